@@ -0,0 +1,627 @@
+#!/usr/bin/env python3
+
+"""Measure the throughput of the crawler against a farm of simulated mirrors.
+
+A synthetic category is created in a temporary SQLite database, and served by local HTTP,
+FTP and rsync stand-ins with configurable latency, error rates and staleness. Then
+``mm2_crawler`` is run against them in a child process, and the number of hosts per minute,
+requests per second, database statements and peak memory are reported.
+
+Run it from the root of the repository, for example::
+
+    ./devel/benchmark.py run --hosts 50 --directories 500 --latency 20 -- --threads 20 crawl
+
+The options after ``--`` are passed to ``mm2_crawler`` (``crawl`` if there are none).
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import random
+import resource
+import shlex
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+import sqlalchemy as sa
+
+from mirrormanager2.lib import model, read_config
+from mirrormanager2.lib.database import get_db_manager
+
+PROTOCOLS = ("http", "ftp", "rsync")
+ERRORS = ("403", "404", "421", "timeout")
+TOPDIR = "pub/bench"
+# Modification time of all the files
+MTIME = 1500000000
+# How long a "timeout" error holds the request, longer than the crawler's timeouts
+TIMEOUT_DELAY = 15
+
+FAKE_RSYNC = """\
+#!{python}
+import os, sys
+sys.path.insert(0, {devel!r})
+from benchmark import run_fake_rsync
+sys.exit(run_fake_rsync(sys.argv[-1], os.environ["MM_BENCHMARK_DIR"]))
+"""
+
+
+class MirrorTree:
+    """The directories and files of the synthetic category.
+
+    One directory out of ten is a ``repodata`` directory with a ``repomd.xml`` file, the
+    others are in the ``Packages`` subtrees of the repositories.
+    """
+
+    def __init__(self, directories, files):
+        # Directory name, relative to the top directory -> file name -> size
+        self.directories = {}
+        for index in range(directories):
+            repo = f"repo{index // 10:04}"
+            if index % 10 == 0:
+                name = f"{repo}/repodata"
+                filenames = ["repomd.xml"] + [f"data-{n}.xml.gz" for n in range(files - 1)]
+            else:
+                name = f"{repo}/Packages/p{index % 10}"
+                filenames = [f"package-{index}-{n}.rpm" for n in range(files)]
+            self.directories[name] = {
+                filename: 100 + zlib.crc32(f"{name}/{filename}".encode()) % 10000
+                for filename in filenames
+            }
+        # Directory -> sub-directories, with the intermediate ones
+        self.subdirs = {"": set()}
+        for name in self.directories:
+            parts = name.split("/")
+            for depth in range(1, len(parts) + 1):
+                parent, child = "/".join(parts[: depth - 1]), "/".join(parts[:depth])
+                self.subdirs.setdefault(parent, set()).add(parts[depth - 1])
+                self.subdirs.setdefault(child, set())
+
+    @staticmethod
+    def get_content(path, size):
+        pattern = hashlib.sha256(path.encode()).hexdigest().encode()
+        return (pattern * (size // len(pattern) + 1))[:size]
+
+    def get_file(self, path):
+        """Return the size of the file, or None if it does not exist"""
+        dirname, _sep, filename = path.rpartition("/")
+        return self.directories.get(dirname, {}).get(filename)
+
+    def list_dir(self, path):
+        """Return the files and the sub-directories of a directory, or None if it's missing"""
+        if path not in self.subdirs:
+            return None
+        return self.directories.get(path, {}), sorted(self.subdirs[path])
+
+
+class MirrorFarm:
+    """How the simulated mirrors behave: each host has a path prefix (``/h<ID>``) on the
+    servers."""
+
+    def __init__(self, tree, latency=0, error_rate=0, errors=ERRORS, stale_hosts=0, seed=0):
+        self.tree = tree
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = errors
+        self.stale_hosts = stale_hosts
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = dict.fromkeys(PROTOCOLS, 0)
+
+    def count(self, protocol):
+        with self._lock:
+            self.requests[protocol] += 1
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_error(self, allowed=ERRORS):
+        """Return the error to inject in this request, if any"""
+        with self._lock:
+            if not self.error_rate or self._random.random() >= self.error_rate:
+                return None
+            errors = [error for error in self.errors if error in allowed]
+            return self._random.choice(errors) if errors else None
+
+    def split_path(self, path):
+        """Return the host ID and the path in the tree, or None if it's not in the tree"""
+        host, _sep, rest = path.strip("/").partition("/")
+        if not host.startswith("h") or not host[1:].isdigit():
+            return None, None
+        rest = rest.strip("/")
+        if rest == TOPDIR:
+            return int(host[1:]), ""
+        if not rest.startswith(f"{TOPDIR}/"):
+            return int(host[1:]), None
+        return int(host[1:]), rest[len(TOPDIR) + 1 :]
+
+    def get_size(self, host_id, path, size):
+        """The stale hosts have the wrong size for one file out of ten"""
+        if host_id < self.stale_hosts and zlib.crc32(path.encode()) % 10 == 0:
+            return size + 1
+        return size
+
+
+class MirrorHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body=b"", content_type=None, with_body=True):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def _respond(self, with_body):
+        farm = self.server.farm
+        farm.count("http")
+        farm.wait()
+        error = farm.get_error(("403", "404", "timeout"))
+        if error == "timeout":
+            time.sleep(TIMEOUT_DELAY)
+            self.close_connection = True
+            return
+        if error is not None:
+            self._send(int(error), with_body=with_body)
+            return
+        host_id, path = farm.split_path(self.path.split("?")[0])
+        if path is None:
+            self._send(404, with_body=with_body)
+            return
+        if self.path.endswith("/") or farm.tree.list_dir(path) is not None:
+            listing = farm.tree.list_dir(path)
+            if listing is None:
+                self._send(404, with_body=with_body)
+                return
+            # nginx's JSON autoindex
+            files, dirs = listing
+            entries = [{"name": name, "type": "directory"} for name in dirs]
+            entries.extend(
+                {
+                    "name": name,
+                    "type": "file",
+                    "size": farm.get_size(host_id, posixpath.join(path, name), size),
+                }
+                for name, size in files.items()
+            )
+            body = json.dumps(entries).encode()
+            self._send(200, body, "application/json", with_body)
+            return
+        size = farm.tree.get_file(path)
+        if size is None:
+            self._send(404, with_body=with_body)
+            return
+        body = farm.tree.get_content(path, farm.get_size(host_id, path, size))
+        self._send(200, body, "application/octet-stream", with_body)
+
+    def do_HEAD(self):
+        self._respond(with_body=False)
+
+    def do_GET(self):
+        self._respond(with_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MirrorHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, farm):
+        super().__init__(("127.0.0.1", 0), MirrorHTTPRequestHandler)
+        self.farm = farm
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class MirrorFTPRequestHandler(socketserver.StreamRequestHandler):
+    """The commands of an anonymous FTP server that the crawler uses"""
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def _send_data(self, lines):
+        self._reply("150 Here comes the listing")
+        conn, _addr = self._data_socket.accept()
+        with conn:
+            conn.sendall("".join(f"{line}\r\n" for line in lines).encode())
+        self._data_socket.close()
+        self._reply("226 Transfer complete")
+
+    def _list(self, path):
+        host_id, tree_path = self.server.farm.split_path(path)
+        if tree_path is None:
+            return host_id, None, None
+        listing = self.server.farm.tree.list_dir(tree_path)
+        if listing is None:
+            return host_id, None, None
+        return host_id, tree_path, listing
+
+    def _ls_lines(self, host_id, tree_path, listing):
+        files, dirs = listing
+        lines = [f"drwxr-xr-x    2 ftp      ftp          4096 Jul 05  2017 {d}" for d in dirs]
+        for name, size in files.items():
+            size = self.server.farm.get_size(host_id, posixpath.join(tree_path, name), size)
+            lines.append(f"-rw-r--r--    1 ftp      ftp      {size:>8} Jul 05  2017 {name}")
+        return lines
+
+    def _ls_recursive_lines(self, host_id, tree_path, relative="."):
+        listing = self.server.farm.tree.list_dir(tree_path)
+        lines = [f"{relative}:", *self._ls_lines(host_id, tree_path, listing), ""]
+        for subdir in listing[1]:
+            lines.extend(
+                self._ls_recursive_lines(
+                    host_id, posixpath.join(tree_path, subdir), f"{relative}/{subdir}"
+                )
+            )
+        return lines
+
+    def handle(self):
+        farm = self.server.farm
+        self._cwd = "/"
+        self._data_socket = None
+        if farm.get_error(("421",)):
+            self._reply("421 Too many users, try again later")
+            return
+        self._reply("220 Fake mirror")
+        for raw_line in self.rfile:
+            command, _sep, arg = raw_line.decode().strip().partition(" ")
+            command = command.upper()
+            farm.count("ftp")
+            farm.wait()
+            if command == "USER":
+                self._reply("331 Please specify the password")
+            elif command == "PASS":
+                self._reply("230 Login successful")
+            elif command == "FEAT":
+                self._reply("211-Features:\r\n MLST type*;size*;modify*;\r\n PASV\r\n211 End")
+            elif command == "TYPE":
+                self._reply("200 Switching mode")
+            elif command == "PWD":
+                self._reply(f'257 "{self._cwd}"')
+            elif command == "CWD":
+                path = posixpath.normpath(posixpath.join(self._cwd, arg or "."))
+                if self._list(path)[2] is None:
+                    self._reply("550 Failed to change directory")
+                else:
+                    self._cwd = path
+                    self._reply("250 Directory successfully changed")
+            elif command == "PASV":
+                self._data_socket = socket.create_server(("127.0.0.1", 0))
+                port = self._data_socket.getsockname()[1]
+                self._reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF})")
+            elif command in ("LIST", "MLSD"):
+                options = [a for a in arg.split() if a.startswith("-")]
+                path = " ".join(a for a in arg.split() if not a.startswith("-"))
+                path = posixpath.normpath(posixpath.join(self._cwd, path or "."))
+                host_id, tree_path, listing = self._list(path)
+                if listing is None:
+                    self._data_socket.close()
+                    self._reply("550 No such directory")
+                elif command == "MLSD":
+                    files, dirs = listing
+                    lines = [f"type=dir; {d}" for d in dirs]
+                    for name, size in files.items():
+                        size = farm.get_size(host_id, posixpath.join(tree_path, name), size)
+                        lines.append(f"type=file;size={size}; {name}")
+                    self._send_data(lines)
+                elif "-R" in options:
+                    self._send_data(self._ls_recursive_lines(host_id, tree_path))
+                else:
+                    self._send_data(self._ls_lines(host_id, tree_path, listing))
+            elif command == "QUIT":
+                self._reply("221 Goodbye")
+                return
+            else:
+                self._reply("500 Unknown command")
+
+
+class MirrorFTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, farm):
+        super().__init__(("127.0.0.1", 0), MirrorFTPRequestHandler)
+        self.farm = farm
+
+    @property
+    def url(self):
+        return f"ftp://127.0.0.1:{self.server_address[1]}"
+
+
+def write_rsync_listings(farm, hosts, directory):
+    """Write the rsync listing of each host, for the fake rsync command"""
+    for host_id in range(hosts):
+        lines = ["drwxr-xr-x 4,096 2017/07/05 10:00:00 ."]
+        for dirname in sorted(farm.tree.subdirs):
+            if not dirname:
+                continue
+            lines.append(f"drwxr-xr-x 4,096 2017/07/05 10:00:00 {dirname}")
+            for filename, size in farm.tree.directories.get(dirname, {}).items():
+                size = farm.get_size(host_id, f"{dirname}/{filename}", size)
+                lines.append(f"-rw-r--r-- {size:,} 2017/07/05 10:00:00 {dirname}/{filename}")
+        with open(os.path.join(directory, f"h{host_id}.listing"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    with open(os.path.join(directory, "farm.json"), "w") as f:
+        json.dump(
+            {
+                "latency": farm.latency,
+                "error_rate": farm.error_rate,
+                "errors": [e for e in farm.errors if e in ("421", "timeout")],
+            },
+            f,
+        )
+
+
+def run_fake_rsync(url, directory):
+    """Stand-in for the rsync command, print the listing of the host of the URL"""
+    with open(os.path.join(directory, "farm.json")) as f:
+        settings = json.load(f)
+    with open(os.path.join(directory, "requests"), "a") as f:
+        f.write("1")
+    time.sleep(settings["latency"])
+    if settings["errors"] and random.random() < settings["error_rate"]:
+        if random.choice(settings["errors"]) == "timeout":
+            time.sleep(TIMEOUT_DELAY)
+        # "Error starting client-server protocol"
+        return 5
+    host = url.split("://", 1)[-1].split("/")[1]
+    try:
+        with open(os.path.join(directory, f"{host}.listing")) as f:
+            sys.stdout.write(f.read())
+    except FileNotFoundError:
+        # "Error in socket I/O", like a missing module
+        return 10
+    return 0
+
+
+def install_fake_rsync(directory):
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir)
+    path = os.path.join(bin_dir, "rsync")
+    with open(path, "w") as f:
+        f.write(
+            FAKE_RSYNC.format(
+                python=sys.executable, devel=os.path.dirname(os.path.abspath(__file__))
+            )
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return bin_dir
+
+
+def populate(session, tree, hosts, urls, protocols):
+    """Create the category, its directories and the hosts in the database.
+
+    :arg urls: the base URL of each protocol
+    :arg protocols: the protocols that the hosts are crawled with, in turn
+    """
+    product = model.Product(name="Bench")
+    topdir = model.Directory(name=TOPDIR, readable=True, files={}, ctime=MTIME)
+    category = model.Category(name="Bench", product=product, topdir=topdir)
+    session.add_all([product, topdir, category])
+    category.directories.append(topdir)
+    for name, files in tree.directories.items():
+        directory = model.Directory(
+            name=f"{TOPDIR}/{name}",
+            readable=True,
+            ctime=MTIME,
+            files={
+                filename: {"size": size, "stat": MTIME - index}
+                for index, (filename, size) in enumerate(files.items())
+            },
+        )
+        category.directories.append(directory)
+        if "repomd.xml" in files:
+            session.flush()
+            content = tree.get_content(f"{name}/repomd.xml", files["repomd.xml"])
+            session.add(
+                model.FileDetail(
+                    directory_id=directory.id,
+                    filename="repomd.xml",
+                    timestamp=MTIME,
+                    size=len(content),
+                    sha256=hashlib.sha256(content).hexdigest(),
+                )
+            )
+    site = model.Site(name="Bench", created_by="benchmark")
+    session.add(site)
+    for host_id in range(hosts):
+        host = model.Host(name=f"mirror{host_id}.example.com", site=site, country="US")
+        host_category = model.HostCategory(host=host, category=category)
+        session.add_all([host, host_category])
+        # The crawler checks the HTTP URL before crawling with the preferred one
+        for base_url in {urls["http"], urls[protocols[host_id % len(protocols)]]}:
+            session.add(
+                model.HostCategoryUrl(
+                    host_category=host_category,
+                    url=f"{base_url}/h{host_id}/{TOPDIR}",
+                    private=False,
+                )
+            )
+    session.commit()
+
+
+def get_metrics_total(summary, name):
+    return sum(
+        values.get(name, 0) for host in summary["hosts"].values() for values in host.values()
+    )
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command(context_settings={"ignore_unknown_options": True})
+@click.option("--hosts", type=int, default=20, help="Number of simulated mirrors")
+@click.option("--directories", type=int, default=200, help="Directories in the category")
+@click.option("--files", type=int, default=10, help="Files in each directory")
+@click.option(
+    "--protocols",
+    default="http",
+    help="Comma-separated protocols of the mirrors, used in turn (http, ftp, rsync)",
+)
+@click.option("--latency", type=float, default=0, help="Latency of each response, in ms")
+@click.option("--error-rate", type=float, default=0, help="Fraction of the requests that fail")
+@click.option(
+    "--errors",
+    default="403,404,421,timeout",
+    help="Comma-separated errors to inject (403, 404, 421, timeout)",
+)
+@click.option("--stale", type=float, default=0, help="Fraction of the mirrors that are stale")
+@click.option("--seed", type=int, default=0, help="Seed of the injected errors")
+@click.option("--output", type=click.Path(), help="Also write the results to this JSON file")
+@click.argument("crawler_args", nargs=-1, type=click.UNPROCESSED)
+def run(
+    hosts,
+    directories,
+    files,
+    protocols,
+    latency,
+    error_rate,
+    errors,
+    stale,
+    seed,
+    output,
+    crawler_args,
+):
+    """Crawl the simulated mirrors and report the throughput"""
+    protocols = protocols.split(",")
+    errors = errors.split(",")
+    for value, allowed in ((protocols, PROTOCOLS), (errors, ERRORS)):
+        unknown = set(value) - set(allowed)
+        if unknown:
+            raise click.BadParameter(f"Unknown values: {', '.join(sorted(unknown))}")
+    tree = MirrorTree(directories, files)
+    farm = MirrorFarm(
+        tree,
+        latency=latency / 1000,
+        error_rate=error_rate,
+        errors=errors,
+        stale_hosts=int(hosts * stale),
+        seed=seed,
+    )
+    with tempfile.TemporaryDirectory(prefix="mm2-benchmark-") as directory:
+        config_path = os.path.join(directory, "mirrormanager2.cfg")
+        metrics_path = os.path.join(directory, "metrics.json")
+        with open(config_path, "w") as f:
+            f.write(
+                f"SQLALCHEMY_DATABASE_URI = 'sqlite:///{directory}/mirrormanager2.sqlite'\n"
+                f"CRAWLER_METRICS_JSON = {metrics_path!r}\n"
+                f"MM_LOG_DIR = {directory!r}\n"
+            )
+        # For the database migrations
+        os.environ["MM2_CONFIG"] = config_path
+        config = read_config(config_path)
+        db_manager = get_db_manager(config)
+        db_manager.sync()
+        servers = [MirrorHTTPServer(farm), MirrorFTPServer(farm)]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = {
+            "http": servers[0].url,
+            "ftp": servers[1].url,
+            "rsync": "rsync://127.0.0.1",
+        }
+        with db_manager.Session() as session:
+            populate(session, tree, hosts, urls, protocols)
+        write_rsync_listings(farm, hosts, directory)
+        env = dict(
+            os.environ,
+            PATH=f"{install_fake_rsync(directory)}:{os.environ['PATH']}",
+            MM_BENCHMARK_DIR=directory,
+        )
+        stats_path = os.path.join(directory, "stats.json")
+        cmd = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "crawler",
+            stats_path,
+            "--config",
+            config_path,
+            *(crawler_args or ["crawl"]),
+        ]
+        click.echo(f"Running mm2_crawler {shlex.join(cmd[6:])} against {hosts} mirrors", err=True)
+        start = time.monotonic()
+        process = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=False)
+        wall_time = time.monotonic() - start
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if process.returncode != 0:
+            raise click.ClickException(f"The crawler failed with code {process.returncode}")
+
+        with open(stats_path) as f:
+            stats = json.load(f)
+        try:
+            with open(metrics_path) as f:
+                summary = json.load(f)
+        except FileNotFoundError:
+            summary = {"run": {}, "hosts": {}}
+        try:
+            with open(os.path.join(directory, "requests")) as f:
+                farm.requests["rsync"] = len(f.read())
+        except FileNotFoundError:
+            pass
+    duration = stats["duration"]
+    requests = int(get_metrics_total(summary, "requests_total"))
+    results = {
+        "hosts": hosts,
+        "directories": directories,
+        "files": files,
+        "duration_seconds": round(duration, 3),
+        "wall_time_seconds": round(wall_time, 3),
+        "hosts_per_minute": round(hosts / duration * 60, 1),
+        "requests": requests,
+        "requests_per_second": round(requests / duration, 1),
+        "server_requests": farm.requests,
+        "db_statements": stats["statements"],
+        # In KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    for key, value in results.items():
+        click.echo(f"{key}: {value}")
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+@main.command(hidden=True, context_settings={"ignore_unknown_options": True})
+@click.argument("stats_path")
+@click.argument("crawler_args", nargs=-1, type=click.UNPROCESSED)
+def crawler(stats_path, crawler_args):
+    """Run mm2_crawler and count its database statements"""
+    from mirrormanager2.crawler.cli import main as crawler_main
+
+    statements = 0
+
+    def _count(*args):
+        nonlocal statements
+        statements += 1
+
+    # The statements of the forked processes (--processes) are not counted
+    sa.event.listen(sa.engine.Engine, "before_cursor_execute", _count)
+    start = time.monotonic()
+    try:
+        crawler_main.main(list(crawler_args), prog_name="mm2_crawler", standalone_mode=False)
+    finally:
+        with open(stats_path, "w") as f:
+            json.dump({"statements": statements, "duration": time.monotonic() - start}, f)
+
+
+if __name__ == "__main__":
+    main()
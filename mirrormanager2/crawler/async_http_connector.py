@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import suppress
+
+import aiohttp
+
+from .connector import FetchingFailed, TryLater
+from .constants import CONNECTION_TIMEOUT, REPODATA_FILE
+from .http_connector import HEADERS, HTTPConnector
+from .metrics import metrics
+from .sampling import order_files
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncHTTPSession:
+    """An aiohttp session running in its own event loop.
+
+    The crawler workers are threads, each host gets its own loop that is driven
+    from the worker thread with :meth:`run`.
+    """
+
+    def __init__(self, max_connections):
+        self.loop = asyncio.new_event_loop()
+        self.max_connections = max_connections
+        self.session, self.semaphore = self.run(self._setup())
+
+    async def _setup(self):
+        # Those must be created from within the loop
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_connections)
+        session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=CONNECTION_TIMEOUT),
+            trace_configs=[self._get_trace_config()],
+        )
+        return session, asyncio.Semaphore(self.max_connections)
+
+    @staticmethod
+    def _get_trace_config():
+        """Measure the DNS resolutions and the new connections (with the TLS handshake)"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def _start(session, context, params):
+            context.start = time.monotonic()
+
+        async def _dns_end(session, context, params):
+            metrics.observe("dns_duration_seconds", time.monotonic() - context.start)
+
+        async def _connection_end(session, context, params):
+            metrics.inc("connections_total", protocol="http")
+            metrics.observe(
+                "connect_duration_seconds", time.monotonic() - context.start, protocol="http"
+            )
+
+        trace_config.on_dns_resolvehost_start.append(_start)
+        trace_config.on_dns_resolvehost_end.append(_dns_end)
+        trace_config.on_connection_create_start.append(_start)
+        trace_config.on_connection_create_end.append(_connection_end)
+        return trace_config
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def close(self):
+        try:
+            self.run(self.session.close())
+        finally:
+            self.loop.close()
+
+
+class AsyncHTTPConnector(HTTPConnector):
+    """Check files with concurrent HEAD requests.
+
+    At most ``max_connections`` requests are in flight at the same time for a
+    host, and the checks are cancelled as soon as one file is found to be
+    missing or unreadable.
+    """
+
+    def _connect(self):
+        return AsyncHTTPSession(self.max_connections)
+
+    def _close(self):
+        self._connection.close()
+
+    def check_url(self, url):
+        conn = self.get_connection()
+
+        async def _head():
+            async with conn.session.head(url, allow_redirects=False) as response:
+                return response.ok
+
+        return conn.run(_head())
+
+    async def _async_check_file(self, conn, url, filedata, readable):
+        """See HTTPConnector._check_file() for the return values."""
+        async with conn.semaphore:
+            try:
+                with self._measure_request("HEAD"):
+                    async with conn.session.head(url, allow_redirects=False) as response:
+                        status_code = response.status
+                        headers = response.headers
+            except asyncio.TimeoutError as e:
+                raise TryLater(f"HTTP timeout on {url}") from e
+            except aiohttp.ClientError as e:
+                logger.debug("Could not get the content length for %s: %s", url, e)
+                return None
+        return self._check_response(url, status_code, headers, filedata, readable)
+
+    async def _async_check_files(self, conn, url, files, readable):
+        """Check all the files of a directory concurrently.
+
+        Returns the status of the directory, and the SHA256 checksum of the repomd.xml file
+        if there is one and it is present on the mirror.
+        """
+
+        async def _check(filename):
+            file_url = f"{url}/{filename}"
+            exists = await self._async_check_file(conn, file_url, files[filename], readable)
+            checksum = None
+            if filename == REPODATA_FILE and exists:
+                # Additional optional check
+                try:
+                    checksum = await self._async_get_sha256(conn, file_url)
+                except FetchingFailed:
+                    # Like Connector.compare_sha256()
+                    logger.debug("Could not get %s", file_url)
+                    return False, None
+                except Exception:
+                    pass
+            return exists, checksum
+
+        tasks = [asyncio.ensure_future(_check(filename)) for filename in files]
+        repomd_checksum = None
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                exists, checksum = await next_result
+                if exists in (False, None):
+                    # Shortcut: we don't need to wait for the other files
+                    return exists, None
+                if checksum is not None:
+                    repomd_checksum = checksum
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return True, repomd_checksum
+
+    def _check_dir(self, url, directory):
+        try:
+            conn = self.get_connection()
+        except Exception as e:
+            logger.info(f"Could not get {url}: {e}")
+            return None
+        if not directory.files:
+            return True
+        listed = self._check_listing(url, directory)
+        if listed is False:
+            return False
+        # The requests are started in this order
+        files = {
+            filename: filedata
+            for filename, filedata in order_files(directory.files)
+            if filename not in listed
+        }
+        status, repomd_checksum = conn.run(
+            self._async_check_files(conn, url, files, directory.readable)
+        )
+        if status is True and REPODATA_FILE in listed:
+            repomd_url = f"{url}/{REPODATA_FILE}"
+            try:
+                repomd_checksum = conn.run(self._async_get_sha256(conn, repomd_url))
+            except FetchingFailed:
+                logger.debug("Could not get %s", repomd_url)
+                return False
+            except Exception:
+                pass
+        if repomd_checksum is not None:
+            with suppress(Exception):
+                status = self._compare_checksum(directory, REPODATA_FILE, repomd_checksum)
+        return status
+
+    async def _async_get_listing(self, conn, url):
+        async with conn.semaphore:
+            with self._measure_request("GET"):
+                async with conn.session.get(url) as response:
+                    body = await response.read()
+                    text = await response.text()
+            self._count_received(len(body))
+            return response.status, response.headers.get("Content-Type"), text
+
+    def _get_listing(self, url):
+        conn = self.get_connection()
+        return conn.run(self._async_get_listing(conn, url))
+
+    async def _async_get_file_conditional(self, conn, url, headers=None):
+        """See HTTPConnector._get_file_conditional() for the return values."""
+        async with conn.semaphore:
+            try:
+                with self._measure_request("GET"):
+                    async with conn.session.get(url, headers=headers) as response:
+                        if response.status == 304:
+                            return response.status, response.headers, None
+                        if not response.ok:
+                            raise FetchingFailed(response)
+                        content = await response.read()
+                self._count_received(len(content))
+                return response.status, response.headers, content
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise FetchingFailed() from e
+
+    async def _async_get_file(self, conn, url):
+        status_code, headers, contents = await self._async_get_file_conditional(conn, url)
+        return contents
+
+    async def _async_get_sha256(self, conn, url):
+        contents = await self._async_get_file(conn, url)
+        return hashlib.sha256(contents).hexdigest()
+
+    def _get_file_conditional(self, url, headers=None):
+        conn = self.get_connection()
+        return conn.run(self._async_get_file_conditional(conn, url, headers))
+
+
+class AsyncHTTPSConnector(AsyncHTTPConnector):
+    scheme = "https"
@@ -0,0 +1,195 @@
+import dataclasses
+import json
+import logging
+import math
+import re
+from html.parser import HTMLParser
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__)
+
+# Sizes as displayed in the autoindex pages: 1234, 1.2K, 12M, 1.5GiB...
+SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)([KMGTP]?)(?:i?B)?$", re.IGNORECASE)
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4, "P": 1024**5}
+
+
+@dataclasses.dataclass(frozen=True)
+class ListedFile:
+    """A file in a directory index page.
+
+    The size may be rounded by the web server (``1.2K``), ``tolerance`` is the precision of the
+    displayed size.
+    """
+
+    size: int
+    tolerance: int = 0
+
+    def matches(self, size):
+        return abs(float(size) - self.size) <= self.tolerance
+
+
+def parse_size(text):
+    match = SIZE_RE.match(text.replace(",", ""))
+    if match is None:
+        return None
+    number, unit = match.groups()
+    factor = UNITS[unit.upper()]
+    if factor == 1 and "." not in number:
+        return ListedFile(size=int(number))
+    decimals = len(number.partition(".")[2])
+    # The web servers round up or down, allow one step in both directions
+    return ListedFile(
+        size=round(float(number) * factor), tolerance=math.ceil(factor / 10**decimals)
+    )
+
+
+def detect_autoindex_format(content_type, body):
+    """Guess which web server generated a directory index page.
+
+    :returns: one of ``json``, ``apache``, ``lighttpd``, ``nginx``, or None if the page is not
+        a known directory index.
+    """
+    if "json" in (content_type or "") or body.lstrip().startswith("["):
+        return "json"
+    if "Index of " not in body:
+        return None
+    if 'class="s"' in body and ("lighttpd" in body or 'class="list"' in body):
+        return "lighttpd"
+    if "?C=N;O=D" in body or "<address>Apache" in body:
+        return "apache"
+    if "<pre>" in body:
+        return "nginx"
+    return None
+
+
+class _IndexParser(HTMLParser):
+    """Collect the links of a directory index page and the text that follows each of them.
+
+    The text after a link holds the modification time and the size, either in the following
+    cells of a table row (Apache, lighttpd) or on the rest of the line (nginx, Apache). Each
+    entry has the list of the cells that follow the link, as ``(attributes, text)``; the text
+    that is not in a cell of its own, like the rest of the line, goes to the first one.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries = []
+        self._current = None
+        self._in_link = False
+        self._in_row = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            self._current = None
+            if href is not None:
+                self._current = (href, [({}, [])])
+                self.entries.append(self._current)
+                self._in_link = True
+        elif tag == "tr":
+            self._current = None
+            self._in_row = True
+        elif tag == "td" and self._current is not None:
+            self._current[1].append((dict(attrs), []))
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._in_link = False
+        elif tag in ("tr", "pre", "table"):
+            self._current = None
+            self._in_row = False
+
+    def handle_data(self, data):
+        if self._current is None or self._in_link:
+            return
+        texts = self._current[1][-1][1]
+        if self._in_row:
+            texts.append(data)
+            return
+        # In the <pre> pages, the line ends with the entry
+        data, newline, _rest = data.partition("\n")
+        texts.append(data)
+        if newline:
+            self._current = None
+
+
+def _get_tokens(cells):
+    return " ".join("".join(texts) for _attrs, texts in cells).split()
+
+
+def _get_nginx_size(cells):
+    # The size ends the line
+    tokens = _get_tokens(cells)
+    return tokens[-1] if tokens else None
+
+
+def _get_apache_size(cells):
+    # The size follows the date and time, and may be followed by a description
+    tokens = _get_tokens(cells)
+    return tokens[2] if len(tokens) > 2 else None
+
+
+def _get_lighttpd_size(cells):
+    for attrs, texts in cells:
+        if attrs.get("class") == "s":
+            return "".join(texts).strip()
+    return None
+
+
+SIZE_GETTERS = {
+    "apache": _get_apache_size,
+    "lighttpd": _get_lighttpd_size,
+    "nginx": _get_nginx_size,
+}
+
+
+def _get_filename(href):
+    if href.startswith(("?", "/", "#", "../")) or "://" in href:
+        return None
+    if href.startswith("./"):
+        href = href[2:]
+    name = unquote(href)
+    if not name or "/" in name:
+        # Sub-directories
+        return None
+    return name
+
+
+def _parse_html(body, get_size):
+    parser = _IndexParser()
+    parser.feed(body)
+    parser.close()
+    listing = {}
+    for href, cells in parser.entries:
+        name = _get_filename(href)
+        if name is None:
+            continue
+        size = get_size(cells)
+        listed_file = parse_size(size) if size else None
+        if listed_file is not None:
+            listing[name] = listed_file
+    return listing
+
+
+def _parse_json(body):
+    listing = {}
+    for entry in json.loads(body):
+        if entry.get("type") != "file" or "size" not in entry:
+            continue
+        listing[entry["name"]] = ListedFile(size=int(entry["size"]))
+    return listing
+
+
+def parse_autoindex(body, autoindex_format):
+    """Parse a directory index page.
+
+    :returns: a dict of the names of the files in the directory to :class:`ListedFile`, or
+        None if the page could not be parsed. The sub-directories are not listed.
+    """
+    try:
+        if autoindex_format == "json":
+            return _parse_json(body)
+        return _parse_html(body, SIZE_GETTERS[autoindex_format])
+    except Exception as e:
+        logger.debug("Could not parse the %s directory index: %s", autoindex_format, e)
+        return None
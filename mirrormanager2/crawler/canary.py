@@ -0,0 +1,206 @@
+import asyncio
+import dataclasses
+import datetime
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import mirrormanager2.lib as mmlib
+
+from .async_http_connector import AsyncHTTPSession
+from .constants import CONNECTION_TIMEOUT
+from .crawler import (
+    CANARY_FAILED_DETAILS,
+    GLOBAL_TIMEOUT_DETAILS,
+    HOST_TIMEOUT_DETAILS,
+    CrawlResult,
+    sort_urls,
+)
+from .http_connector import HEADERS
+from .metrics import metrics
+from .states import CrawlStatus
+
+logger = logging.getLogger(__name__)
+
+CANARY_ENGINES = ("threads", "asyncio")
+
+
+@dataclasses.dataclass
+class CanaryHost:
+    id: int
+    name: str
+    max_connections: int = 1
+    # The HTTP URLs of each category, preferred first
+    categories: list = dataclasses.field(default_factory=list)
+    # One of the categories is always up to date, nothing to check
+    always_up2date: bool = False
+
+    @classmethod
+    def load(cls, session, host_ids, category_ids=None):
+        """Return the hosts, in the order of ``host_ids``, with the URLs of their categories"""
+        hosts = {}
+        urls = {}
+        for row in mmlib.get_host_category_urls(session, host_ids, category_ids):
+            host = hosts.get(row.host_id)
+            if host is None:
+                host = hosts[row.host_id] = cls(
+                    id=row.host_id, name=row.host_name, max_connections=row.max_connections
+                )
+            if row.host_category_id is None:
+                continue
+            if row.always_up2date:
+                host.always_up2date = True
+            category_urls = urls.setdefault((host.id, row.host_category_id), [])
+            if row.url is not None:
+                category_urls.append(row.url)
+        for (host_id, _hc_id), category_urls in urls.items():
+            # Like Crawler.check_for_base_dir(), only the URLs of the users matter
+            hosts[host_id].categories.append(
+                [url for url in sort_urls(category_urls) if url.startswith(("http:", "https:"))]
+            )
+        return [hosts[host_id] for host_id in host_ids if host_id in hosts]
+
+
+class CanaryEngine:
+    """Check that the mirrors are up, for all the hosts at once.
+
+    This is what ``mm2_crawler crawl --canary`` does, without a thread, a database session
+    and a crawler per host: a host is up if the base URL of one of its categories answers a
+    HEAD request. All the requests are sent from a single event loop, for at most
+    ``concurrency`` hosts at a time, and at most ``max_connections`` requests at a time to
+    each host.
+
+    When a URL can't be reached, the other URLs of the same host and netloc are not tried.
+    """
+
+    def __init__(self, concurrency=100, get_timeout=None):
+        self.concurrency = concurrency
+        # Host ID -> timeout in seconds, or None
+        self.get_timeout = get_timeout or (lambda host_id: None)
+
+    def run(self, hosts, timeout=None, on_result=None):
+        """Check the hosts, return the CrawlResults and whether the global timeout was reached.
+
+        :arg on_result: called with each CrawlResult as soon as it is known
+        """
+        return asyncio.run(self._run(hosts, timeout, on_result))
+
+    async def _run(self, hosts, timeout, on_result):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=None)
+        async with aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=CONNECTION_TIMEOUT),
+            trace_configs=[AsyncHTTPSession._get_trace_config()],
+        ) as session:
+
+            async def _check(host):
+                result = await self._check_host(session, host)
+                if on_result is not None:
+                    on_result(result)
+                return result
+
+            tasks = {asyncio.ensure_future(_check(host)): host for host in hosts}
+            if not tasks:
+                return [], False
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        results = []
+        for task, host in tasks.items():
+            if task in done:
+                results.append(task.result())
+            else:
+                logger.info(
+                    "Host %s (%s) was not checked before the global timeout", host.id, host.name
+                )
+                results.append(self._make_result(host, CrawlStatus.UNKNOWN, GLOBAL_TIMEOUT_DETAILS))
+        return results, bool(pending)
+
+    def _make_result(self, host, status, details=None, duration=0):
+        return CrawlResult(
+            host_id=host.id,
+            host_name=host.name,
+            status=status.value,
+            details=details,
+            finished_at=datetime.datetime.now(tz=datetime.timezone.utc),
+            duration=duration,
+        )
+
+    async def _check_host(self, session, host):
+        if not host.categories and not host.always_up2date:
+            logger.info("No categories to crawl on host %s (%s)", host.id, host.name)
+            return self._make_result(host, CrawlStatus.UNKNOWN)
+        async with self._semaphore:
+            start = time.monotonic()
+            try:
+                if host.always_up2date:
+                    status = CrawlStatus.OK
+                elif await asyncio.wait_for(
+                    self._check_categories(session, host), self.get_timeout(host.id)
+                ):
+                    status = CrawlStatus.OK
+                else:
+                    logger.info("All categories failed on host %s (%s)", host.id, host.name)
+                    return self._make_result(
+                        host, CrawlStatus.FAILURE, CANARY_FAILED_DETAILS, time.monotonic() - start
+                    )
+            except asyncio.TimeoutError:
+                logger.info("Host %s (%s) timed out", host.id, host.name)
+                return self._make_result(
+                    host, CrawlStatus.TIMEOUT, HOST_TIMEOUT_DETAILS, time.monotonic() - start
+                )
+            except Exception:
+                logger.exception("Unhandled exception raised, this is a bug in the MM crawler.")
+                return self._make_result(host, CrawlStatus.UNKNOWN, None, time.monotonic() - start)
+            return self._make_result(host, status, None, time.monotonic() - start)
+
+    async def _check_categories(self, session, host):
+        """Return True as soon as the base URL of one of the categories exists"""
+        semaphore = asyncio.Semaphore(max(1, host.max_connections))
+        unreachable = set()
+
+        async def _check_category(urls):
+            for url in urls:
+                if await self._check_url(session, host, url, semaphore, unreachable):
+                    return True
+            return False
+
+        tasks = [asyncio.ensure_future(_check_category(urls)) for urls in host.categories]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                if await next_result:
+                    # Shortcut: we don't need to wait for the other categories
+                    return True
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return False
+
+    async def _check_url(self, session, host, url, semaphore, unreachable):
+        netloc = urlsplit(url)[:2]
+        async with semaphore:
+            if netloc in unreachable:
+                return False
+            try:
+                metrics.inc("requests_total", protocol="http", method="HEAD", host=host.name)
+                with metrics.timer(
+                    "request_duration_seconds", protocol="http", method="HEAD", host=host.name
+                ):
+                    async with session.head(url, allow_redirects=False) as response:
+                        exists = response.ok
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                unreachable.add(netloc)
+                logger.info("Could not get the base dir of %s on %s: %r", host.name, url, e)
+                return False
+            except aiohttp.ClientError as e:
+                logger.info("Could not get the base dir of %s on %s: %r", host.name, url, e)
+                return False
+        if not exists:
+            logger.warning("Base URL %s of %s does not exist.", url, host.name)
+        return exists
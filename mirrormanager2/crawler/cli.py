@@ -8,16 +8,34 @@ import click
 from rich.console import Console
 from rich.progress import Progress
 
-from mirrormanager2.lib import get_categories, get_category_by_name, get_mirrors, model, read_config
-from mirrormanager2.lib.database import get_db_manager
+from mirrormanager2.lib import (
+    get_categories,
+    get_category_by_name,
+    get_crawl_histories,
+    get_mirrors,
+    model,
+    read_config,
+)
 from mirrormanager2.lib.fedora import get_current_versions
 
+from .canary import CANARY_ENGINES, CanaryEngine, CanaryHost
+from .connection_pool import HTTP_ENGINES
 from .constants import CONTINENTS, DEFAULT_GLOBAL_TIMEOUT
-from .crawler import PropagationResult, worker
+from .crawler import CrawlResult, PropagationResult, WorkerContext, worker
+from .database import get_crawler_db_manager, record_pool_metrics
+from .http_pool import SharedHTTPPool
+from .leases import LeaseManager
 from .log import setup_logging
+from .memory import MemoryCeiling
+from .metrics import metrics
+from .processes import WorkerProcesses
+from .propagation import ChecksumIndex, PropagationCache
 from .reporter import store_crawl_result
+from .scheduler import Schedule, get_run_mode
+from .snapshot import CrawlSnapshot
 from .threads import GlobalTimeoutError, run_in_threadpool
 from .ui import human_duration, report_crawl, report_propagation
+from .writer import DatabaseWriter
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +87,16 @@ def validate_continents(ctx, param, value):
     help="max threads to start in parallel",
     show_default=True,
 )
+@click.option(
+    "--processes",
+    type=int,
+    default=1,
+    help=(
+        "Number of processes to share the hosts and the threads between, balanced by the "
+        "predicted duration of the hosts"
+    ),
+    show_default=True,
+)
 @click.option(
     "--global-timeout",
     "global_timeout",
@@ -147,7 +175,8 @@ def main(ctx, config, debug, include_disabled, categories, startid, stopid, frac
     ctx.obj["options"] = ctx.params
     config = read_config(config)
     ctx.obj["config"] = config
-    db_manager = get_db_manager(config)
+    # The engine and its connection pool are shared by all the threads
+    db_manager = get_crawler_db_manager(config, threads=kwargs["threads"])
     with db_manager.Session() as session:
         category_ids = []
         for category_name in categories:
@@ -160,6 +189,7 @@ def main(ctx, config, debug, include_disabled, categories, startid, stopid, frac
                     f"Available categories: {available_categories}",
                 )
             category_ids.append(category.id)
+        ctx.obj["category_ids"] = category_ids
         # Get *all* of the mirrors
         hosts = get_mirrors(
             session,
@@ -202,23 +232,148 @@ def main(ctx, config, debug, include_disabled, categories, startid, stopid, frac
     os.chdir("/var/tmp")
 
 
+def build_snapshot(ctx_obj, options, host_ids):
+    """Load the directories of the crawled categories once for all the threads"""
+    if options.get("propagation") or options["canary"]:
+        # Those don't look at the directories
+        return None
+    starttime = time.monotonic()
+    db_manager = get_crawler_db_manager(ctx_obj["config"])
+    with db_manager.Session() as session:
+        snapshot = CrawlSnapshot.build(
+            session,
+            host_ids,
+            category_ids=ctx_obj["category_ids"],
+            only_repodata=options["repodata"],
+            with_continents=bool(options["continents"]),
+            max_directories=ctx_obj["config"].get("CRAWLER_SNAPSHOT_MAX_DIRECTORIES", 10000),
+        )
+    logger.info(
+        "Loaded %s directories from %s categories in %s",
+        sum(len(category.directories) for category in snapshot.categories.values()),
+        len(snapshot.categories),
+        human_duration(time.monotonic() - starttime),
+    )
+    return snapshot
+
+
+def load_propagation_cache(ctx_obj, options):
+    """Load the ETags and checksums of the repomd.xml files seen in the previous runs"""
+    path = ctx_obj["config"].get("CRAWLER_PROPAGATION_CACHE")
+    if not options.get("propagation") or not path:
+        return None
+    cache = PropagationCache.load(path)
+    logger.debug("Loaded %s repomd.xml files from the propagation cache", len(cache))
+    return cache
+
+
+def build_checksum_index(ctx_obj, options):
+    """Load the recent checksums of the repomd.xml files once for all the threads"""
+    if not options.get("propagation"):
+        return None
+    config = ctx_obj["config"]
+    db_manager = get_crawler_db_manager(config)
+    with db_manager.Session() as session:
+        index = ChecksumIndex.build(
+            session, options["product_versions"], max_stale_days=config["MAX_STALE_DAYS"]
+        )
+    logger.debug("Loaded the checksums history of %s repodata directories", len(index))
+    return index
+
+
+def build_schedule(ctx_obj, options, host_ids):
+    """Order the hosts by their predicted crawl duration, longest first"""
+    config = ctx_obj["config"]
+    db_manager = get_crawler_db_manager(config)
+    with db_manager.Session() as session:
+        histories = get_crawl_histories(session, host_ids)
+    schedule = Schedule.build(config, options, histories, host_ids)
+    host_names = {host.id: host.name for host in ctx_obj["hosts"]}
+    logger.debug(
+        "Expected run duration: %s", human_duration(schedule.get_makespan(options["threads"]))
+    )
+    for estimate, end in schedule.get_expected_overruns(
+        options["threads"], options["global_timeout"]
+    ):
+        logger.warning(
+            "Host %s (%s) is expected to end after the global timeout: predicted duration %s, "
+            "expected to end after %s",
+            host_names.get(estimate.host_id),
+            estimate.host_id,
+            human_duration(schedule.get_duration(estimate)),
+            human_duration(end),
+        )
+    return schedule
+
+
+def write_metrics(ctx_obj, options, host_count, duration):
+    config = ctx_obj["config"]
+    mode = get_run_mode(options)
+    metrics.set("run_duration_seconds", duration, mode=mode)
+    metrics.set("run_hosts", host_count, mode=mode)
+    metrics.set("last_run_timestamp_seconds", time.time(), mode=mode)
+    record_pool_metrics()
+    metrics.write(
+        textfile_path=config.get("CRAWLER_METRICS_TEXTFILE"),
+        json_path=config.get("CRAWLER_METRICS_JSON"),
+    )
+
+
 def run_on_all_hosts(ctx_obj, options, report):
     logger.debug("Run with option: %s", repr(options))
     starttime = time.monotonic()
-    host_ids = [host.id for host in ctx_obj["hosts"]]
+    metrics.reset()
+    schedule = build_schedule(ctx_obj, options, [host.id for host in ctx_obj["hosts"]])
+    host_ids = schedule.host_ids
+    context = WorkerContext(
+        options=options,
+        config=ctx_obj["config"],
+        progress=None,
+        snapshot=build_snapshot(ctx_obj, options, host_ids),
+        propagation_cache=load_propagation_cache(ctx_obj, options),
+        checksum_index=build_checksum_index(ctx_obj, options),
+        schedule=schedule,
+        leases=(
+            LeaseManager.from_options(ctx_obj["config"], options)
+            if options.get("work_queue")
+            else None
+        ),
+        writer=(
+            DatabaseWriter.from_options(ctx_obj["config"], options)
+            if options.get("db_writer")
+            else None
+        ),
+        memory=MemoryCeiling.from_options(ctx_obj["config"], options),
+        http_pool=SharedHTTPPool.from_options(ctx_obj["config"], options),
+    )
+    processes = None
+    if options["processes"] > 1:
+        processes = WorkerProcesses(
+            worker,
+            context,
+            schedule.shard(options["processes"]),
+            threads=options["threads"],
+            timeout=options["global_timeout"],
+        )
+        # Fork before the progress bar starts its thread
+        processes.start()
     results = []
     error = None
     with Progress(console=ctx_obj["console"], refresh_per_second=1) as progress:
         task_global = progress.add_task(f"Crawling {len(host_ids)} mirrors", total=len(host_ids))
-        threads_results = run_in_threadpool(
-            worker,
-            host_ids,
-            fn_args=(options, ctx_obj["config"], progress),
-            timeout=options["global_timeout"],
-            executor_kwargs={
-                "max_workers": options["threads"],
-            },
-        )
+        context.progress = progress
+        if processes is not None:
+            threads_results = processes.results()
+        else:
+            threads_results = run_in_threadpool(
+                worker,
+                host_ids,
+                fn_args=(context,),
+                timeout=options["global_timeout"],
+                executor_kwargs={
+                    "max_workers": options["threads"],
+                },
+            )
         try:
             for result in threads_results:
                 progress.advance(task_global)
@@ -229,8 +384,49 @@ def run_on_all_hosts(ctx_obj, options, report):
         except GlobalTimeoutError as e:
             error = e
 
+    if context.propagation_cache is not None:
+        context.propagation_cache.save()
+    if context.leases is not None:
+        context.leases.stop()
+    if context.writer is not None:
+        context.writer.stop()
+    if context.http_pool is not None:
+        context.http_pool.close_all()
+    finish_run(ctx_obj, options, report, results, len(host_ids), starttime, error)
+
+
+def run_canary(ctx_obj, options):
+    """Check all the hosts from a single event loop, see
+    :class:`~mirrormanager2.crawler.canary.CanaryEngine`."""
+    logger.debug("Run the canary engine with option: %s", repr(options))
+    starttime = time.monotonic()
+    metrics.reset()
+    config = ctx_obj["config"]
+    schedule = build_schedule(ctx_obj, options, [host.id for host in ctx_obj["hosts"]])
+    db_manager = get_crawler_db_manager(config)
+    with db_manager.Session() as session:
+        hosts = CanaryHost.load(session, schedule.host_ids, ctx_obj["category_ids"])
+    engine = CanaryEngine(
+        concurrency=config.get("CRAWLER_CANARY_CONCURRENCY", 100),
+        get_timeout=schedule.get_timeout,
+    )
+    error = None
+    with Progress(console=ctx_obj["console"], refresh_per_second=1) as progress:
+        task = progress.add_task(f"Checking {len(hosts)} mirrors", total=len(hosts))
+        results, timed_out = engine.run(
+            hosts,
+            timeout=options["global_timeout"],
+            on_result=lambda result: progress.advance(task),
+        )
+    if timed_out:
+        error = GlobalTimeoutError("Maximum run time reached")
+    finish_run(ctx_obj, options, record_canary, results, len(hosts), starttime, error)
+
+
+def finish_run(ctx_obj, options, report, results, host_count, starttime, error):
     # Report what we have even if there was an error
     report(ctx_obj, options, results)
+    write_metrics(ctx_obj, options, host_count, time.monotonic() - starttime)
     duration = human_duration(time.monotonic() - starttime)
     if error is None:
         click.echo(f"Crawler finished after {duration}")
@@ -247,16 +443,136 @@ def run_on_all_hosts(ctx_obj, options, report):
     default=False,
     help="Fast crawl by only checking if mirror can be reached",
 )
+@click.option(
+    "--canary-engine",
+    type=click.Choice(CANARY_ENGINES),
+    default="threads",
+    help=(
+        "How to run --canary: like the other crawls, with a thread per host, or all the "
+        "hosts at once in a single asyncio event loop"
+    ),
+    show_default=True,
+)
 @click.option(
     "--repodata",
     is_flag=True,
     default=False,
     help="Fast crawl by only checking if the repodata is up to date",
 )
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help=(
+        "Only check the directories that changed since the last crawl of each category, "
+        "and a sample of the others. Falls back to a full crawl when too much changed"
+    ),
+)
+@click.option(
+    "--autoindex/--no-autoindex",
+    default=True,
+    help=(
+        "Check the files of a directory with the web server's directory index when there "
+        "is one, instead of one HTTP request per file"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--ftp-recursive",
+    is_flag=True,
+    default=False,
+    help=(
+        "List the whole category with a single recursive FTP listing (LIST -R) when the "
+        "server supports it, instead of one listing per directory"
+    ),
+)
+@click.option(
+    "--sample",
+    type=click.IntRange(min=1),
+    default=None,
+    metavar="N",
+    help=(
+        "Only check the N newest files of each directory and N other files chosen at random. "
+        "All the files are still checked every CRAWLER_SAMPLE_FULL_INTERVAL hours"
+    ),
+)
+@click.option(
+    "--trust-repodata",
+    is_flag=True,
+    default=False,
+    help=(
+        "When the repomd.xml file of a repository is up to date, only check a sample of the "
+        "directories of its Packages subtree (CRAWLER_TRUST_REPODATA_SAMPLE)"
+    ),
+)
+@click.option(
+    "--defer-retries/--no-defer-retries",
+    default=True,
+    help=(
+        "When a mirror is overloaded, put its crawl aside and resume it after the backoff "
+        "delay, instead of keeping the thread waiting"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--http-engine",
+    type=click.Choice(HTTP_ENGINES),
+    default="requests",
+    help=(
+        "How to check files over HTTP: one request after the other, or concurrently "
+        "(up to the host's max_connections) with asyncio"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--shared-http-pool/--no-shared-http-pool",
+    default=False,
+    help=(
+        "Share the HTTP connections and the DNS resolutions of each process between the "
+        "hosts, by scheme and netloc, instead of opening new ones for each host"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--db-writer/--no-db-writer",
+    default=True,
+    help=(
+        "Write the statuses and the results of the hosts from a single thread, in batches, "
+        "instead of from each crawler thread"
+    ),
+    show_default=True,
+)
+@click.option(
+    "--work-queue",
+    "work_queue",
+    metavar="RUN_ID",
+    default=None,
+    help=(
+        "Share the hosts with the other crawler nodes started with the same RUN_ID, by "
+        "leasing them in the database. The result of each host is recorded when it is done"
+    ),
+)
+@click.option(
+    "--node-id",
+    default=None,
+    help="Name of this crawler node in the leases (default: hostname and process ID)",
+)
 @click.pass_context
 def crawl(ctx, **kwargs):
     options = ctx.obj["options"]
     options.update(ctx.params)
+    if options["incremental"] and (options["canary"] or options["repodata"]):
+        raise click.BadOptionUsage(
+            "--incremental", "Cannot use --incremental with --canary or --repodata"
+        )
+    if options["canary"] and options["canary_engine"] == "asyncio":
+        if options["continents"] or options["work_queue"]:
+            raise click.BadOptionUsage(
+                "--canary-engine",
+                "Cannot use the asyncio canary engine with --continent or --work-queue",
+            )
+        run_canary(ctx.obj, options)
+        return
     run_on_all_hosts(ctx.obj, options, record_crawl)
 
 
@@ -264,10 +580,24 @@ def record_crawl(ctx_obj, options, results: list[PropagationResult]):
     console = ctx_obj["console"]
     config = ctx_obj["config"]
     options = ctx_obj["options"]
-    db_manager = get_db_manager(config)
+    db_manager = get_crawler_db_manager(config)
+    with db_manager.Session() as session:
+        if not options.get("work_queue") and not options.get("db_writer"):
+            # Otherwise they have been recorded as each host was done
+            for result in results:
+                store_crawl_result(config, options, session, result)
+            session.commit()
+        report_crawl(console, options, results)
+
+
+def record_canary(ctx_obj, options, results: list[CrawlResult]):
+    console = ctx_obj["console"]
+    config = ctx_obj["config"]
+    db_manager = get_crawler_db_manager(config)
     with db_manager.Session() as session:
+        # All at once
         for result in results:
-            store_crawl_result(config, options, session, result)
+            store_crawl_result(config, options, session, result, commit=False)
         session.commit()
         report_crawl(console, options, results)
 
@@ -319,7 +649,7 @@ def propagation(ctx, **kwargs):
 def record_propagation(ctx_obj, options, results: list[PropagationResult]):
     console = ctx_obj["console"]
     config = ctx_obj["config"]
-    db_manager = get_db_manager(config)
+    db_manager = get_crawler_db_manager(config)
     repo_status = defaultdict(lambda: defaultdict(lambda: 0))
     for result in results:
         for repo_id, status in result.repo_status.items():
@@ -2,6 +2,7 @@ import logging
 from functools import partial
 from urllib.parse import urlsplit
 
+from .async_http_connector import AsyncHTTPConnector, AsyncHTTPSConnector
 from .ftp_connector import FTPConnector
 from .http_connector import HTTPConnector, HTTPSConnector
 from .rsync_connector import RsyncConnector
@@ -9,11 +10,14 @@ from .rsync_connector import RsyncConnector
 logger = logging.getLogger(__name__)
 
 
-def _get_connection_class(scheme):
+HTTP_ENGINES = ("requests", "asyncio")
+
+
+def _get_connection_class(scheme, http_engine="requests"):
     if scheme == "http":
-        return HTTPConnector
+        return AsyncHTTPConnector if http_engine == "asyncio" else HTTPConnector
     if scheme == "https":
-        return HTTPSConnector
+        return AsyncHTTPSConnector if http_engine == "asyncio" else HTTPSConnector
     if scheme == "ftp":
         return FTPConnector
     if scheme == "rsync":
@@ -22,10 +26,26 @@ def _get_connection_class(scheme):
 
 
 class ConnectionPool:
-    def __init__(self, config, debuglevel=0):
+    def __init__(
+        self,
+        config,
+        debuglevel=0,
+        max_connections=1,
+        http_engine="requests",
+        autoindex=False,
+        ftp_recursive=False,
+        defer_retries=False,
+        shared_pool=None,
+    ):
         self._connections = {}
         self.config = config
         self.debuglevel = debuglevel
+        self.max_connections = max_connections
+        self.http_engine = http_engine
+        self.autoindex = autoindex
+        self.ftp_recursive = ftp_recursive
+        self.defer_retries = defer_retries
+        self.shared_pool = shared_pool
 
     def _get_key(self, url):
         scheme, netloc, path, query, fragment = urlsplit(url)
@@ -40,15 +60,25 @@ class ConnectionPool:
         key = self._get_key(url)
         if key not in self._connections:
             try:
-                connection_class = _get_connection_class(scheme)
+                connection_class = _get_connection_class(scheme, self.http_engine)
             except ValueError:
                 logger.error(f"Malformed URL: {url!r}")
                 raise
+            kwargs = {}
+            if scheme in ("http", "https"):
+                kwargs["autoindex"] = self.autoindex
+                if self.http_engine == "requests":
+                    kwargs["shared_pool"] = self.shared_pool
+            elif scheme == "ftp":
+                kwargs["recursive"] = self.ftp_recursive
             self._connections[key] = connection_class(
                 config=self.config,
                 netloc=netloc,
                 debuglevel=self.debuglevel,
                 on_closed=partial(self._remove_connection, key),
+                max_connections=self.max_connections,
+                defer_retries=self.defer_retries,
+                **kwargs,
             )
             # self._connections[key] = self._connect(netloc)
             # self._connections[key].set_debuglevel(self.debuglevel)
@@ -1,12 +1,11 @@
 import hashlib
 import logging
+from contextlib import contextmanager
 
 import backoff
-from sqlalchemy.orm import object_session
-
-from mirrormanager2 import lib as mmlib
 
 from .constants import RETRIES, RETRIES_MAX_INTERVAL
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +24,9 @@ class FetchingFailed(Exception):
 
 
 def _on_backoff(details):
-    # connector = details["args"][0]
+    connector = details["args"][0]
     url = details["args"][1]
+    metrics.inc("retries_total", protocol=connector.scheme)
     logger.info(
         f"Server load exceeded on {url} - trying again in "
         f"{details['wait']:0.1f}s (after {details['tries']} tries)"
@@ -44,10 +44,16 @@ def _on_giveup(details):
 class Connector:
     scheme = None
 
-    def __init__(self, config, netloc, debuglevel, on_closed):
+    def __init__(
+        self, config, netloc, debuglevel, on_closed, max_connections=1, defer_retries=False
+    ):
         self._config = config
+        # Let TryLater through instead of sleeping between the retries, the crawler will
+        # come back to this host later.
+        self.defer_retries = defer_retries
         self._netloc = netloc
         self.debuglevel = debuglevel
+        self.max_connections = max_connections
         self._connection = None
         self._on_closed = on_closed
 
@@ -65,12 +71,26 @@ class Connector:
     def _connect(self, url):
         raise NotImplementedError
 
+    @contextmanager
+    def _measure_request(self, method):
+        metrics.inc("requests_total", protocol=self.scheme, method=method)
+        with metrics.timer("request_duration_seconds", protocol=self.scheme, method=method):
+            yield
+
+    def _count_received(self, size):
+        metrics.inc("received_bytes_total", size, protocol=self.scheme)
+
     def _close(self):
         raise NotImplementedError
 
     def _get_file(self, url):
         raise NotImplementedError
 
+    def check_dir(self, url, directory):
+        if self.defer_retries:
+            return self._check_dir(url, directory)
+        return self._check_dir_with_retries(url, directory)
+
     @backoff.on_exception(
         backoff.expo,
         TryLater,
@@ -80,7 +100,7 @@ class Connector:
         on_giveup=_on_giveup,
         logger=None,  # custom logging
     )
-    def check_dir(self, url, directory):
+    def _check_dir_with_retries(self, url, directory):
         return self._check_dir(url, directory)
 
     def _check_dir(self, url, directory):
@@ -91,6 +111,15 @@ class Connector:
         contents = self._get_file(graburl)
         return hashlib.sha256(contents).hexdigest()
 
+    def get_sha256_cached(self, url, cache=None):
+        """Same as :meth:`get_sha256`, avoiding the download if the file is in the cache and
+        has not changed since.
+
+        The cache is a :class:`~mirrormanager2.crawler.propagation.PropagationCache`, it is
+        only used by the protocols that support conditional requests.
+        """
+        return self.get_sha256(url)
+
     def compare_sha256(self, directory, filename, graburl):
         """looks for a FileDetails object that matches the given URL"""
         try:
@@ -98,19 +127,23 @@ class Connector:
         except FetchingFailed:
             logger.debug("Could not get %s", graburl)
             return False
-        session = object_session(directory)
-        latest_file_detail = mmlib.get_file_detail(
-            session, filename, directory_id=directory.id, reverse=True
-        )
-        if latest_file_detail is None:
+        return self._compare_checksum(directory, filename, sha256)
+
+    def _compare_checksum(self, directory, filename, sha256):
+        """Compare the checksum of a remote file with the latest one in the database"""
+        expected = directory.sha256sums.get(filename)
+        if expected is None:
             return False
-        if latest_file_detail.sha256 != sha256:
-            logger.debug(
-                f"Found {filename} with sha {sha256}, but expected {latest_file_detail.sha256}"
-            )
+        if expected != sha256:
+            logger.debug(f"Found {filename} with sha {sha256}, but expected {expected}")
             return False
         return True
 
+    def get_listing_digest(self, url):
+        """Return a digest of the listing of the whole category, or None if the connector
+        does not list categories at once."""
+        return None
+
     def _get_dir_url(self, url, directory, category_prefix_length):
         dirname = directory.name[category_prefix_length:]
         return f"{url}/{dirname}"
@@ -125,6 +158,8 @@ class Connector:
         try:
             dir_status = self.check_dir(dir_url, directory)
         except TryLater as e:
+            if self.defer_retries:
+                raise
             # We backed off a few times but it's still in timeout
             raise SchemeNotAvailable from e
         # logger.debug(f"Dir status for {dir_url} is {dir_status}")
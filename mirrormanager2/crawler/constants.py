@@ -4,6 +4,7 @@ CONTINENTS = ["AF", "AN", "AS", "EU", "NA", "OC", "SA", "--"]
 
 REPODATA_DIR = "repodata"
 REPODATA_FILE = "repomd.xml"
+PACKAGES_DIR = "Packages"
 
 DEFAULT_GLOBAL_TIMEOUT = 360  # minutes
 
@@ -12,6 +13,10 @@ SHUTDOWN_TIMEOUT = 5
 
 CONNECTION_TIMEOUT = 10  # seconds
 
+# Number of repomd.xml files downloaded at the same time from a host when checking the
+# propagation, if its max_connections is lower
+PROPAGATION_MAX_CONNECTIONS = 4
+
 # Number of times to retry a connection
 RETRIES = 10
 RETRIES_MAX_INTERVAL = 10  # in seconds
@@ -59,10 +59,11 @@ def get_geoip(base_dir):
     return geoip2.database.Reader(os.path.join(base_dir, "GeoLite2-Country.mmdb"))
 
 
-def check_continent(config, options, session, categoryUrl):
+def check_continent(config, options, session, categoryUrl, country_continents=None):
     gi = get_geoip(config["GEOIP_BASE"])
     continents = filter_continents(options["continents"])
-    country_continents = get_country_continents(session)
+    if country_continents is None:
+        country_continents = get_country_continents(session)
     # Before the first network access to the mirror let's
     # check if continent mode is enabled and verfiy if
     # the mirror is on the target continent.
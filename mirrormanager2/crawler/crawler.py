@@ -1,31 +1,59 @@
 import dataclasses
 import datetime
+import hashlib
 import logging
-from collections import defaultdict
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import mirrormanager2.lib as mmlib
-from mirrormanager2.lib.constants import PROPAGATION_ARCH
-from mirrormanager2.lib.database import get_db_manager
-from mirrormanager2.lib.fedora import get_propagation_repo_prefix
-from mirrormanager2.lib.model import HostCategoryDir
 
 from .connection_pool import ConnectionPool
-from .connector import FetchingFailed, SchemeNotAvailable
-from .constants import REPODATA_DIR, REPODATA_FILE
+from .connector import FetchingFailed, SchemeNotAvailable, TryLater
+from .constants import (
+    PROPAGATION_MAX_CONNECTIONS,
+    REPODATA_DIR,
+    REPODATA_FILE,
+    RETRIES,
+    RETRIES_MAX_INTERVAL,
+)
 from .continents import BrokenBaseUrl, EmbargoedCountry, WrongContinent, check_continent
+from .database import get_crawler_db_manager
+from .incremental import CrawlPlan, plan_crawl
 from .log import thread_file_logger
-from .states import CrawlStatus, PropagationStatus, SyncStatus
+from .metrics import metrics
+from .propagation import RepomdCheck, get_propagation_repos
+from .reconcile import HostCategoryDirReconciler
+from .sampling import DirectorySampler, RepositorySampler, get_packages_root
+from .snapshot import DatabaseCategory
+from .states import CrawlMode, CrawlStatus, PropagationStatus
 from .threads import (
+    Continuation,
     GlobalTimeoutError,
     HostTimeoutError,
     ThreadTimeout,
     get_thread_id,
     on_thread_started,
+    threadlocal,
 )
 from .ui import ProgressTask
 
 logger = logging.getLogger(__name__)
 
+# The status of the directories that have been checked by a previous crawl of the category,
+# which was interrupted.
+ALREADY_CHECKED = object()
+
+CANARY_FAILED_DETAILS = "Canary mode failed for all categories. Marking host as not up to date."
+HOST_TIMEOUT_DETAILS = "Crawler timed out before completing. Host is likely overloaded."
+GLOBAL_TIMEOUT_DETAILS = (
+    "Crawler reached its maximum execution time, could not complete this host's scan."
+)
+
+# Check the memory ceiling every that many directories
+MEMORY_CHECK_INTERVAL = 1000
+
 
 class CrawlerError(Exception):
     pass
@@ -43,6 +71,28 @@ class CategoryNotAccessible(CrawlerError):
     pass
 
 
+class CategoryDeferred(CrawlerError):
+    """The mirror asked to try again later while its category was being crawled"""
+
+    def __init__(self, resume_after=None, checked=0, stats=None):
+        super().__init__()
+        # The last directory that has been checked
+        self.resume_after = resume_after
+        # The number of directories checked before the mirror asked to try later
+        self.checked = checked
+        self.stats = stats
+
+
+class CategoryUnchanged(CrawlerError):
+    """Neither the listing of the mirror nor the category changed since the last crawl"""
+
+
+class HostDeferred(CrawlerError):
+    def __init__(self, deferred):
+        super().__init__()
+        self.deferred = deferred
+
+
 @dataclasses.dataclass
 class CrawlStats:
     total_directories: int = 0
@@ -65,6 +115,45 @@ class CrawlStats:
         setattr(self, attr, current_value + 1)
 
 
+@dataclasses.dataclass
+class ListingDigest:
+    """The state of a category on a mirror: the digest of the mirror's listing, and of the
+    directories of the category on the master mirror."""
+
+    ctimes_digest: str
+    listing_digest: str | None = None
+
+    @property
+    def value(self):
+        if self.listing_digest is None:
+            return None
+        return hashlib.sha256(f"{self.listing_digest}:{self.ctimes_digest}".encode()).hexdigest()
+
+
+@dataclasses.dataclass
+class DeferredCrawl:
+    """The state of the crawl of a host that has been put aside until the mirror can be
+    contacted again. It is given back to the worker in a
+    :class:`~mirrormanager2.crawler.threads.Continuation`."""
+
+    host_id: int
+    # Number of times in a row that the mirror asked to try later without progress
+    tries: int
+    # When the crawl of the host started, the host timeout still applies
+    starttime: float
+    # The categories that have been crawled, and their stats
+    done_categories: frozenset
+    successful_categories: int
+    stats: "CrawlStats"
+    # The category that was being crawled, and the last directory checked in it
+    category_id: int | None = None
+    resume_after: str | None = None
+
+    def get_delay(self):
+        # Same as backoff.expo with full jitter
+        return random.uniform(0, min(2**self.tries, RETRIES_MAX_INTERVAL))
+
+
 @dataclasses.dataclass
 class CrawlResult:
     host_id: int
@@ -83,37 +172,111 @@ class PropagationResult:
     repo_status: dict[int, PropagationStatus]
 
 
+def _preferred_method(url):
+    if url.startswith("rsync:"):
+        return 1
+    elif url.startswith("ftp:"):
+        return 2
+    elif url.startswith("http:"):
+        return 3
+    elif url.startswith("https:"):
+        return 4
+    else:
+        return 5
+
+
+def sort_urls(urls):
+    """Sort the URLs of a host category by preferred connection method"""
+    return sorted(urls, key=_preferred_method)
+
+
 def get_preferred_urls(host_category):
     """return which of the hosts connection method should be used
     rsync > http(s) > ftp"""
-    urls = [hcurl.url for hcurl in host_category.urls if hcurl.url is not None]
-
-    def _preferred_method(url):
-        if url.startswith("rsync:"):
-            return 1
-        elif url.startswith("ftp:"):
-            return 2
-        elif url.startswith("http:"):
-            return 3
-        elif url.startswith("https:"):
-            return 4
-        else:
-            return 5
+    return sort_urls(hcurl.url for hcurl in host_category.urls if hcurl.url is not None)
+
 
-    urls.sort(key=_preferred_method)
-    return urls
+@dataclasses.dataclass
+class WorkerContext:
+    """What is shared by all the worker threads of a run"""
+
+    options: dict
+    config: dict
+    progress: object
+    snapshot: object = None
+    propagation_cache: object = None
+    checksum_index: object = None
+    schedule: object = None
+    leases: object = None
+    writer: object = None
+    memory: object = None
+    http_pool: object = None
 
 
 class Crawler:
-    def __init__(self, config, session, options, progress, host):
+    def __init__(
+        self,
+        config,
+        session,
+        options,
+        progress,
+        host,
+        snapshot=None,
+        propagation_cache=None,
+        checksum_index=None,
+        host_timeout=None,
+        deferred=None,
+        writer=None,
+        memory=None,
+        http_pool=None,
+    ):
         self.config = config
         self.options = options
         self.session = session
         self.progress = progress
         self.host = host
-        self.connection_pool = ConnectionPool(config, debuglevel=2 if options["debug"] else 0)
-        self.timeout = ThreadTimeout(options["host_timeout"])
+        if host_timeout is None:
+            host_timeout = options["host_timeout"]
+        self.timeout = ThreadTimeout(host_timeout)
         self.host_category_dirs = {}
+        self.snapshot = snapshot
+        self.propagation_cache = propagation_cache
+        self.checksum_index = checksum_index
+        # The state of the crawl if it has been deferred before
+        self.deferred = deferred
+        # Writes the changes from another thread if set
+        self.writer = writer
+        # The memory ceiling of the process, if any
+        self.memory = memory
+        # The HTTP connections shared with the other hosts of the process, if any
+        self.http_pool = http_pool
+        self.connection_pool = self._make_connection_pool()
+        # Directories checked since the crawl was started or resumed
+        self._checked_directories = 0
+        self.sampler = DirectorySampler(options["sample"]) if options.get("sample") else None
+        self.repository_sampler = None
+        if options.get("trust_repodata") and not options["repodata"]:
+            self.repository_sampler = RepositorySampler(
+                config.get("CRAWLER_TRUST_REPODATA_SAMPLE", 3)
+            )
+
+    def _make_connection_pool(self):
+        return ConnectionPool(
+            self.config,
+            debuglevel=2 if self.options["debug"] else 0,
+            max_connections=self.host.max_connections,
+            http_engine=self.options.get("http_engine", "requests"),
+            autoindex=self.options.get("autoindex", False),
+            ftp_recursive=self.options.get("ftp_recursive", False),
+            defer_retries=self.options.get("defer_retries", False),
+            shared_pool=self.http_pool,
+        )
+
+    def _get_category(self, hc):
+        """Return the directories of the category, from the run-wide snapshot if possible."""
+        if self.snapshot is None:
+            return DatabaseCategory(self.session, hc.category)
+        return self.snapshot.get_category(self.session, hc.category)
 
     # def _parent(self, directory):
     #     parentDir = None
@@ -158,32 +321,45 @@ class Crawler:
         fails it scans the hosts file by file using HTTP.
         Canary mode only tries to determine if the mirror is up and
         repodata mode only scans all the repodata/ directories."""
-        self.timeout.start()
-        successful_categories = 0
+        deferred = self.deferred
+        self.timeout.start(deferred.starttime if deferred is not None else None)
+        successful_categories = deferred.successful_categories if deferred is not None else 0
+        done_categories = set(deferred.done_categories) if deferred is not None else set()
         # host_category_dirs = {}
 
         host_categories_to_scan = self.select_host_categories_to_scan()
         # self.progress.set_total(len(host_categories_to_scan))
         # print(self.host, len(host_categories_to_scan))
 
-        stats = CrawlStats()
+        stats = deferred.stats if deferred is not None else CrawlStats()
 
         for hc in host_categories_to_scan:
+            if hc.id in done_categories:
+                continue
             self.timeout.check()
             self.progress.reset()
             self.progress.set_action(hc.category.name)
             # self.progress.advance()
             if hc.always_up2date:
                 successful_categories += 1
+                done_categories.add(hc.id)
                 continue
             try:
                 category_stats = self._scan_host_category(hc)
             except CategoryNotAccessible:
+                done_categories.add(hc.id)
                 continue
+            except CategoryDeferred as e:
+                self.connection_pool.close_all()
+                stats.update(e.stats)
+                raise HostDeferred(
+                    self._defer(hc, e, done_categories, successful_categories, stats)
+                ) from e
             else:
                 # Record that this host has at least one (or more) categories
                 # which is accessible via http or ftp
                 successful_categories += 1
+            done_categories.add(hc.id)
             # host_category_dirs.update(result or {})
 
             # if self.options["canary"]:
@@ -205,6 +381,26 @@ class Crawler:
         #     return None
         # return self.sync_hcds(host_category_dirs)
 
+    def _defer(self, hc, error, done_categories, successful_categories, stats):
+        """Put the crawl of the host aside, to be resumed in the category that was being
+        crawled."""
+        tries = 1
+        if self.deferred is not None and error.checked == 0:
+            # No progress since the last time
+            tries = self.deferred.tries + 1
+        deferred = DeferredCrawl(
+            host_id=self.host.id,
+            tries=tries,
+            starttime=threadlocal.starttime,
+            done_categories=frozenset(done_categories),
+            successful_categories=successful_categories,
+            stats=stats,
+            category_id=hc.id,
+            resume_after=error.resume_after,
+        )
+        metrics.inc("deferred_total")
+        return deferred
+
     def check_for_base_dir(self, urls):
         """Check if at least one of the given URL exists on the remote host.
         This is used to detect mirrors which have completely dropped our content.
@@ -242,41 +438,257 @@ class Crawler:
             msg = f"repodata {msg}"
         logger.debug(msg)
 
-        trydirs_count = mmlib.count_directories_by_category(
-            self.session, hc.category, self.options["repodata"]
+        if self.writer is not None and self.deferred is not None:
+            # The changes of the previous attempt must be written before they are read again
+            self.writer.wait_for(hc.id)
+            self.session.expire(hc)
+        category = self._get_category(hc)
+        reconciler = HostCategoryDirReconciler(self.session, hc, category.topdir_name)
+        plan = CrawlPlan(mode=CrawlMode.FULL, category=category)
+        if self.options.get("incremental"):
+            plan = plan_crawl(self.config, hc, category, stale=reconciler.get_stale_names())
+            category = plan.category
+        full_crawl = plan.mode == CrawlMode.FULL and not (
+            self.options["repodata"] or self.options["canary"]
         )
+        resume_after = self._get_checkpoint(hc) if full_crawl else None
+        if resume_after is not None:
+            logger.info("Resuming the crawl of %s after %s", hc.category.name, resume_after)
+            started_at = hc.crawl_checkpoint_started
+        else:
+            started_at = int(time.time())
+        if self.deferred is not None and self.deferred.category_id == hc.id:
+            # Go on where the mirror asked to try later
+            resume_after = self.deferred.resume_after
+        sampled = self._can_sample(hc)
+        sampler = self.sampler if sampled else None
+        repository_sampler = self.repository_sampler if sampled else None
+        digest = ListingDigest(category.ctimes_digest) if full_crawl else None
+        trydirs_count = category.count_directories(self.options["repodata"])
         self.progress.set_total(trydirs_count)
         # logger.info("Category %s has %s directories", hc.category.name, trydirs_count)
 
         stats = CrawlStats(total_directories=trydirs_count)
-        seen_hcds = set()
+        newest_ctime = plan.newest_ctime or 0
+        # The oldest directory that changed since the last crawl and is not up2date yet
+        oldest_failed_ctime = None
+        checkpoint_interval = self.config.get("CRAWLER_CHECKPOINT_INTERVAL")
+        checked = 0
+        last_checked = None
+
+        def _save_progress():
+            values = {}
+            if full_crawl and last_checked is not None:
+                values = {"crawl_checkpoint": last_checked, "crawl_checkpoint_started": started_at}
+            self._apply(hc, reconciler, values)
 
-        for directory, status in self._get_directory_statuses(hc):
-            self.timeout.check()
-            self.progress.advance()
-            sync_status, hcd_id = self.sync_dir(hc, directory, status)
-            stats.increment(sync_status.value)
-            if hcd_id is not None:
-                # It's None on unknown status
-                seen_hcds.add(hcd_id)
-        # Expire the session to unload the directory entries
-        self.session.commit()
+        try:
+            for directory, status in self._get_directory_statuses(
+                hc, category, resume_after, sampler, repository_sampler, digest
+            ):
+                self.timeout.check()
+                self.progress.advance()
+                newest_ctime = max(newest_ctime, directory.ctime or 0)
+                if status is ALREADY_CHECKED:
+                    reconciler.mark_seen(directory)
+                    continue
+                with metrics.timer("db_duration_seconds", operation="sync_dir"):
+                    sync_status = reconciler.sync_dir(directory, status)
+                ctime = directory.ctime or 0
+                if (
+                    status is False
+                    and plan.mode != CrawlMode.FULL
+                    and ctime > hc.last_verified
+                    and (oldest_failed_ctime is None or ctime < oldest_failed_ctime)
+                ):
+                    oldest_failed_ctime = ctime
+                stats.increment(sync_status.value)
+                checked += 1
+                last_checked = directory.name
+                if checkpoint_interval and checked % checkpoint_interval == 0:
+                    # Don't lose this work if the crawl is interrupted
+                    _save_progress()
+                    self.session.commit()
+                elif (
+                    self.memory is not None
+                    and checked % MEMORY_CHECK_INTERVAL == 0
+                    and self.memory.check(f"crawling {hc.category.name} on {self.host.name}")
+                ):
+                    # Don't keep the pending changes in memory
+                    _save_progress()
+                    self.session.commit()
+        except CategoryUnchanged:
+            logger.info("The listing of %s has not changed, skipping", hc.category.name)
+            self.progress.advance(trydirs_count)
+            stats.unchanged = trydirs_count
+            # The statuses of the last full crawl are still right
+            self._apply(
+                hc,
+                reconciler,
+                {
+                    "last_full_crawl": started_at,
+                    "crawl_checkpoint": None,
+                    "crawl_checkpoint_started": None,
+                },
+            )
+            self.session.commit()
+            return stats
+        except BaseException as e:
+            # Keep the statuses of the directories that have been checked so far.
+            _save_progress()
+            if isinstance(e, CategoryDeferred):
+                e.resume_after = last_checked or resume_after
+                e.checked = checked
+                # The directories are counted when the category is resumed
+                e.stats = dataclasses.replace(stats, total_directories=0)
+            raise
 
+        # Only a complete full crawl can be skipped the next time
+        values = {"listing_digest": None}
         # In repodata or canary mode we only want to update the files actually scanned.
         # Do not mark files which have not been scanned as not being up to date.
         if self.options["repodata"] or self.options["canary"]:
+            self._apply(hc, reconciler, values)
+            # Expire the session to unload the directory entries
+            self.session.commit()
+            return stats
+
+        # All the directories that changed up to this one have now been checked.
+        values["last_verified"] = newest_ctime
+        if oldest_failed_ctime is not None:
+            # Check it again next time, the host may not have a HostCategoryDir for it.
+            values["last_verified"] = min(newest_ctime, oldest_failed_ctime - 1)
+        if plan.mode != CrawlMode.FULL:
+            # The directories that have not been checked keep their status.
+            self._apply(hc, reconciler, values)
+            self.session.commit()
             return stats
 
-        # now-historical HostCategoryDirs are not up2date
-        # we wait for a cascading Directory delete to delete this
+        if not sampled:
+            # Only count the crawls that checked all the files
+            values["last_full_crawl"] = started_at
+            values["listing_digest"] = digest.value
+        values["crawl_checkpoint"] = None
+        values["crawl_checkpoint_started"] = None
         # It is VERY memory-hungry to list hc.directories, so make specific DB queries.
         stats.unreadable += mmlib.count_hostcategorydirs_with_unreadable_dir(self.session, hc)
-        stats.hcds_deleted += mmlib.set_hostcategorydirs_not_up2date(self.session, hc, seen_hcds)
+        stats.hcds_deleted += self._apply(hc, reconciler, values, mark_unseen_not_up2date=True)
         self.session.commit()
 
         return stats
 
-    def _get_directory_statuses(self, hc):
+    def _apply(self, hc, reconciler, values, mark_unseen_not_up2date=False):
+        """Write the statuses collected by the reconciler and the new values of the columns of
+        the host category, or hand them over to the writer thread.
+
+        :returns: the number of HostCategoryDirs set to not up2date because they were not seen.
+        """
+        changes = reconciler.take_changes(mark_unseen_not_up2date)
+        if self.writer is not None:
+            # The HostCategory is updated with its HostCategoryDirs, in the same transaction
+            changes.values = values
+            self.writer.put(changes)
+            return len(changes.unseen_ids)
+        with metrics.timer("db_duration_seconds", operation="apply"):
+            changes.write(self.session)
+        for name, value in values.items():
+            setattr(hc, name, value)
+        return len(changes.unseen_ids)
+
+    def _can_sample(self, hc):
+        """Return whether only a sample of the files can be checked, False if all the files
+        of the category must be checked this time."""
+        if self.sampler is None and self.repository_sampler is None:
+            return False
+        full_interval = self.config.get("CRAWLER_SAMPLE_FULL_INTERVAL", 168) * 3600
+        if hc.last_full_crawl is None or hc.last_full_crawl < time.time() - full_interval:
+            logger.debug("Checking all the files of %s", hc.category.name)
+            return False
+        return True
+
+    def _get_tries(self):
+        """The number of times in a row that the mirror has asked to try later"""
+        return (self.deferred.tries if self.deferred is not None else 0) + 1
+
+    def _get_checkpoint(self, hc):
+        """Return the last directory checked by the previous crawl of the category if it was
+        interrupted, and if it is recent enough to be resumed."""
+        if hc.crawl_checkpoint is None:
+            return None
+        max_age = self.config.get("CRAWLER_CHECKPOINT_MAX_AGE", 24) * 3600
+        if (hc.crawl_checkpoint_started or 0) < time.time() - max_age:
+            logger.debug("The checkpoint of %s is too old", hc.category.name)
+            return None
+        if (
+            mmlib.get_category_directory_by_name(self.session, hc.category, hc.crawl_checkpoint)
+            is None
+        ):
+            # We would not know where to resume, and would skip all the directories
+            logger.debug("The checkpoint of %s is not in the category", hc.category.name)
+            return None
+        return hc.crawl_checkpoint
+
+    def _check_directory(self, connector, url, directory, category_prefix_length):
+        try:
+            status = connector.check_category(url, directory, category_prefix_length)
+        except TryLater as e:
+            if self._checked_directories == 0 and self._get_tries() >= RETRIES:
+                logger.info("Server load exceeded on %s - giving up", url)
+                raise SchemeNotAvailable from e
+            logger.info("Server load exceeded on %s - trying again later", url)
+            raise CategoryDeferred() from e
+        self._checked_directories += 1
+        return status
+
+    def _check_repositories(self, connector, url, category, category_prefix_length, sampler):
+        """Check the repomd.xml file and a sample of the Packages subtree of the yum
+        repositories.
+
+        Return the statuses of the checked directories, and the roots of the repositories
+        whose Packages subtree is up to date.
+
+        Only the HTTP connectors compare the checksum of repomd.xml, which is needed to trust
+        a repository; the FTP and RSYNC ones only compare its size, nothing is trusted then.
+        """
+        statuses = {}
+        trusted = set()
+        if not url.startswith(("http:", "https:")):
+            return statuses, trusted
+        samples = sampler.sample(category.get_directories())
+        for root, sample in samples.items():
+            status = self._check_directory(connector, url, sample.repodata, category_prefix_length)
+            statuses[sample.repodata.name] = status
+            if not status:
+                continue
+            for directory in sample.packages:
+                status = self._check_directory(connector, url, directory, category_prefix_length)
+                statuses[directory.name] = status
+                if status is False:
+                    logger.debug("%s is not up to date, checking all of %s", directory.name, root)
+                    break
+            else:
+                trusted.add(root)
+        logger.debug(
+            "Trusting the Packages subtree of %s out of %s repositories",
+            len(trusted),
+            len(samples),
+        )
+        return statuses, trusted
+
+    def _check_listing_digest(self, hc, connector, url, digest):
+        digest.listing_digest = connector.get_listing_digest(url)
+        if digest.value is not None and digest.value == hc.listing_digest:
+            raise CategoryUnchanged
+
+    def _get_directory_statuses(
+        self,
+        hc,
+        category,
+        resume_after=None,
+        sampler=None,
+        repository_sampler=None,
+        digest=None,
+    ):
         urls = get_preferred_urls(hc)
         if not urls:
             logger.debug("No URLs: %s", repr(urls))
@@ -285,7 +697,13 @@ class Crawler:
         if self.options["continents"]:
             # Only check for continent if something specified
             # on the command-line
-            check_continent(self.config, self.options, self.session, urls[0])
+            check_continent(
+                self.config,
+                self.options,
+                self.session,
+                urls[0],
+                country_continents=self.snapshot and self.snapshot.country_continents,
+            )
 
         if not self.check_for_base_dir(urls):
             logger.debug("Base directory not accessible: %s", repr(urls))
@@ -294,11 +712,7 @@ class Crawler:
         if self.options["canary"]:
             return
 
-        trydirs = mmlib.get_directories_by_category(
-            self.session, hc.category, self.options["repodata"]
-        )
-
-        category_prefix_length = len(hc.category.topdir.name)
+        category_prefix_length = len(category.topdir_name)
         if category_prefix_length > 0:
             category_prefix_length += 1
 
@@ -320,8 +734,34 @@ class Crawler:
 
             connector = self.connection_pool.get(url)
             try:
-                for directory in trydirs:
-                    status = connector.check_category(url, directory, category_prefix_length)
+                if digest is not None:
+                    self._check_listing_digest(hc, connector, url, digest)
+                statuses, trusted = {}, set()
+                if repository_sampler is not None:
+                    # The repodata directories are listed after the Packages subtrees
+                    statuses, trusted = self._check_repositories(
+                        connector, url, category, category_prefix_length, repository_sampler
+                    )
+                resuming = resume_after is not None
+                for directory in category.get_directories(self.options["repodata"]):
+                    if resuming:
+                        # The directories are sorted by name
+                        resuming = directory.name != resume_after
+                        yield directory, ALREADY_CHECKED
+                        continue
+                    if directory.name in statuses:
+                        yield directory, statuses[directory.name]
+                        continue
+                    if trusted and get_packages_root(directory.name) in trusted:
+                        # Like the connectors, None for the directories without files
+                        yield directory, True if directory.files else None
+                        continue
+                    checked_directory = directory
+                    if sampler is not None:
+                        checked_directory = sampler.sample(directory)
+                    status = self._check_directory(
+                        connector, url, checked_directory, category_prefix_length
+                    )
                     yield directory, status
             except SchemeNotAvailable:
                 logger.debug(f"Scheme {url} is not available")
@@ -332,81 +772,51 @@ class Crawler:
         )
         raise CategoryNotAccessible
 
-    def sync_dir(self, hc, directory, status):
-        logger.debug("Syncing directory %s", directory.name)
-        sync_status = SyncStatus.UNKNOWN
-        if status is None:
-            # could be a dir with no files, or an unreadable dir.
-            # defer decision on this dir, let a child decide.
-            return sync_status, None
-
-        topname = hc.category.topdir.name
-        toplen = len(topname)
-        if directory.name.startswith("/"):
-            toplen += 1
-        path = directory.name[toplen:]
-
-        hcd = mmlib.get_hostcategorydir_by_hostcategoryid_and_path(
-            self.session, host_category_id=hc.id, path=path
-        )
-        if hcd is None:
-            if not status:
-                # don't create HCDs for directories which aren't up2date on the
-                # mirror chances are the mirror is excluding that directory
-                return sync_status, None
-            hcd = HostCategoryDir(host_category_id=hc.id, path=path, directory_id=directory.id)
-            self.session.add(hcd)
-            self.session.flush()
-            sync_status = SyncStatus.CREATED
-
-        if hcd.directory is None:
-            hcd.directory = directory
-        if hcd.up2date != status:
-            hcd.up2date = status
-            if status is False:
-                logger.info("Directory %s is not up-to-date on this host.", directory.name)
-                sync_status = SyncStatus.NOT_UP2DATE
-            else:
-                sync_status = SyncStatus.UP2DATE
-        else:
-            sync_status = SyncStatus.UNCHANGED
-        self.session.flush()
-        return sync_status, hcd.id
-
     def check_propagation(self, product_versions):
         self.timeout.start()
         repo_status = {}
-        all_repos = defaultdict(list)
-        for product_name, version_name in product_versions:
-            repo_prefix = get_propagation_repo_prefix(product_name, version_name)
-            # First try with the PROPAGATION_ARCH arch, but if not found try with any other.
-            for arch in [PROPAGATION_ARCH, None]:
-                repos_for_arch = mmlib.get_repositories(
-                    self.session,
-                    product_name=product_name,
-                    version_name=version_name,
-                    prefix=repo_prefix,
-                    arch=arch,
-                )
-                if repos_for_arch:
-                    all_repos[(product_name, version_name)].extend(repos_for_arch)
+        all_repos = get_propagation_repos(self.session, product_versions)
         if not all_repos:
             logger.warning("No repo found")
             return {}
-        for product_name, version_name in all_repos:
-            for repo in all_repos[(product_name, version_name)]:
-                status = self.check_propagation_for_repo(repo)
-                if status is not None:
-                    repo_status[repo.id] = status
+        # Check the first repo of all the product versions concurrently, then move on to the
+        # next repo of the product versions where the file was not found.
+        pending = [iter(repos) for repos in all_repos.values()]
+        while pending:
+            checks = []
+            for repos in pending:
+                for repo in repos:
+                    check = self._get_propagation_check(repo)
+                    if check is None:
+                        continue
+                    if isinstance(check, RepomdCheck):
+                        checks.append((check, repos))
+                    else:
+                        repo_status[repo.id] = check
                     break
+            pending = []
+            checksums = self._get_checksums([check.url for check, _repos in checks])
+            for (check, repos), checksum in zip(checks, checksums, strict=True):
+                if checksum is None:
+                    logger.info("Could not find the checksum for repo with %s", check.description)
+                    # The file wasn't found on this arch, it may not be mirrored, try another arch.
+                    pending.append(repos)
+                    continue
+                repo_status[check.repo_id] = self._get_file_propagation_status(
+                    check.file_detail, checksum
+                )
         return repo_status
 
-    def check_propagation_for_repo(self, repo):
+    def _get_propagation_check(self, repo):
+        """Find the repomd.xml file to download to check the propagation of a repo.
+
+        Returns a :class:`RepomdCheck`, a :class:`PropagationStatus` if it can't be checked,
+        or None if the host does not carry the repo.
+        """
+        description = f"prefix {repo.prefix} on {repo.arch.name}"
         repo_dir = repo.directory
         if repo_dir is None:
-            logger.warning(
-                "No directory for repo with prefix %s on %s", repo.prefix, repo.arch.name
-            )
+            logger.warning("No directory for repo with %s", description)
             return PropagationStatus.NO_INFO
         repodata_dir = mmlib.get_directory_by_name(self.session, f"{repo_dir.name}/{REPODATA_DIR}")
         if repodata_dir is None:
@@ -430,22 +840,18 @@ class Crawler:
             return PropagationStatus.NO_INFO
         fd = mmlib.get_file_detail(self.session, REPODATA_FILE, repodata_dir.id, reverse=True)
         if fd is None:
-            logger.warning(
-                "Could not find the file details for repo with prefix %s on %s",
-                repo.prefix,
-                repo.arch.name,
-            )
+            logger.warning("Could not find the file details for repo with %s", description)
             return PropagationStatus.NO_INFO
-        checksum = self._get_checksum_for_repo(url, topdir, repodata_dir)
-        if checksum is None:
-            logger.info(
-                "Could not find the checksum for repo with prefix %s on %s",
-                repo.prefix,
-                repo.arch.name,
-            )
-            # The file wasn't found on this arch, it may not be mirrored, try another arch.
-            return None
-        return self._get_file_propagation_status(fd, checksum)
+        path = repodata_dir.name
+        if topdir and repodata_dir.name.startswith(topdir):
+            path = repodata_dir.name[len(topdir) + 1 :]
+        logger.debug("Base URL: %s. Path: %s", url, path)
+        return RepomdCheck(
+            repo_id=repo.id,
+            description=description,
+            url=f"{url}{path}/{REPODATA_FILE}",
+            file_detail=fd,
+        )
 
     def _get_http_url(self, host_category):
         for hcu in host_category.urls:
@@ -455,33 +861,69 @@ class Crawler:
                     url += "/"
                 return url
 
-    def _get_checksum_for_repo(self, url, topdir, repo_dir):
-        # Print out information about the repomd.xml status
-        path = repo_dir.name
-        if topdir and repo_dir.name.startswith(topdir):
-            path = repo_dir.name[len(topdir) + 1 :]
-        # fds = mmlib.get_file_detail_history(self.session, "repomd.xml", repo_dir.id)
-        # sha256sums = {fd.sha256: fd.timestamp for fd in fds}
+    def _get_checksums(self, urls):
+        """Get the SHA256 checksums of the repomd.xml files concurrently.
 
-        logger.debug("Base URL: %s. Path: %s", url, path)
-        url = f"{url}{path}/{REPODATA_FILE}"
-        connector = self.connection_pool.get(url)
-        try:
-            csum = connector.get_sha256(url)
-        except FetchingFailed as e:
-            logger.info("Could not check %s: %s", url, e.response or "Connection error")
-            return None
-        return csum
+        The database session is not used in the threads, each of them has its own
+        connections to the host.
+        """
+        if not urls:
+            return []
+        max_workers = min(len(urls), max(self.host.max_connections, PROPAGATION_MAX_CONNECTIONS))
+        host_id = getattr(threadlocal, "host_id", self.host.id)
+        host_name = getattr(threadlocal, "host_name", self.host.name)
+        starttime = threadlocal.starttime
+        local = threading.local()
+        pools = []
+
+        def _on_thread_started():
+            on_thread_started(host_id=host_id, host_name=host_name)
+            # Share the host timeout with the calling thread
+            threadlocal.starttime = starttime
+            local.connection_pool = self._make_connection_pool()
+            pools.append(local.connection_pool)
+
+        def _get_checksum(url):
+            self.timeout.check()
+            connector = local.connection_pool.get(url)
+            try:
+                return connector.get_sha256_cached(url, self.propagation_cache)
+            except FetchingFailed as e:
+                logger.info("Could not check %s: %s", url, e.response or "Connection error")
+                return None
 
-    def _get_file_propagation_status(self, file_detail, checksum):
-        reference_dt = file_detail.datetime
-        age_threshold = reference_dt - datetime.timedelta(days=self.config["MAX_STALE_DAYS"])
+        try:
+            with ThreadPoolExecutor(
+                max_workers=max_workers, initializer=_on_thread_started
+            ) as executor:
+                return list(executor.map(_get_checksum, urls))
+        finally:
+            for pool in pools:
+                pool.close_all()
+
+    def _get_host_file_datetime(self, file_detail, checksum):
+        """When the file the host has was published, if it is less than MAX_STALE_DAYS older
+        than the latest one."""
+        if self.checksum_index is not None and file_detail in self.checksum_index:
+            timestamp = self.checksum_index.get_timestamp(file_detail, checksum)
+            if timestamp is None:
+                return None
+            return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+        age_threshold = file_detail.datetime - datetime.timedelta(
+            days=self.config["MAX_STALE_DAYS"]
+        )
         host_file_detail = mmlib.get_file_details_with_checksum(
             self.session, file_detail, checksum, age_threshold
         )
         if host_file_detail is None:
+            return None
+        return host_file_detail.datetime
+
+    def _get_file_propagation_status(self, file_detail, checksum):
+        reference_dt = file_detail.datetime
+        host_file_detail_dt = self._get_host_file_datetime(file_detail, checksum)
+        if host_file_detail_dt is None:
             return PropagationStatus.OLDER
-        host_file_detail_dt = host_file_detail.datetime
         if reference_dt - host_file_detail_dt > datetime.timedelta(days=3):
             return PropagationStatus.OLDER
         elif reference_dt - host_file_detail_dt > datetime.timedelta(days=2):
@@ -501,23 +943,31 @@ def crawl_and_report(options, crawler):
         stats = None
         try:
             stats = crawler.crawl()
+        except HostDeferred as e:
+            deferred = e.deferred
+            delay = deferred.get_delay()
+            logger.info(
+                "Host %s (%s) is overloaded, going on with its crawl in %.1fs",
+                host.id,
+                host.name,
+                delay,
+            )
+            return Continuation(item=deferred, delay=delay)
         except AllCategoriesFailed:
             status = CrawlStatus.FAILURE
             if options["canary"]:
                 # If running in canary mode do not auto disable mirrors
                 # if they have failed.
                 # Let's mark the complete mirror as not being up to date.
-                details = "Canary mode failed for all categories. Marking host as not up to date."
+                details = CANARY_FAILED_DETAILS
             logger.info("All categories failed.")
         except HostTimeoutError:
             status = CrawlStatus.TIMEOUT
-            details = "Crawler timed out before completing. Host is likely overloaded."
+            details = HOST_TIMEOUT_DETAILS
             logger.info(details)
         except GlobalTimeoutError:
             status = CrawlStatus.UNKNOWN
-            details = (
-                "Crawler reached its maximum execution time, could not complete this host's scan."
-            )
+            details = GLOBAL_TIMEOUT_DETAILS
             logger.info(details)
         except WrongContinent:
             logger.info("Skipping host %s (%s); wrong continent", host.id, host.name)
@@ -569,9 +1019,42 @@ def check_propagation_and_report(options, crawler):
     )
 
 
-def worker(options, config, progress_bar, host_id):
-    progress = ProgressTask(progress_bar, host_id)
-    db_manager = get_db_manager(config)
+def worker(context, item):
+    """Check a host, ``item`` is its ID or the :class:`DeferredCrawl` of a host to resume."""
+    deferred = item if isinstance(item, DeferredCrawl) else None
+    host_id = deferred.host_id if deferred is not None else item
+    if context.leases is None:
+        result = check_host(context, host_id, deferred)
+        if context.writer is not None and isinstance(result, CrawlResult):
+            # Written after the changes of the host's categories
+            context.writer.put(result)
+        return result
+    if deferred is None and not context.leases.acquire(host_id):
+        delay = context.leases.get_retry_delay(host_id)
+        if delay is None:
+            logger.debug(f"Host {host_id} has been crawled by another node")
+            return None
+        # Crawl it if the other node stops before it is done
+        logger.debug(f"Host {host_id} is crawled by another node, trying again in {delay}s")
+        return Continuation(item=host_id, delay=delay)
+    result = None
+    try:
+        result = check_host(context, host_id, deferred)
+    finally:
+        if not isinstance(result, Continuation):
+            if context.writer is not None:
+                # The statuses must be written before the host is marked as done
+                context.writer.flush()
+            # Record the result right away, the other nodes won't crawl this host again
+            context.leases.release(host_id, result)
+    return result
+
+
+def check_host(context, host_id, deferred=None):
+    options = context.options
+    config = context.config
+    progress = ProgressTask(context.progress, host_id)
+    db_manager = get_crawler_db_manager(config)
     with db_manager.Session() as session:
         host = mmlib.get_host(session, host_id)
         progress.set_host_name(host.name)
@@ -583,7 +1066,23 @@ def worker(options, config, progress_bar, host_id):
 
         logger.debug(f"Worker {get_thread_id()!r} starting on host {host.id} ({host.name})")
 
-        crawler = Crawler(config, session, options, progress, host)
+        crawler = Crawler(
+            config,
+            session,
+            options,
+            progress,
+            host,
+            snapshot=context.snapshot,
+            propagation_cache=context.propagation_cache,
+            checksum_index=context.checksum_index,
+            host_timeout=(
+                context.schedule.get_timeout(host.id) if context.schedule is not None else None
+            ),
+            deferred=deferred,
+            writer=context.writer,
+            memory=context.memory,
+            http_pool=context.http_pool,
+        )
 
         if options.get("propagation", False):
             check_function = check_propagation_and_report
@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from mirrormanager2.lib.database import get_db_manager
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Connections for the main thread and the reporting, in addition to one per worker thread
+EXTRA_CONNECTIONS = 2
+
+_lock = threading.Lock()
+# Database URI -> DatabaseManager
+_db_managers = {}
+
+
+class MonitoredQueuePool(QueuePool):
+    """A QueuePool that measures how long the threads wait for a connection."""
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except Exception:
+            metrics.inc("db_pool_errors_total", host=None)
+            raise
+        finally:
+            metrics.observe("db_pool_wait_seconds", time.monotonic() - start, host=None)
+
+
+class PoolMonitor:
+    """Count the connections that are checked out of the pool."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self._lock = threading.Lock()
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out -= 1
+
+    def record_metrics(self):
+        metrics.set("db_pool_size", self.pool.size() if hasattr(self.pool, "size") else 0)
+        metrics.set("db_pool_checked_out", self.checked_out)
+        metrics.set("db_pool_checked_out_max", self.max_checked_out)
+
+
+def _get_engine_args(config, threads):
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    if uri in ("sqlite://", "sqlite:///:memory:"):
+        # The in-memory databases can't have a pool of connections
+        return {}
+    pool_size = config.get("CRAWLER_DB_POOL_SIZE") or threads + EXTRA_CONNECTIONS
+    return {
+        "poolclass": MonitoredQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": config.get("CRAWLER_DB_MAX_OVERFLOW", 5),
+        "pool_timeout": config.get("CRAWLER_DB_POOL_TIMEOUT", 30),
+    }
+
+
+def get_crawler_db_manager(config, threads=1):
+    """Return the database manager shared by all the crawler threads.
+
+    It is created on the first call, with a connection pool sized for ``threads`` worker
+    threads. Its sessions are thread-local.
+    """
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    with _lock:
+        db_manager = _db_managers.get(uri)
+        if db_manager is None:
+            engine_args = _get_engine_args(config, threads)
+            db_manager = get_db_manager(config, **engine_args)
+            db_manager.pool_monitor = PoolMonitor(db_manager.engine.pool)
+            logger.debug("Database connection pool: %s", engine_args.get("pool_size", "default"))
+            _db_managers[uri] = db_manager
+    return db_manager
+
+
+def record_pool_metrics():
+    with _lock:
+        db_managers = list(_db_managers.values())
+    for db_manager in db_managers:
+        db_manager.pool_monitor.record_metrics()
@@ -1,65 +1,221 @@
 import ftplib
 import logging
+import re
 from contextlib import suppress
 from ftplib import FTP
 from urllib.parse import urlsplit
 
-from mirrormanager2 import lib as mmlib
-
 from .connector import Connector, TryLater
 from .constants import CONNECTION_TIMEOUT
+from .listing import DEFAULT_MAX_ENTRIES, INVALID_SIZE, FileListing, ListingTooLarge
+from .metrics import metrics
+from .sampling import order_files
 
 logger = logging.getLogger(__name__)
 
+# The beginning of a line of "ls -l": file type and permissions
+LS_MODE_RE = re.compile(r"^[-dlbcpsD][-rwxsStTlL]{9}")
+
+
+def parse_list_line(line):
+    """Parse a line of the output of the LIST command (like ``ls -l``).
+
+    The lines look like this::
+
+        -rw-r--r--    1 ftp      ftp          4321 Jul 05  2017 file with spaces
+        lrwxrwxrwx    1 ftp      ftp             4 Jul 05 10:00 link -> file
+
+    :returns: a tuple of the name, the size and the type (``file``, ``dir`` or ``link``) of
+        the entry, or None if the line can't be parsed.
+    """
+    fields = line.split(None, 8)
+    if len(fields) < 9 or not LS_MODE_RE.match(fields[0]):
+        # some servers first include a line starting with the word 'total'
+        # that we can ignore
+        return None
+    mode, size, name = fields[0], fields[4], fields[8]
+    if mode.startswith("d"):
+        return name, None, "dir"
+    if mode.startswith("l"):
+        return name.split(" -> ", 1)[0], None, "link"
+    try:
+        size = int(size)
+    except ValueError:
+        size = INVALID_SIZE
+    return name, size, "file"
+
+
+def parse_list(lines):
+    results = {}
+    for line in lines:
+        entry = parse_list_line(line)
+        if entry is None:
+            continue
+        name, size, entry_type = entry
+        if entry_type != "dir":
+            results[name] = {"size": size}
+    return results
+
+
+def parse_mlsd(entries):
+    results = {}
+    for name, facts in entries:
+        entry_type = facts.get("type", "").lower()
+        if entry_type == "file":
+            results[name] = {"size": facts.get("size")}
+        elif entry_type.startswith("os.unix=slink"):
+            results[name] = {"size": None}
+    return results
+
+
+class RecursiveFTPListing(FileListing):
+    """A :class:`FileListing` filled from the output of ``LIST -R``.
+
+    The entries of each sub-directory are preceded by its path, like ``ls -lR`` does::
+
+        ./releases/26:
+        -rw-r--r--    1 ftp      ftp          4321 Jul 05  2017 file
+    """
+
+    def __init__(self, root, max_entries=None):
+        super().__init__(max_entries=max_entries)
+        self.root = root.rstrip("/")
+        self.current_dir = ""
+        self.has_subdirs = False
+        self.has_headers = False
+
+    def _get_relative_path(self, path):
+        if self.root and path.startswith(f"{self.root}/"):
+            path = path[len(self.root) + 1 :]
+        elif path == self.root:
+            path = ""
+        if path.startswith("./"):
+            path = path[2:]
+        if path in (".", "/"):
+            path = ""
+        return path.strip("/")
+
+    def parse_line(self, line):
+        if not line.strip():
+            return
+        if line.endswith(":") and not LS_MODE_RE.match(line):
+            self.has_headers = True
+            self.current_dir = self._get_relative_path(line[:-1])
+            return
+        entry = parse_list_line(line)
+        if entry is None:
+            if not line.startswith("total"):
+                self.invalid_lines += 1
+            return
+        name, size, entry_type = entry
+        if entry_type == "dir":
+            self.has_subdirs = True
+            return
+        path = f"{self.current_dir}/{name}" if self.current_dir else name
+        if entry_type == "link":
+            # The size of the symlinks is not checked, but the listing only stores integers
+            self.add(path, 0, True)
+        else:
+            self.add(path, size, False)
+
+    @property
+    def is_complete(self):
+        """Whether the server actually listed the sub-directories"""
+        return self.has_headers or not self.has_subdirs
+
 
 class FTPConnector(Connector):
+    scheme = "ftp"
+
+    def __init__(self, *args, recursive=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recursive = recursive
+        self._has_mlsd = None
+        # Category URL -> RecursiveFTPListing, or None if it could not be listed
+        self._scan_results = {}
+
     def _connect(self):
-        conn = FTP(self.netloc, timeout=CONNECTION_TIMEOUT)
+        netloc = urlsplit(f"//{self._netloc}")
+        conn = FTP(timeout=CONNECTION_TIMEOUT)
         conn.set_debuglevel(self.debuglevel)
-        conn.login()
+        metrics.inc("connections_total", protocol=self.scheme)
+        with metrics.timer("connect_duration_seconds", protocol=self.scheme):
+            conn.connect(netloc.hostname, netloc.port or 0)
+            conn.login()
         return conn
 
     def _close(self):
         with suppress(Exception):
             self._connection.quit()
 
+    def _reconnect(self):
+        # Don't use close(), it would remove this connector from the pool
+        if self._connection is not None:
+            self._close()
+            self._connection = None
+
+    def _supports_mlsd(self, conn):
+        if self._has_mlsd is None:
+            try:
+                features = conn.sendcmd("FEAT")
+            except ftplib.all_errors:
+                features = ""
+            self._has_mlsd = any(
+                line.strip().upper().startswith("MLST") for line in features.splitlines()[1:]
+            )
+            logger.debug("MLSD support on %s: %s", self._netloc, self._has_mlsd)
+        return self._has_mlsd
+
     def _ftp_dir(self, url):
         try:
             conn = self.get_connection()
         except Exception:
             return None
         scheme, netloc, path, query, fragment = urlsplit(url)
+        if self._supports_mlsd(conn):
+            try:
+                with self._measure_request("MLSD"):
+                    entries = list(conn.mlsd(path))
+                return parse_mlsd(entries)
+            except ftplib.error_perm as e:
+                if not str(e).startswith(("500", "502")):
+                    raise
+                logger.debug("MLSD is advertised but not supported on %s: %s", self._netloc, e)
+                self._has_mlsd = False
+
         results = []
 
         def _callback(line):
             if self.debuglevel > 0:
                 logger.info(line)
             results.append(line)
+            self._count_received(len(line) + 2)
 
-        conn.dir(path, _callback)
-        return results
+        with self._measure_request("LIST"):
+            conn.dir(path, _callback)
+        return parse_list(results)
 
     def get_ftp_dir(self, url, readable, i=0):
         if i > 1:
             raise TryLater("Too many FTP 530 errors")
 
         try:
-            listing = self._ftp_dir(url)
+            return self._ftp_dir(url)
         except ftplib.error_perm as e:
             # Returned by Princeton University when directory does not exist
             if str(e).startswith("550"):
-                return []
+                return {}
             # Returned by Princeton University when directory isn't readable
             # (pre-bitflip)
             if str(e).startswith("553"):
                 if readable:
-                    return []
+                    return {}
                 else:
                     return None
             # Returned by ftp2.surplux.net when cannot log in due to connection
             # restrictions
             if str(e).startswith("530"):
-                self.close_ftp(url)
+                self._reconnect()
                 return self.get_ftp_dir(url, readable, i + 1)
             if str(e).startswith("500"):  # Oops
                 raise TryLater(f"Got FTP 500 error: {e}") from e
@@ -69,7 +225,7 @@ class FTPConnector(Connector):
         except ftplib.error_temp as e:
             # Returned by Boston University when directory does not exist
             if str(e).startswith("450"):
-                return []
+                return {}
             # Returned by Princeton University when cannot log in due to
             # connection restrictions
             if str(e).startswith("421"):
@@ -82,26 +238,16 @@ class FTPConnector(Connector):
                 logger.error(f"unknown error {e} on {url}")
                 raise
         except (OSError, EOFError):
-            self.close(url)
+            self._reconnect()
             return self.get_ftp_dir(url, readable, i + 1)
 
-        results = {}
-        for line in listing:
-            if line.startswith("total"):
-                # some servers first include a line starting with the word 'total'
-                # that we can ignore
-                continue
-            fields = line.split()
-            try:
-                results[fields[8]] = {"size": fields[4]}
-            except IndexError:  # line doesn't have 8 fields, it's not a dir line
-                pass
-        return results
-
     def compare_sha256(self, d, filename, graburl):
         return True  # Not implemented on FTP
 
     def _check_file(self, current_file_info, db_file_info):
+        if current_file_info["size"] is None:
+            # Symlinks, or no size in the MLSD facts
+            return True
         try:
             return float(current_file_info["size"]) == float(db_file_info["size"])
         except Exception:
@@ -112,11 +258,72 @@ class FTPConnector(Connector):
         if results is None:
             return None
 
-        with mmlib.instance_attribute(directory, "files") as files:
-            # Getting Directory.files is a bit expensive, involves json decoding
-            for filename in files:
-                status = self._check_file(results[filename], files[filename])
-                if not status:
-                    # Shortcut: we don't need to go over other files
-                    return False
+        for filename, filedata in order_files(directory.files):
+            try:
+                current_file_info = results[filename]
+            except KeyError:
+                logger.debug("Missing remote file %s/%s", url, filename)
+                return False
+            status = self._check_file(current_file_info, filedata)
+            if not status:
+                # Shortcut: we don't need to go over other files
+                return False
         return True
+
+    def _list_recursive(self, url):
+        """List the whole category with a single LIST -R command.
+
+        Returns None if the server does not support it.
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        listing = RecursiveFTPListing(
+            path,
+            max_entries=self._config.get("CRAWLER_LISTING_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+        )
+
+        def _callback(line):
+            self._count_received(len(line) + 2)
+            listing.parse_line(line)
+
+        try:
+            conn = self.get_connection()
+            conn.cwd(path or "/")
+            with self._measure_request("LIST -R"):
+                conn.retrlines("LIST -R", _callback)
+        except ListingTooLarge as e:
+            logger.warning("Could not list %s recursively: %s", url, e)
+            # Don't leave the rest of the listing in the data connection
+            self._reconnect()
+            return None
+        except ftplib.all_errors as e:
+            logger.info("Could not list %s recursively: %s", url, e)
+            self._reconnect()
+            return None
+        if not listing.is_complete:
+            logger.info("The server of %s does not support recursive listings", url)
+            return None
+        logger.debug(
+            "Recursive FTP listing of %s has %d files (%d invalid lines)",
+            url,
+            len(listing),
+            listing.invalid_lines,
+        )
+        return listing
+
+    def check_category(
+        self,
+        url,
+        directory,
+        category_prefix_length,
+    ):
+        if not self.recursive:
+            return super().check_category(url, directory, category_prefix_length)
+        # List only once for the entire category
+        if url not in self._scan_results:
+            self._scan_results[url] = self._list_recursive(url)
+        listing = self._scan_results[url]
+        if listing is None:
+            # Go directory by directory
+            return super().check_category(url, directory, category_prefix_length)
+        dirname = directory.name[category_prefix_length:]
+        return listing.check_directory(dirname, directory.files)
@@ -1,28 +1,52 @@
+import hashlib
 import logging
 from contextlib import suppress
 
 import requests
 
-from mirrormanager2 import lib as mmlib
-
+from .autoindex import detect_autoindex_format, parse_autoindex
 from .connector import Connector, FetchingFailed, TryLater
 from .constants import CONNECTION_TIMEOUT, REPODATA_FILE
+from .sampling import order_files
 
 logger = logging.getLogger(__name__)
 
+HEADERS = {
+    "Connection": "Keep-Alive",
+    "Pragma": "no-cache",
+    "User-Agent": "mirrormanager-crawler/0.1 (+https://github.com/fedora-infra/mirrormanager2/)",
+}
+
 
 class HTTPConnector(Connector):
+    scheme = "http"
+
+    def __init__(self, *args, autoindex=False, shared_pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autoindex = autoindex
+        # A SharedHTTPPool, to reuse the connections of the other hosts on the same netloc
+        self.shared_pool = shared_pool
+        # The directory index format of this host: None if it is not known yet, False if the
+        # host has no usable directory index.
+        self._autoindex_format = None
+
     def _connect(self):
         session = requests.Session()
-        session.headers = {
-            "Connection": "Keep-Alive",
-            "Pragma": "no-cache",
-            "User-Agent": "mirrormanager-crawler/0.1 (+https://"
-            "github.com/fedora-infra/mirrormanager2/)",
-        }
+        session.headers = HEADERS.copy()
+        if self.shared_pool is not None:
+            session.mount(
+                self._get_mount_prefix(), self.shared_pool.acquire(self.scheme, self._netloc)
+            )
         return session
 
+    def _get_mount_prefix(self):
+        return f"{self.scheme}://{self._netloc}/"
+
     def _close(self):
+        if self.shared_pool is not None:
+            # Closing the session would close the shared connections
+            self._connection.adapters.pop(self._get_mount_prefix(), None)
+            self.shared_pool.release(self.scheme, self._netloc)
         self._connection.close()
 
     def check_url(self, url):
@@ -37,16 +61,25 @@ class HTTPConnector(Connector):
         None - we don't know
         """
         try:
-            response = conn.head(url, timeout=CONNECTION_TIMEOUT)
-            response.raise_for_status()
+            with self._measure_request("HEAD"):
+                response = conn.head(url, timeout=CONNECTION_TIMEOUT)
         except requests.Timeout as e:
             raise TryLater(f"HTTP timeout: {e}") from e
-        except requests.HTTPError as e:
-            response = e.response
-            if response.status_code in (404, 410):
+        except requests.RequestException as e:
+            logger.debug("Could not get the content length for %s: %s", url, e)
+            return None
+        return self._check_response(url, response.status_code, response.headers, filedata, readable)
+
+    def _check_response(self, url, status_code, headers, filedata, readable):
+        """Interpret the response to a HEAD request on a file.
+
+        This is shared by all the HTTP engines, see :meth:`_check_file` for the return values.
+        """
+        if status_code >= 400:
+            if status_code in (404, 410):
                 # Not Found / Gone
                 return False
-            if response.status_code == 403:
+            if status_code == 403:
                 # may be a hidden dir still
                 if readable:
                     # It should be readable but it's not
@@ -54,15 +87,11 @@ class HTTPConnector(Connector):
                 else:
                     # This 403 is allowed
                     return None
-            logger.debug("Could not get the content length for %s: %s", url, response)
-            return None
-        except requests.RequestException as e:
-            logger.debug("Could not get the content length for %s: %s", url, e)
+            logger.debug("Could not get the content length for %s: HTTP %s", url, status_code)
             return None
 
-        try:
-            content_length = response.headers["Content-Length"]
-        except KeyError:
+        content_length = headers.get("Content-Length")
+        if content_length is None:
             logger.debug("No content length header for %s", url)
             return True
 
@@ -81,39 +110,142 @@ class HTTPConnector(Connector):
         # handle streaming/chunked return or zero-length file
         return True
 
+    def _get_listing(self, url):
+        """Return the status code, the content type and the body of a directory index page"""
+        conn = self.get_connection()
+        with self._measure_request("GET"):
+            response = conn.get(url, timeout=CONNECTION_TIMEOUT)
+        self._count_received(len(response.content))
+        return response.status_code, response.headers.get("Content-Type"), response.text
+
+    def _check_listing(self, url, directory):
+        """Check the files of a directory with a single request on its directory index.
+
+        Returns the names of the files that are listed with the exact expected size, or False
+        if a file has the wrong size. The files that are not listed (some web servers hide the
+        README files for example) or only with a rounded size must still be checked one by
+        one.
+        """
+        if not self.autoindex or self._autoindex_format is False or not directory.files:
+            return set()
+        try:
+            status_code, content_type, body = self._get_listing(f"{url}/")
+        except Exception as e:
+            logger.debug("Could not get the directory index of %s: %s", url, e)
+            return set()
+        if status_code != 200:
+            if status_code in (401, 403) and directory.readable and not self._autoindex_format:
+                logger.info("No directory index on %s, checking the files one by one", url)
+                self._autoindex_format = False
+            return set()
+        autoindex_format = self._autoindex_format or detect_autoindex_format(content_type, body)
+        if autoindex_format is None:
+            logger.info("Unknown directory index on %s, checking the files one by one", url)
+            self._autoindex_format = False
+            return set()
+        listing = parse_autoindex(body, autoindex_format)
+        if listing is None:
+            return set()
+        if self._autoindex_format is None:
+            logger.debug("Using the %s directory index on %s", autoindex_format, self._netloc)
+            self._autoindex_format = autoindex_format
+
+        listed = set()
+        for filename, filedata in order_files(directory.files):
+            listed_file = listing.get(filename)
+            if listed_file is None:
+                continue
+            if not listed_file.matches(filedata["size"]):
+                logger.debug(
+                    "Found %s/%s with size %s, but expected %s",
+                    url,
+                    filename,
+                    listed_file.size,
+                    filedata["size"],
+                )
+                return False
+            if listed_file.tolerance == 0:
+                # The rounded sizes can hide a truncated file, check it with a HEAD request
+                listed.add(filename)
+        return listed
+
     def _check_dir(self, url, directory):
         try:
             conn = self.get_connection()
         except Exception as e:
             logger.info(f"Could not get {url}: {e}")
             return None
-        with mmlib.instance_attribute(directory, "files") as files:
-            # Getting Directory.files is a bit expensive, involves json decoding
-            for filename in files:
-                file_url = f"{url}/{filename}"
-                exists = self._check_file(conn, file_url, files[filename], directory.readable)
-                if filename == REPODATA_FILE and exists:
-                    # Additional optional check
-                    with suppress(Exception):
-                        exists = self.compare_sha256(directory, filename, file_url)
-                if exists in (False, None):
-                    # Shortcut: we don't need to go over other files
-                    return exists
+        listed = self._check_listing(url, directory)
+        if listed is False:
+            return False
+        for filename, filedata in order_files(directory.files):
+            file_url = f"{url}/{filename}"
+            if filename in listed:
+                exists = True
+            else:
+                exists = self._check_file(conn, file_url, filedata, directory.readable)
+            if filename == REPODATA_FILE and exists:
+                # Additional optional check
+                with suppress(Exception):
+                    exists = self.compare_sha256(directory, filename, file_url)
+            if exists in (False, None):
+                # Shortcut: we don't need to go over other files
+                return exists
         return True
 
-    def _get_file(self, url):
+    def _get_file_conditional(self, url, headers=None):
+        """Download a file, with additional request headers.
+
+        Returns the status code, the response headers and the content, which is None if the
+        file was not modified (HTTP 304).
+        """
         conn = self.get_connection()
         try:
-            r = conn.get(
-                url,
-                timeout=CONNECTION_TIMEOUT,
-            )
+            with self._measure_request("GET"):
+                r = conn.get(
+                    url,
+                    headers=headers,
+                    timeout=CONNECTION_TIMEOUT,
+                )
         except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout) as e:
             raise FetchingFailed() from e
+        if r.status_code == 304:
+            return r.status_code, r.headers, None
         if not r.ok:
             raise FetchingFailed(r)
-        return r.content
+        self._count_received(len(r.content))
+        return r.status_code, r.headers, r.content
+
+    def _get_file(self, url):
+        return self._get_file_conditional(url)[2]
+
+    def get_sha256_cached(self, url, cache=None):
+        if cache is None:
+            return self.get_sha256(url)
+        cached = cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        status_code, response_headers, content = self._get_file_conditional(url, headers)
+        if content is None:
+            if cached is None:
+                # We did not ask for it
+                raise FetchingFailed()
+            logger.debug("%s has not changed since the last check", url)
+            cache.touch(url)
+            return cached["sha256"]
+        sha256 = hashlib.sha256(content).hexdigest()
+        cache.set(
+            url,
+            sha256,
+            etag=response_headers.get("ETag"),
+            last_modified=response_headers.get("Last-Modified"),
+        )
+        return sha256
 
 
 class HTTPSConnector(HTTPConnector):
-    pass
+    scheme = "https"
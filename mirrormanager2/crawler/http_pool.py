@@ -0,0 +1,209 @@
+import dataclasses
+import logging
+import os
+import socket
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool, PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NewConnectionError
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DNS_FAMILIES = {"ipv4": socket.AF_INET, "ipv6": socket.AF_INET6}
+
+
+class DNSCache:
+    """Resolve each host name once per run.
+
+    The addresses are sorted with those of the ``family`` (``ipv4`` or ``ipv6``) first, the
+    others are only tried if none of them can be reached.
+    """
+
+    def __init__(self, family=None):
+        if family is not None and family not in DNS_FAMILIES:
+            raise ValueError(f"Unknown address family: {family}")
+        self.family = DNS_FAMILIES.get(family)
+        self._addresses = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """Return the IP addresses of the host, raise socket.gaierror if there are none"""
+        key = (host, port)
+        with self._lock:
+            if key in self._addresses:
+                return self._addresses[key]
+        with metrics.timer("dns_duration_seconds"):
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = []
+        for *_info, sockaddr in sorted(infos, key=lambda info: info[0] != self.family):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        with self._lock:
+            self._addresses[key] = addresses
+        return addresses
+
+
+class _DNSCachingMixin:
+    """Open the connections to the addresses of the :class:`DNSCache`"""
+
+    def __init__(self, *args, dns_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dns_cache = dns_cache
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        try:
+            addresses = self.dns_cache.resolve(dns_host, self.port)
+        except (OSError, UnicodeError):
+            # Let urllib3 report the error
+            return super()._new_conn()
+        error = None
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError as e:
+                    error = e
+        finally:
+            self._dns_host = dns_host
+        raise error
+
+    def connect(self):
+        metrics.inc("connections_total", protocol="http")
+        with metrics.timer("connect_duration_seconds", protocol="http"):
+            super().connect()
+
+
+class _HTTPConnection(_DNSCachingMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_DNSCachingMixin, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _PoolManager(PoolManager):
+    def __init__(self, *args, dns_cache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dns_cache = dns_cache
+        self.pool_classes_by_scheme = {"http": _HTTPConnectionPool, "https": _HTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        # Not in the connection pool keyword arguments, urllib3 would make it part of the key
+        pool.conn_kw["dns_cache"] = self.dns_cache
+        return pool
+
+
+class DNSCachingAdapter(HTTPAdapter):
+    def __init__(self, dns_cache, **kwargs):
+        self.dns_cache = dns_cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _PoolManager(
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            dns_cache=self.dns_cache,
+            **pool_kwargs,
+        )
+
+
+@dataclasses.dataclass
+class _PoolEntry:
+    adapter: HTTPAdapter
+    # Number of connectors using it
+    users: int = 0
+    last_used: float = 0
+
+
+class SharedHTTPPool:
+    """Share the HTTP connections of a process between the hosts and their categories.
+
+    Several hosts are often served by the same server or CDN: the connectors of the same
+    scheme and netloc use the same urllib3 pool, with at most ``max_connections``
+    connections, which are kept alive from one host to the next instead of being opened
+    again. The pools that no connector has used for ``idle_timeout`` seconds are closed.
+    """
+
+    def __init__(self, max_connections=4, idle_timeout=60, dns_cache=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.dns_cache = dns_cache or DNSCache()
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._pid = os.getpid()
+
+    @classmethod
+    def from_options(cls, config, options):
+        if not options.get("shared_http_pool"):
+            return None
+        return cls(
+            max_connections=config.get("CRAWLER_HTTP_POOL_MAX_CONNECTIONS", 4),
+            idle_timeout=config.get("CRAWLER_HTTP_POOL_IDLE_TIMEOUT", 60),
+            dns_cache=DNSCache(config.get("CRAWLER_DNS_FAMILY")),
+        )
+
+    def _check_pid(self):
+        # The connections of the parent process can't be shared with the forked ones
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pools = {}
+
+    def _evict_idle(self, now):
+        for key, entry in list(self._pools.items()):
+            if entry.users == 0 and now - entry.last_used > self.idle_timeout:
+                logger.debug("Closing the idle connections to %s://%s", *key)
+                entry.adapter.close()
+                del self._pools[key]
+
+    def acquire(self, scheme, netloc):
+        """Return the adapter of the scheme and netloc, to mount in a requests session"""
+        key = (scheme, netloc)
+        with self._lock:
+            self._check_pid()
+            self._evict_idle(time.monotonic())
+            entry = self._pools.get(key)
+            if entry is None:
+                adapter = DNSCachingAdapter(
+                    self.dns_cache,
+                    pool_maxsize=self.max_connections,
+                    # Wait for a connection instead of opening more
+                    pool_block=True,
+                )
+                entry = self._pools[key] = _PoolEntry(adapter)
+            entry.users += 1
+            return entry.adapter
+
+    def release(self, scheme, netloc):
+        """The connector that acquired the adapter does not need it anymore"""
+        with self._lock:
+            entry = self._pools.get((scheme, netloc))
+            if entry is None:
+                return
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+
+    def close_all(self):
+        with self._lock:
+            for entry in self._pools.values():
+                entry.adapter.close()
+            self._pools = {}
@@ -0,0 +1,115 @@
+import dataclasses
+import logging
+import random
+import time
+
+from .states import CrawlMode
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CrawlPlan:
+    mode: CrawlMode
+    # The category, or a view of it with only the directories to check
+    category: object
+    # The newest Directory.ctime of the whole category, if it is known
+    newest_ctime: int | None = None
+
+
+class IncrementalCategory:
+    """Same interface as CategorySnapshot, but only with the directories to re-check."""
+
+    def __init__(self, category, directories):
+        self.id = category.id
+        self.name = category.name
+        self.topdir_name = category.topdir_name
+        self.directories = tuple(directories)
+
+    def count_directories(self, only_repodata=False):
+        return sum(1 for _ in self.get_directories(only_repodata))
+
+    def get_directories(self, only_repodata=False):
+        if only_repodata:
+            return (d for d in self.directories if d.is_repodata)
+        return iter(self.directories)
+
+
+def plan_crawl(config, hc, category, stale=frozenset(), now=None, rng=random):
+    """Choose how a host category must be crawled in incremental mode.
+
+    - a full crawl if it has never been crawled, if the last full crawl is too old,
+      or if too many directories changed since the last successful crawl;
+    - a repodata crawl if no directory changed and none is stale;
+    - an incremental crawl of the changed and the stale directories otherwise.
+
+    A random sample of the other directories is checked in the last two modes, to notice
+    the mirrors that lost content even though nothing changed on the master mirror.
+
+    :arg stale: the names of the directories that were not up2date on the host, they are
+        re-checked until the host catches up.
+    """
+    if now is None:
+        now = int(time.time())
+    full_interval = config.get("CRAWLER_INCREMENTAL_FULL_INTERVAL", 24) * 3600
+    if hc.last_verified is None or hc.last_full_crawl is None:
+        logger.debug("Category %s has never been fully crawled", category.name)
+        return CrawlPlan(mode=CrawlMode.FULL, category=category)
+    if now - hc.last_full_crawl > full_interval:
+        logger.debug("The last full crawl of category %s is too old", category.name)
+        return CrawlPlan(mode=CrawlMode.FULL, category=category)
+
+    sample_ratio = config.get("CRAWLER_INCREMENTAL_SAMPLE", 0.05)
+    total = 0
+    changed = []
+    stale_directories = []
+    repodata = []
+    sample = []
+    newest_ctime = 0
+    for directory in category.get_directories():
+        total += 1
+        ctime = directory.ctime or 0
+        newest_ctime = max(newest_ctime, ctime)
+        if ctime > hc.last_verified:
+            changed.append(directory)
+        elif directory.name in stale:
+            stale_directories.append(directory)
+        elif directory.is_repodata:
+            repodata.append(directory)
+        elif rng.random() < sample_ratio:
+            sample.append(directory)
+
+    max_changed = config.get("CRAWLER_INCREMENTAL_MAX_CHANGED", 0.5)
+    if total and len(changed) > total * max_changed:
+        logger.debug(
+            "%s of the %s directories of category %s changed", len(changed), total, category.name
+        )
+        return CrawlPlan(mode=CrawlMode.FULL, category=category, newest_ctime=newest_ctime)
+    if changed or stale_directories:
+        mode = CrawlMode.INCREMENTAL
+        # The repodata directories are sampled like the others
+        directories = (
+            changed
+            + stale_directories
+            + [d for d in repodata if rng.random() < sample_ratio]
+            + sample
+        )
+    else:
+        mode = CrawlMode.REPODATA
+        directories = repodata + sample
+    directories.sort(key=lambda d: d.name)
+    logger.debug(
+        "Crawling category %s in %s mode: %s changed, %s stale and %s sampled directories "
+        "out of %s",
+        category.name,
+        mode.value,
+        len(changed),
+        len(stale_directories),
+        len(directories) - len(changed) - len(stale_directories),
+        total,
+    )
+    return CrawlPlan(
+        mode=mode,
+        category=IncrementalCategory(category, directories),
+        newest_ctime=newest_ctime,
+    )
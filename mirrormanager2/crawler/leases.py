@@ -0,0 +1,201 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from mirrormanager2.lib import model
+
+from .database import get_crawler_db_manager
+from .reporter import store_crawl_result
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseManager:
+    """Share the hosts of a crawl run between several crawler nodes.
+
+    Before crawling a host, a node leases it in the ``crawl_lease`` table, and it renews the
+    leases of the hosts it is crawling every ``heartbeat`` seconds. If the node stops, its
+    leases expire and the other nodes crawl those hosts. A host is crawled once per run: the
+    nodes of a run use the same ``run_id``.
+
+    On PostgreSQL the rows leased by other nodes are skipped with ``SKIP LOCKED``. On SQLite
+    the lease is taken with a conditional update (compare and set), which only one node can
+    win.
+    """
+
+    def __init__(self, config, options, run_id, node_id, duration=300, heartbeat=60):
+        self.config = config
+        self.options = options
+        self.run_id = run_id
+        self.node_id = node_id
+        self.duration = duration
+        self.heartbeat = heartbeat
+        self._held = set()
+        self._lock = threading.Lock()
+        self._heartbeat_pid = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_options(cls, config, options):
+        return cls(
+            config,
+            options,
+            run_id=options["work_queue"],
+            node_id=options.get("node_id") or get_default_node_id(),
+            duration=config.get("CRAWLER_LEASE_DURATION", 300),
+            heartbeat=config.get("CRAWLER_LEASE_HEARTBEAT", 60),
+        )
+
+    @property
+    def _db_manager(self):
+        return get_crawler_db_manager(self.config)
+
+    def _is_available(self, now):
+        lease = model.CrawlLease
+        return sa.or_(
+            lease.run_id.is_(None),
+            lease.run_id != self.run_id,
+            # The node that had it has stopped
+            sa.and_(lease.finished_at.is_(None), lease.expires_at < now),
+        )
+
+    def _create_lease(self, session, host_id):
+        dialect = session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            session.execute(
+                insert(model.CrawlLease).values(host_id=host_id).on_conflict_do_nothing()
+            )
+            return
+        try:
+            with session.begin_nested():
+                session.execute(sa.insert(model.CrawlLease).values(host_id=host_id))
+        except IntegrityError:
+            pass
+
+    def acquire(self, host_id):
+        """Lease the host, return False if another node has it or has already crawled it"""
+        self._start_heartbeat()
+        lease = model.CrawlLease
+        now = int(time.time())
+        with self._db_manager.Session() as session:
+            self._create_lease(session, host_id)
+            session.commit()
+            if session.get_bind().dialect.name == "postgresql":
+                locked = session.execute(
+                    sa.select(lease.host_id)
+                    .where(lease.host_id == host_id, self._is_available(now))
+                    .with_for_update(skip_locked=True)
+                ).first()
+                if locked is None:
+                    session.rollback()
+                    return False
+            result = session.execute(
+                sa.update(lease)
+                .where(lease.host_id == host_id, self._is_available(now))
+                .values(
+                    run_id=self.run_id,
+                    node_id=self.node_id,
+                    expires_at=now + self.duration,
+                    finished_at=None,
+                )
+            )
+            session.commit()
+        if result.rowcount != 1:
+            return False
+        with self._lock:
+            self._held.add(host_id)
+        return True
+
+    def get_retry_delay(self, host_id):
+        """Return in how many seconds the host can be leased again, or None if it has
+        already been crawled in this run.
+
+        Called when :meth:`acquire` failed: another node has the host, and if it stops, its
+        lease expires.
+        """
+        now = int(time.time())
+        with self._db_manager.Session() as session:
+            lease = session.get(model.CrawlLease, host_id)
+            if lease is None or lease.run_id != self.run_id:
+                # Another node was leasing it at the same time
+                return 1
+            if lease.finished_at is not None:
+                return None
+            return max(1, (lease.expires_at or now) - now + 1)
+
+    def release(self, host_id, result=None):
+        """Record the result of the crawl of the host and mark it as done in this run"""
+        lease = model.CrawlLease
+        with self._lock:
+            self._held.discard(host_id)
+        with self._db_manager.Session() as session:
+            if result is not None:
+                store_crawl_result(self.config, self.options, session, result)
+            updated = session.execute(
+                sa.update(lease)
+                .where(
+                    lease.host_id == host_id,
+                    lease.run_id == self.run_id,
+                    lease.node_id == self.node_id,
+                )
+                .values(finished_at=int(time.time()), expires_at=None)
+            )
+            session.commit()
+        if updated.rowcount != 1:
+            logger.warning("The lease of host %s had been taken over by another node", host_id)
+
+    def renew(self):
+        """Extend the leases of the hosts being crawled"""
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
+        lease = model.CrawlLease
+        with self._db_manager.Session() as session:
+            result = session.execute(
+                sa.update(lease)
+                .where(
+                    lease.host_id.in_(held),
+                    lease.run_id == self.run_id,
+                    lease.node_id == self.node_id,
+                    lease.finished_at.is_(None),
+                )
+                .values(expires_at=int(time.time()) + self.duration)
+            )
+            session.commit()
+        if result.rowcount < len(held):
+            logger.warning(
+                "%s of the %s leases have been taken over by other nodes",
+                len(held) - result.rowcount,
+                len(held),
+            )
+
+    def _start_heartbeat(self):
+        with self._lock:
+            # Threads don't survive a fork, each process has its own heartbeat
+            if self._heartbeat_pid == os.getpid():
+                return
+            self._heartbeat_pid = os.getpid()
+        thread = threading.Thread(target=self._run_heartbeat, name="lease-heartbeat", daemon=True)
+        thread.start()
+
+    def _run_heartbeat(self):
+        while not self._stopped.wait(self.heartbeat):
+            try:
+                self.renew()
+            except Exception:
+                logger.exception("Could not renew the crawl leases")
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,124 @@
+import logging
+import os
+from array import array
+
+from .sampling import order_files
+
+logger = logging.getLogger(__name__)
+
+# Marks a size that could not be parsed, it will never match
+INVALID_SIZE = -1
+
+# Around 1.5 GB of memory per crawled host at most, see FileListing
+DEFAULT_MAX_ENTRIES = 10_000_000
+
+
+class ListingTooLarge(Exception):
+    pass
+
+
+class ListedDirectory:
+    """The files of a directory in a recursive listing.
+
+    The filenames point to their position in the sizes array and the symlinks bytearray. The
+    positions are small integers that Python does not allocate separately for directories with
+    less than 256 files, which is most of them.
+    """
+
+    __slots__ = ("names", "sizes", "symlinks")
+
+    def __init__(self):
+        self.names = {}
+        self.sizes = array("q")
+        self.symlinks = bytearray()
+
+    def add(self, name, size, is_symlink):
+        index = self.names.get(name)
+        if index is None:
+            self.names[name] = len(self.sizes)
+            self.sizes.append(size)
+            self.symlinks.append(is_symlink)
+        else:
+            self.sizes[index] = size
+            self.symlinks[index] = is_symlink
+
+    def get(self, name):
+        """Return the size of a file and whether it is a symlink, or None if it is missing."""
+        index = self.names.get(name)
+        if index is None:
+            return None
+        return self.sizes[index], bool(self.symlinks[index])
+
+    def __len__(self):
+        return len(self.names)
+
+
+class FileListing:
+    """A compact copy of the recursive listing of a category on a mirror.
+
+    Only the files and the symlinks are kept, grouped by directory, with their size. The
+    directory entries themselves are not stored, the crawler only looks for files.
+
+    Each file takes around 100 bytes plus the length of its name. The number of files is
+    limited by ``max_entries``, :class:`ListingTooLarge` is raised above it.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._directories = {}
+        self.entries = 0
+        self.invalid_lines = 0
+
+    def add(self, path, size, is_symlink=False):
+        dirname, name = os.path.split(path)
+        try:
+            directory = self._directories[dirname]
+        except KeyError:
+            directory = self._directories[dirname] = ListedDirectory()
+        before = len(directory)
+        directory.add(name, size, is_symlink)
+        if len(directory) > before:
+            self.entries += 1
+            if self.max_entries is not None and self.entries > self.max_entries:
+                raise ListingTooLarge(f"The listing has more than {self.max_entries} files")
+
+    def get_directory(self, dirname):
+        """Return the :class:`ListedDirectory` for this path, or None if it is not listed."""
+        return self._directories.get(dirname)
+
+    def _check_file(self, path, listed_file_info, db_file_info):
+        size, is_symlink = listed_file_info
+        if is_symlink:
+            # ignore symlink size differences
+            return True
+
+        if size == INVALID_SIZE:
+            logger.debug("Invalid size value for file %s", path)
+            return False
+        try:
+            return float(size) == float(db_file_info["size"])
+        except (TypeError, ValueError):  # the size in the database is invalid
+            logger.debug("Invalid size value in the database for file %s", path)
+            return False
+
+    def check_directory(self, dirname, files):
+        """Check that the files of a directory are all listed with the expected size."""
+        if not files:
+            return True
+        listed_directory = self.get_directory(dirname)
+        if listed_directory is None:
+            logger.debug("Missing remote directory %s", dirname)
+            return False
+        for filename, filedata in order_files(files):
+            path = os.path.join(dirname, filename)
+            listed_file_info = listed_directory.get(filename)
+            if listed_file_info is None:  # file is not in the listing
+                logger.debug("Missing remote file %s", path)
+                return False
+            if not self._check_file(path, listed_file_info, filedata):
+                # Shortcut: we don't need to go over other files
+                return False
+        return True
+
+    def __len__(self):
+        return self.entries
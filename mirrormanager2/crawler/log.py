@@ -1,5 +1,8 @@
+import collections
+import gzip
 import logging
 import os
+import threading
 from contextlib import contextmanager
 
 from .threads import threadlocal
@@ -29,22 +32,95 @@ class MasterFilter(logging.Filter):
         return True
 
 
-# This filter is necessary to enable logging per thread into a separate file
-# Based on http://plumberjack.blogspot.de/2010/09/configuring-logging-for-web.html
-class InjectingFilter(logging.Filter):
-    """Check that the treadlocal variable has the attributes we want.
+class HostLogRouter(logging.Handler):
+    """Write the log records of each host being crawled to its own file.
 
-    Example: InjectingFilter(host_id=42) will only log if threadlocal.host_id == 42
+    There is a single handler for all the hosts: the records go to the file of the host that
+    the thread is crawling (``threadlocal.host_id``), if it has been registered with
+    :meth:`add_host`. At most ``max_open_files`` files are kept open, the least recently used
+    one is closed when another one must be opened. With ``compress``, the files are written
+    with gzip.
     """
 
-    def __init__(self, **kwargs):
-        self.args = kwargs
-
-    def filter(self, record):
+    def __init__(self, max_open_files=32, compress=False):
+        super().__init__(level=logging.DEBUG)
+        self.max_open_files = max_open_files
+        self.compress = compress
+        # host_id -> (path, level)
+        self._hosts = {}
+        # host_id -> file object, the most recently used last
+        self._files = collections.OrderedDict()
+
+    def add_host(self, host_id, path, level):
+        with self.lock:
+            self._hosts[host_id] = (path, level)
+
+    def remove_host(self, host_id):
+        with self.lock:
+            self._hosts.pop(host_id, None)
+            stream = self._files.pop(host_id, None)
+            if stream is not None:
+                stream.close()
+
+    def _open(self, path):
+        if self.compress:
+            # The runs are appended as separate gzip members, gzip reads them as one stream
+            return gzip.open(path, "at", encoding="utf-8")
+        return open(path, "a", encoding="utf-8")
+
+    def _get_file(self, host_id, path):
+        stream = self._files.get(host_id)
+        if stream is not None:
+            self._files.move_to_end(host_id)
+            return stream
+        while len(self._files) >= self.max_open_files:
+            _host_id, oldest = self._files.popitem(last=False)
+            oldest.close()
+        stream = self._files[host_id] = self._open(path)
+        return stream
+
+    def emit(self, record):
+        host_id = getattr(threadlocal, "host_id", None)
+        host = self._hosts.get(host_id)
+        if host is None:
+            return
+        path, level = host
+        if record.levelno < level:
+            return
         try:
-            return all(getattr(threadlocal, key) == value for key, value in self.args.items())
+            stream = self._get_file(host_id, path)
+            stream.write(self.format(record) + "\n")
+            if not self.compress:
+                # Compressing each record on its own would make the file much larger
+                stream.flush()
         except Exception:
-            return False
+            self.handleError(record)
+
+    def close(self):
+        with self.lock:
+            for stream in self._files.values():
+                stream.close()
+            self._files.clear()
+        super().close()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_host_log_router(config):
+    """Return the handler of the per-host log files, it is added to the root logger the
+    first time."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = HostLogRouter(
+                max_open_files=config.get("CRAWLER_LOG_MAX_OPEN_FILES", 32),
+                compress=config.get("CRAWLER_LOG_GZIP", False),
+            )
+            _router.setFormatter(thread_formatter)
+            logging.getLogger().addHandler(_router)
+        return _router
 
 
 def setup_logging(debug, console):
@@ -73,16 +149,12 @@ def thread_file_logger(config, host_id, debug):
     if not os.path.isdir(log_dir):
         os.makedirs(log_dir)
 
+    router = get_host_log_router(config)
     log_file = os.path.join(log_dir, f"{host_id}.log")
-    handler = logging.FileHandler(log_file)
-    f = InjectingFilter(host_id=host_id)
-    handler.addFilter(f)
-
-    handler.setLevel(logging.DEBUG if debug else logging.INFO)
-    handler.setFormatter(thread_formatter)
-    root_logger = logging.getLogger()
-    root_logger.addHandler(handler)
-
-    yield log_file
-
-    root_logger.removeHandler(handler)
+    if router.compress:
+        log_file += ".gz"
+    router.add_host(host_id, log_file, logging.DEBUG if debug else logging.INFO)
+    try:
+        yield log_file
+    finally:
+        router.remove_host(host_id)
@@ -0,0 +1,73 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Don't repeat the warning more often than that, in seconds
+WARNING_INTERVAL = 60
+
+
+def get_rss():
+    """Return the resident memory of the process in bytes, or None if it is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryCeiling:
+    """Watch the memory used by a crawler process.
+
+    The ceiling is set per worker thread (``CRAWLER_WORKER_MEMORY_LIMIT``, in MiB) and
+    multiplied by the number of threads of the process: the threads share the memory of
+    their process, it can't be measured for each of them.
+    """
+
+    def __init__(self, limit_mb, threads=1):
+        self.limit = int(limit_mb * threads * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._max_rss = 0
+        self._last_warning = None
+
+    @classmethod
+    def from_options(cls, config, options):
+        limit_mb = config.get("CRAWLER_WORKER_MEMORY_LIMIT")
+        if not limit_mb:
+            return None
+        threads = math.ceil(options["threads"] / max(1, options.get("processes") or 1))
+        return cls(limit_mb, threads=max(1, threads))
+
+    def check(self, description):
+        """Return True if the process uses more memory than the ceiling.
+
+        :arg description: what the thread is doing, for the warning
+        """
+        rss = get_rss()
+        if rss is None:
+            return False
+        with self._lock:
+            if rss > self._max_rss:
+                self._max_rss = rss
+                metrics.set("memory_rss_bytes_max", rss)
+            if rss <= self.limit:
+                return False
+            now = time.monotonic()
+            warn = self._last_warning is None or now - self._last_warning > WARNING_INTERVAL
+            if warn:
+                self._last_warning = now
+        metrics.inc("memory_ceiling_exceeded_total")
+        if warn:
+            logger.warning(
+                "The crawler uses %s MiB of memory, more than its %s MiB ceiling, while %s",
+                rss // (1024 * 1024),
+                self.limit // (1024 * 1024),
+                description,
+            )
+        return True
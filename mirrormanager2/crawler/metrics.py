@@ -0,0 +1,234 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from . import threads
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "mirrormanager_crawler_"
+
+# In seconds, from a fast HEAD request to a long rsync listing
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+DESCRIPTIONS = {
+    "requests_total": "Requests sent to the mirrors",
+    "received_bytes_total": "Bytes received from the mirrors",
+    "retries_total": "Requests retried after a temporary error",
+    "deferred_total": "Crawls put aside because the mirror asked to try later",
+    "connections_total": "Connections opened to the mirrors",
+    "timeout_checks_total": "Number of host timeout checks",
+    "timeout_checks_seconds_total": "Time spent checking the host timeout",
+    "request_duration_seconds": "Duration of the requests to the mirrors",
+    "connect_duration_seconds": "Time to open a connection, including the TLS handshake",
+    "dns_duration_seconds": "Time to resolve the host name of the mirrors",
+    "db_duration_seconds": "Time spent in database operations",
+    "db_pool_wait_seconds": "Time spent waiting for a database connection",
+    "db_pool_errors_total": "Database connections that could not be checked out",
+    "db_pool_size": "Size of the database connection pool",
+    "db_pool_checked_out": "Database connections checked out at the end of the run",
+    "db_pool_checked_out_max": "Most database connections checked out at the same time",
+    "db_writer_wait_seconds": "Time the crawler threads waited for room in the writer queue",
+    "db_writer_errors_total": "Crawl results that the writer thread could not write",
+    "memory_rss_bytes_max": "Most resident memory used by the crawler process",
+    "memory_ceiling_exceeded_total": "Times the crawler used more memory than its ceiling",
+    "run_duration_seconds": "Duration of the last crawler run",
+    "run_hosts": "Number of hosts checked in the last crawler run",
+    "last_run_timestamp_seconds": "When the last crawler run ended",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip((*self.buckets, "+Inf"), self.counts, strict=True):
+            total += count
+            yield le, total
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _write_atomically(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    # The node exporter must never read a partial file
+    with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".metrics-", delete=False) as f:
+        f.write(content)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+class MetricsRegistry:
+    """Counters and histograms shared by all the crawler threads.
+
+    The metrics are labelled with the host that the calling thread is crawling, see
+    :func:`~mirrormanager2.crawler.threads.on_thread_started`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # name -> sorted labels tuple -> value
+            self._counters = defaultdict(lambda: defaultdict(float))
+            self._histograms = defaultdict(dict)
+            self._gauges = defaultdict(dict)
+
+    def _get_labels(self, labels):
+        host_name = getattr(threads.threadlocal, "host_name", None)
+        if host_name is not None:
+            labels = {"host": host_name, **labels}
+        return tuple(sorted((key, value) for key, value in labels.items() if value is not None))
+
+    def inc(self, name, value=1, **labels):
+        labels = self._get_labels(labels)
+        with self._lock:
+            self._counters[name][labels] += value
+
+    def observe(self, name, value, **labels):
+        labels = self._get_labels(labels)
+        with self._lock:
+            histograms = self._histograms[name]
+            if labels not in histograms:
+                histograms[labels] = Histogram()
+            histograms[labels].observe(value)
+
+    def set(self, name, value, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges[name][labels] = value
+
+    def export(self):
+        """The counters and histograms, to be merged in the registry of another process"""
+        with self._lock:
+            return {
+                "counters": {name: dict(values) for name, values in self._counters.items()},
+                "histograms": {name: dict(values) for name, values in self._histograms.items()},
+            }
+
+    def merge(self, exported):
+        with self._lock:
+            for name, values in exported["counters"].items():
+                for labels, value in values.items():
+                    self._counters[name][labels] += value
+            for name, histograms in exported["histograms"].items():
+                for labels, histogram in histograms.items():
+                    if labels not in self._histograms[name]:
+                        self._histograms[name][labels] = Histogram(histogram.buckets)
+                    self._histograms[name][labels].merge(histogram)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def to_textfile(self):
+        """Format the metrics for the textfile collector of the Prometheus node exporter"""
+        lines = []
+
+        def _header(name, metric_type):
+            if name in DESCRIPTIONS:
+                lines.append(f"# HELP {PREFIX}{name} {DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                _header(name, "counter")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for name, values in sorted(self._gauges.items()):
+                _header(name, "gauge")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for name, histograms in sorted(self._histograms.items()):
+                _header(name, "histogram")
+                for labels, histogram in sorted(histograms.items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(
+                            f"{PREFIX}{name}_bucket{_format_labels(labels, le=le)} {count}"
+                        )
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """Summarize the metrics by host, then by the other labels (protocol...)"""
+
+        def _split(labels):
+            labels = dict(labels)
+            host = labels.pop("host", None)
+            key = ",".join(f"{k}={v}" for k, v in sorted(labels.items())) or "all"
+            return host, key
+
+        hosts = defaultdict(lambda: defaultdict(dict))
+        run = defaultdict(dict)
+        with self._lock:
+            for name, values in self._counters.items():
+                for labels, value in values.items():
+                    host, key = _split(labels)
+                    hosts[host or ""][key][name] = value
+            for name, histograms in self._histograms.items():
+                for labels, histogram in histograms.items():
+                    host, key = _split(labels)
+                    hosts[host or ""][key][name] = {
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "mean": round(histogram.sum / histogram.count, 6),
+                    }
+            for name, values in self._gauges.items():
+                for labels, value in values.items():
+                    _host, key = _split(labels)
+                    run[key][name] = value
+        return {"run": run, "hosts": hosts}
+
+    def write(self, textfile_path=None, json_path=None):
+        for path, formatter in (
+            (textfile_path, self.to_textfile),
+            (json_path, lambda: json.dumps(self.to_dict(), indent=2, sort_keys=True)),
+        ):
+            if not path:
+                continue
+            try:
+                _write_atomically(path, formatter())
+            except OSError as e:
+                logger.warning("Could not write the crawler metrics to %s: %s", path, e)
+
+
+metrics = MetricsRegistry()
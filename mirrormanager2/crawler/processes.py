@@ -0,0 +1,167 @@
+import dataclasses
+import logging
+import math
+import multiprocessing
+import queue
+import time
+
+from .database import get_crawler_db_manager
+from .metrics import metrics
+from .threads import GlobalTimeoutError, run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for the worker processes after the global timeout, they should stop by
+# themselves before that.
+SHUTDOWN_GRACE_PERIOD = 60
+# How long the worker processes have to exit once they are done or interrupted
+STOP_GRACE_PERIOD = 5
+
+
+@dataclasses.dataclass
+class ShardReport:
+    """Sent by a worker process when all the hosts of its shard are done"""
+
+    index: int
+    error: str | None
+    metrics: dict
+    propagation_cache: dict | None = None
+
+
+def _run_shard(index, fn, context, host_ids, threads, timeout, results_queue):
+    # The connections of the parent process can't be shared, open new ones
+    get_crawler_db_manager(context.config).engine.dispose(close=False)
+    metrics.reset()
+    # The progress bar is displayed by the parent process
+    context.progress = None
+    error = None
+    try:
+        for result in run_in_threadpool(
+            fn,
+            host_ids,
+            fn_args=(context,),
+            timeout=timeout,
+            executor_kwargs={"max_workers": threads},
+        ):
+            results_queue.put(("result", result))
+    except GlobalTimeoutError as e:
+        error = str(e)
+    except KeyboardInterrupt:
+        # The parent process stops too
+        return
+    if context.writer is not None:
+        context.writer.stop()
+    if context.http_pool is not None:
+        context.http_pool.close_all()
+    cache = context.propagation_cache
+    report = ShardReport(
+        index=index,
+        error=error,
+        metrics=metrics.export(),
+        propagation_cache=cache.export() if cache is not None else None,
+    )
+    results_queue.put(("done", report))
+
+
+class WorkerProcesses:
+    """Crawl the hosts in several processes, each with its own pool of threads.
+
+    The processes are forked once everything that is shared by the threads (snapshot,
+    schedule...) is loaded, they start with a copy of it. The results are sent back to the
+    parent process as the hosts are crawled, and the metrics and the propagation cache when
+    each process is done.
+    """
+
+    def __init__(self, fn, context, shards, threads, timeout):
+        self.fn = fn
+        self.context = context
+        self.shards = [host_ids for host_ids in shards if host_ids]
+        # --threads is shared between the processes
+        self.threads = max(1, math.ceil(threads / max(1, len(self.shards))))
+        self.timeout = timeout
+        self._mp_context = multiprocessing.get_context("fork")
+        self._queue = self._mp_context.Queue()
+        self._processes = []
+
+    def start(self):
+        """Fork the worker processes.
+
+        This must be called before any other thread is started (the progress bar's), the
+        locks that they hold would never be released in the children.
+        """
+        for index, host_ids in enumerate(self.shards):
+            process = self._mp_context.Process(
+                target=_run_shard,
+                args=(
+                    index,
+                    self.fn,
+                    self.context,
+                    host_ids,
+                    self.threads,
+                    self.timeout,
+                    self._queue,
+                ),
+                name=f"crawler-{index}",
+            )
+            process.start()
+            self._processes.append(process)
+        logger.debug(
+            "Started %s crawler processes with %s threads each", len(self._processes), self.threads
+        )
+
+    def _receive_report(self, report):
+        if report.error is not None:
+            self._errors.append(report.error)
+        metrics.merge(report.metrics)
+        if report.propagation_cache is not None and self.context.propagation_cache is not None:
+            self.context.propagation_cache.merge(report.propagation_cache)
+
+    def _find_crashed(self, pending):
+        for index in list(pending):
+            process = self._processes[index]
+            if process.exitcode is not None:
+                logger.error(
+                    "Crawler process %s exited with code %s before the end of its hosts",
+                    process.name,
+                    process.exitcode,
+                )
+                pending.discard(index)
+
+    def results(self):
+        """Yield the results of the hosts as they are crawled, like
+        :func:`~mirrormanager2.crawler.threads.run_in_threadpool`."""
+        self._errors = []
+        pending = set(range(len(self._processes)))
+        deadline = time.monotonic() + self.timeout + SHUTDOWN_GRACE_PERIOD
+        try:
+            while pending:
+                try:
+                    kind, payload = self._queue.get(timeout=1)
+                except queue.Empty:
+                    if time.monotonic() > deadline:
+                        self._errors.append("the crawler processes did not stop in time")
+                        break
+                    self._find_crashed(pending)
+                    continue
+                if kind == "result":
+                    yield payload
+                else:
+                    pending.discard(payload.index)
+                    self._receive_report(payload)
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                logger.info("Shutting down the crawler processes")
+            self._stop()
+            raise
+        self._stop()
+        if self._errors:
+            raise GlobalTimeoutError(self._errors[0])
+
+    def _stop(self):
+        deadline = time.monotonic() + STOP_GRACE_PERIOD
+        for process in self._processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Terminating the crawler process %s", process.name)
+                process.terminate()
+                process.join()
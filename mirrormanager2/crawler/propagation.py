@@ -0,0 +1,178 @@
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from types import MappingProxyType
+
+import mirrormanager2.lib as mmlib
+from mirrormanager2.lib.constants import PROPAGATION_ARCH
+from mirrormanager2.lib.fedora import get_propagation_repo_prefix
+
+from .constants import REPODATA_DIR, REPODATA_FILE
+
+logger = logging.getLogger(__name__)
+
+# Forget about the URLs that have not been checked for a week
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+@dataclasses.dataclass
+class RepomdCheck:
+    """A repomd.xml file to download from a mirror to check the propagation of a repo."""
+
+    repo_id: int
+    description: str
+    url: str
+    # The latest FileDetail of the file in the master mirror
+    file_detail: object
+
+
+def get_propagation_repos(session, product_versions):
+    """Return the repos to check for each product version, the PROPAGATION_ARCH ones first."""
+    all_repos = defaultdict(list)
+    for product_name, version_name in product_versions:
+        repo_prefix = get_propagation_repo_prefix(product_name, version_name)
+        # First try with the PROPAGATION_ARCH arch, but if not found try with any other.
+        for arch in [PROPAGATION_ARCH, None]:
+            repos_for_arch = mmlib.get_repositories(
+                session,
+                product_name=product_name,
+                version_name=version_name,
+                prefix=repo_prefix,
+                arch=arch,
+            )
+            if repos_for_arch:
+                all_repos[(product_name, version_name)].extend(repos_for_arch)
+    return all_repos
+
+
+class ChecksumIndex:
+    """The recent checksums of the repomd.xml files of the checked repos.
+
+    It is loaded once per run and shared read-only by the crawler threads, so that the
+    propagation status of each host is found without querying the database.
+    """
+
+    def __init__(self, histories):
+        # Directory ID -> (ID of the latest FileDetail, {sha256: timestamp})
+        self._histories = MappingProxyType(histories)
+
+    @classmethod
+    def build(cls, session, product_versions, max_stale_days):
+        repos = [
+            repo
+            for repos in get_propagation_repos(session, product_versions).values()
+            for repo in repos
+            if repo.directory is not None
+        ]
+        directory_ids = set()
+        for dirname in {f"{repo.directory.name}/{REPODATA_DIR}" for repo in repos}:
+            directory = mmlib.get_directory_by_name(session, dirname)
+            if directory is not None:
+                directory_ids.add(directory.id)
+        histories = mmlib.get_recent_sha256_timestamps(
+            session, directory_ids, REPODATA_FILE, max_age=max_stale_days * 24 * 3600
+        )
+        return cls(histories)
+
+    def __contains__(self, file_detail):
+        history = self._histories.get(file_detail.directory_id)
+        # A new file may have been published since the index was built
+        return history is not None and history[0] == file_detail.id
+
+    def __len__(self):
+        return len(self._histories)
+
+    def get_timestamp(self, file_detail, checksum):
+        """Return the newest timestamp of the file with this checksum, or None if it is
+        older than MAX_STALE_DAYS or unknown."""
+        _latest_id, timestamps = self._histories[file_detail.directory_id]
+        return timestamps.get(checksum)
+
+
+class PropagationCache:
+    """The ETag, Last-Modified and SHA256 checksum of the repomd.xml files on the mirrors.
+
+    They are kept between the runs of the propagation check in a JSON file, so that the
+    files that have not changed since the last run are not downloaded again. It is shared by
+    all the crawler threads.
+    """
+
+    def __init__(self, path=None, entries=None, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._entries = entries or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read the propagation cache in %s: %s", path, e)
+            entries = {}
+        return cls(path, entries, **kwargs)
+
+    def get(self, url):
+        with self._lock:
+            return self._entries.get(url)
+
+    def set(self, url, sha256, etag=None, last_modified=None):
+        if etag is None and last_modified is None:
+            # We won't be able to send a conditional request
+            return
+        with self._lock:
+            self._entries[url] = {
+                "sha256": sha256,
+                "etag": etag,
+                "last_modified": last_modified,
+                "checked_at": int(time.time()),
+            }
+
+    def touch(self, url):
+        with self._lock:
+            if url in self._entries:
+                self._entries[url]["checked_at"] = int(time.time())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def export(self):
+        with self._lock:
+            return dict(self._entries)
+
+    def merge(self, entries):
+        """Add the entries of the cache of another process, keeping the latest ones"""
+        with self._lock:
+            for url, entry in entries.items():
+                current = self._entries.get(url)
+                if current is None or current["checked_at"] < entry["checked_at"]:
+                    self._entries[url] = entry
+
+    def save(self):
+        if self.path is None:
+            return
+        threshold = time.time() - self.max_age
+        with self._lock:
+            entries = {
+                url: entry
+                for url, entry in self._entries.items()
+                if entry["checked_at"] >= threshold
+            }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            # Write atomically, another run may read it at the same time
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, prefix=".propagation-", delete=False
+            ) as f:
+                json.dump(entries, f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.warning("Could not write the propagation cache in %s: %s", self.path, e)
@@ -0,0 +1,205 @@
+import dataclasses
+import logging
+
+import sqlalchemy as sa
+
+import mirrormanager2.lib as mmlib
+from mirrormanager2.lib.model import HostCategory, HostCategoryDir
+
+from .states import SyncStatus
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of IDs in the IN clause of an UPDATE
+UPDATE_CHUNK_SIZE = 1000
+
+
+@dataclasses.dataclass
+class HostCategoryChanges:
+    """The changes found by the crawl of a HostCategory, to be written to the database."""
+
+    host_category_id: int
+    to_create: list = dataclasses.field(default_factory=list)
+    to_update: list = dataclasses.field(default_factory=list)
+    # The HostCategoryDirs created by a previous write of the same crawl, by path
+    to_update_by_path: list = dataclasses.field(default_factory=list)
+    # The existing HostCategoryDirs that the crawl has not seen, they are not up2date
+    unseen_ids: list = dataclasses.field(default_factory=list)
+    # Columns of the HostCategory, written after its HostCategoryDirs
+    values: dict = dataclasses.field(default_factory=dict)
+
+    def write(self, session):
+        if self.to_update:
+            session.execute(sa.update(HostCategoryDir), self.to_update)
+        if self.to_update_by_path:
+            table = HostCategoryDir.__table__
+            session.execute(
+                sa.update(table)
+                .where(
+                    table.c.host_category_id == self.host_category_id,
+                    table.c.path == sa.bindparam("b_path"),
+                )
+                .values(up2date=sa.bindparam("b_up2date")),
+                self.to_update_by_path,
+            )
+        # now-historical HostCategoryDirs are not up2date
+        # we wait for a cascading Directory delete to delete this
+        for start in range(0, len(self.unseen_ids), UPDATE_CHUNK_SIZE):
+            session.execute(
+                sa.update(HostCategoryDir)
+                .where(HostCategoryDir.id.in_(self.unseen_ids[start : start + UPDATE_CHUNK_SIZE]))
+                .values(up2date=False)
+            )
+        if self.to_create:
+            session.execute(sa.insert(HostCategoryDir), self.to_create)
+        if self.values:
+            session.execute(
+                sa.update(HostCategory)
+                .where(HostCategory.id == self.host_category_id)
+                .values(**self.values)
+            )
+        logger.debug(
+            "Created %s and updated %s HostCategoryDirs",
+            len(self.to_create),
+            len(self.to_update),
+        )
+
+
+class HostCategoryDirReconciler:
+    """Reconcile the HostCategoryDirs of a HostCategory with the statuses found by the crawler.
+
+    The existing HostCategoryDirs are loaded once in memory, the changes are collected while
+    the directories are checked, and they are written in bulk by :meth:`apply`, or handed
+    over to the writer thread with :meth:`take_changes`.
+    """
+
+    def __init__(self, session, hc, topdir_name):
+        self.hc = hc
+        self.topdir_name = topdir_name
+        # path -> (id, up2date, directory_id)
+        self.existing = {
+            row.path: (row.id, row.up2date, row.directory_id)
+            for row in mmlib.get_hostcategorydirs_by_hostcategory(session, hc)
+        }
+        self.seen_ids = set()
+        # path -> up2date, for the HostCategoryDirs created by this crawl
+        self.created = {}
+        # path -> row, for those that have not been written yet
+        self._pending_creations = {}
+        self.to_create = []
+        self.to_update = []
+        self.to_update_by_path = []
+
+    def _get_path(self, directory):
+        toplen = len(self.topdir_name)
+        if directory.name.startswith("/"):
+            toplen += 1
+        return directory.name[toplen:]
+
+    def get_stale_names(self):
+        """Return the names of the directories that are not up2date on the host"""
+        return {
+            f"{self.topdir_name}{path}"
+            for path, (_hcd_id, up2date, _directory_id) in self.existing.items()
+            if up2date is False
+        }
+
+    def sync_dir(self, directory, status):
+        logger.debug("Syncing directory %s", directory.name)
+        if status is None:
+            # could be a dir with no files, or an unreadable dir.
+            # defer decision on this dir, let a child decide.
+            return SyncStatus.UNKNOWN
+
+        path = self._get_path(directory)
+        try:
+            hcd_id, up2date, directory_id = self.existing[path]
+        except KeyError:
+            if path in self.created:
+                # Checked again, for example with the next URL of the category
+                return self._sync_created(path, status)
+            if not status:
+                # don't create HCDs for directories which aren't up2date on the
+                # mirror chances are the mirror is excluding that directory
+                return SyncStatus.UNKNOWN
+            row = dict(
+                host_category_id=self.hc.id,
+                path=path,
+                directory_id=directory.id,
+                up2date=True,
+            )
+            self.to_create.append(row)
+            self.created[path] = True
+            self._pending_creations[path] = row
+            # It is created as up2date, so it has always been counted as unchanged.
+            return SyncStatus.UNCHANGED
+
+        self.seen_ids.add(hcd_id)
+        if up2date != status:
+            sync_status = SyncStatus.UP2DATE if status else SyncStatus.NOT_UP2DATE
+            if status is False:
+                logger.info("Directory %s is not up-to-date on this host.", directory.name)
+        else:
+            sync_status = SyncStatus.UNCHANGED
+        if up2date != status or directory_id is None:
+            self.to_update.append(
+                dict(id=hcd_id, up2date=status, directory_id=directory_id or directory.id)
+            )
+        return sync_status
+
+    def _sync_created(self, path, status):
+        if self.created[path] == status:
+            return SyncStatus.UNCHANGED
+        self.created[path] = status
+        row = self._pending_creations.get(path)
+        if row is not None:
+            row["up2date"] = status
+        else:
+            self.to_update_by_path.append(dict(b_path=path, b_up2date=status))
+        return SyncStatus.UP2DATE if status else SyncStatus.NOT_UP2DATE
+
+    def mark_seen(self, directory):
+        """The directory has been checked by a previous crawl, which was interrupted."""
+        try:
+            hcd_id, _up2date, _directory_id = self.existing[self._get_path(directory)]
+        except KeyError:
+            return
+        self.seen_ids.add(hcd_id)
+
+    def take_changes(self, mark_unseen_not_up2date=False):
+        """Return the changes collected since the last call, as :class:`HostCategoryChanges`.
+
+        If ``mark_unseen_not_up2date`` is true, the existing HostCategoryDirs that have not been
+        seen during the crawl will be set to not up2date. The HostCategoryDirs created by this
+        crawl were not loaded, they are never in this list.
+        """
+        changes = HostCategoryChanges(
+            host_category_id=self.hc.id,
+            to_create=self.to_create,
+            to_update=self.to_update,
+            to_update_by_path=self.to_update_by_path,
+        )
+        if mark_unseen_not_up2date:
+            changes.unseen_ids = [
+                hcd_id
+                for hcd_id, _up2date, _directory_id in self.existing.values()
+                if hcd_id not in self.seen_ids
+            ]
+        self.to_create = []
+        self.to_update = []
+        self.to_update_by_path = []
+        self._pending_creations = {}
+        return changes
+
+    def apply(self, session, mark_unseen_not_up2date=False):
+        """Write the collected changes to the database.
+
+        If ``mark_unseen_not_up2date`` is true, the existing HostCategoryDirs that have not been
+        seen during the crawl are set to not up2date.
+
+        :returns: the number of HostCategoryDirs that have been set to not up2date because they
+            were not seen.
+        """
+        changes = self.take_changes(mark_unseen_not_up2date)
+        changes.write(session)
+        return len(changes.unseen_ids)
@@ -7,6 +7,7 @@ from typing import TYPE_CHECKING
 
 import mirrormanager2.lib as mmlib
 
+from .scheduler import get_run_mode, record_crawl_duration
 from .states import CrawlStatus
 
 if TYPE_CHECKING:
@@ -70,16 +71,27 @@ class Reporter:
         except Exception:
             logger.exception("Error quitting the SMTP connection")
 
-    def mark_not_up2date(self, reason="Unknown", exc=None):
+    def mark_not_up2date(self, reason="Unknown", exc=None, commit=True, keep_checkpoint=False):
         """This function marks a complete host as not being up to date.
         It usually is called if the scan of a single category has failed.
         This is something the crawler does at multiple places: Failure
-        in the scan of a single category disables the complete host."""
+        in the scan of a single category disables the complete host.
+
+        With ``commit=False`` the changes are only flushed, the caller commits them with
+        the rest of its transaction. With ``keep_checkpoint=True`` the next full crawl of
+        the categories can resume where this one stopped."""
         self.host_failed = True
         self.host.set_not_up2date(self.session)
+        if not keep_checkpoint:
+            # The directories checked by an interrupted crawl must be checked again
+            for hc in self.host.categories:
+                hc.crawl_checkpoint = None
         msg = f"Host {self.host.id} marked not up2date: {reason}"
         logger.warning(msg)
-        self.session.commit()
+        if commit:
+            self.session.commit()
+        else:
+            self.session.flush()
         if exc is not None:
             logger.debug(f"{exc[0]} {exc[1]} {exc[2]}")
         self.send_email(msg, exc)
@@ -118,7 +130,7 @@ class Reporter:
     #     self.host.last_crawl_duration = duration
 
 
-def store_crawl_result(config, options, session, crawl_result: "CrawlResult"):
+def store_crawl_result(config, options, session, crawl_result: "CrawlResult", commit=True):
     host = mmlib.get_host(session, crawl_result.host_id)
     reporter = Reporter(config, session, host)
 
@@ -127,14 +139,16 @@ def store_crawl_result(config, options, session, crawl_result: "CrawlResult"):
             # If running in canary mode do not auto disable mirrors
             # if they have failed.
             # Let's mark the complete mirror as not being up to date.
-            reporter.mark_not_up2date(reason=crawl_result.details)
+            reporter.mark_not_up2date(reason=crawl_result.details, commit=commit)
         else:
             # all categories have failed due to broken base URLs
             # and that this host should be marked as failed during crawl
             reporter.record_crawl_failure()
 
     elif crawl_result.status == CrawlStatus.TIMEOUT.value:
-        reporter.mark_not_up2date(reason=crawl_result.details)
+        # The checkpoints are at most CRAWLER_CHECKPOINT_MAX_AGE old, the next crawl can
+        # skip the directories that were checked before the timeout
+        reporter.mark_not_up2date(reason=crawl_result.details, commit=commit, keep_checkpoint=True)
         reporter.record_crawl_failure()
 
     elif crawl_result.status == CrawlStatus.DISABLE.value:
@@ -144,12 +158,22 @@ def store_crawl_result(config, options, session, crawl_result: "CrawlResult"):
         reporter.enable_host()
 
     host.last_crawled = crawl_result.finished_at
+    if crawl_result.status != CrawlStatus.UNKNOWN.value and crawl_result.duration is not None:
+        # Used to predict the duration of the next crawls in the same mode
+        record_crawl_duration(
+            host,
+            get_run_mode(options),
+            crawl_result.duration,
+            history_length=config.get("CRAWLER_DURATION_HISTORY", 10),
+        )
     if (
         crawl_result.status != CrawlStatus.UNKNOWN.value
         and not options["repodata"]
         and not options["canary"]
+        and not options.get("incremental")
     ):
         # reporter.record_duration(crawl_result.duration)
         host.last_crawl_duration = crawl_result.duration
 
-    session.commit()
+    if commit:
+        session.commit()
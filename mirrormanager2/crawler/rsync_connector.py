@@ -1,16 +1,18 @@
 import logging
-import os
 import time
 
-from mirrormanager2 import lib as mmlib
-from mirrormanager2.lib.sync import run_rsync
+from mirrormanager2.lib.sync import stream_rsync
 
 from .connector import Connector, SchemeNotAvailable
+from .listing import DEFAULT_MAX_ENTRIES, ListingTooLarge
+from .rsync_listing import RsyncListing
 
 logger = logging.getLogger(__name__)
 
 
 class RsyncConnector(Connector):
+    scheme = "rsync"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._scan_result = None
@@ -22,9 +24,24 @@ class RsyncConnector(Connector):
     def _run(self, url):
         if not url.endswith("/"):
             url += "/"
+        listing = RsyncListing(
+            max_entries=self._config.get("CRAWLER_LISTING_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+        )
+
+        def _callback(line):
+            self._count_received(len(line))
+            listing.parse_line(line)
+
         rsync_start_time = time.monotonic()
         try:
-            result, listing = run_rsync(url, self._config["CRAWLER_RSYNC_PARAMETERS"], logger)
+            # Parse the listing while rsync runs, it is never stored as text
+            with self._measure_request("list"):
+                result = stream_rsync(
+                    url, _callback, self._config["CRAWLER_RSYNC_PARAMETERS"], logger
+                )
+        except ListingTooLarge as e:
+            logger.warning("Could not use rsync on %s: %s", url, e)
+            return False
         except Exception:
             logger.exception("Failed to run rsync.", exc_info=True)
             return False
@@ -40,83 +57,40 @@ class RsyncConnector(Connector):
             return False
         if result > 0:
             logger.info("rsync returned exit code %s", result)
+        listing.complete = result == 0
 
-        rsync = {}
-        # put the rsync listing in a dict for easy access
-        while True:
-            line = listing.readline()
-            if not line:
-                break
-            fields = line.split()
-            try:
-                rsync[fields[4]] = {
-                    "mode": fields[0],
-                    "size": fields[1],
-                    "date": fields[2],
-                    "time": fields[3],
-                }
-            except IndexError:
-                logger.debug("invalid rsync line: %s", line)
-
-        # run_rsync() returns a temporary file which needs to be closed
-        listing.close()
-
-        logger.debug("rsync listing has %d lines" % len(rsync))
-        return rsync
-
-    def _check_file(self, current_file_info, db_file_info):
-        if current_file_info["mode"].startswith("l"):
-            # ignore symlink size differences
-            return True
-
-        try:
-            return float(current_file_info["size"]) == float(db_file_info["size"])
-        except ValueError:  # one of the conversion to float() failed
-            logger.debug("Invalid size value for file %s", current_file_info)
-            return False
+        logger.debug(
+            "rsync listing has %d files (%d invalid lines)", len(listing), listing.invalid_lines
+        )
+        return listing
 
     def _check_dir(self, dirname, directory):
-        with mmlib.instance_attribute(directory, "files") as files:
-            # Getting Directory.files is a bit expensive, involves json decoding
-            for filename in sorted(files):
-                if len(dirname) == 0:
-                    key = filename
-                else:
-                    key = os.path.join(dirname, filename)
-                logger.debug(f"Dirname: {dirname}, filename: {filename}, key: {key}")
-
-                logger.debug("trying with key %s", key)
-                try:
-                    current_file_info = self._scan_result[key]
-                except KeyError:  # file is not in the rsync listing
-                    logger.debug("Missing remote file %s", key)
-                    return False
-
-                try:
-                    status = self._check_file(current_file_info, files[filename])
-                    if not status:
-                        # Shortcut: we don't need to go over other files
-                        return False
-                except Exception as e:  # something else went wrong
-                    logger.error("Exception caught when scanning %s: %s", filename, e)
-                    return False
-
-        return True
+        return self._scan_result.check_directory(dirname, directory.files)
 
     def _get_dir_url(self, url, directory, category_prefix_length):
         # We don't need the whole URL, the scan has already been done
         return directory.name[category_prefix_length:]
 
+    def _scan(self, url):
+        # Scan only once for the entire category
+        if self._scan_result is None:
+            self._scan_result = self._run(url)
+        return self._scan_result
+
+    def get_listing_digest(self, url):
+        scan_result = self._scan(url)
+        if not scan_result or not scan_result.complete or scan_result.invalid_lines:
+            # It may not be the complete listing
+            return None
+        return scan_result.digest
+
     def check_category(
         self,
         url,
         directory,
         category_prefix_length,
     ):
-        # Scan only once for the entire category
-        if self._scan_result is None:
-            self._scan_result = self._run(url)
-        if not self._scan_result:
+        if not self._scan(url):
             # no rsync content, fail!
             raise SchemeNotAvailable
         return super().check_category(url, directory, category_prefix_length)
@@ -0,0 +1,51 @@
+import hashlib
+import logging
+
+from .listing import INVALID_SIZE, FileListing
+
+logger = logging.getLogger(__name__)
+
+
+class RsyncListing(FileListing):
+    """A :class:`FileListing` filled from the output of rsync, while it runs."""
+
+    def __init__(self, max_entries=None):
+        super().__init__(max_entries=max_entries)
+        self._digest = hashlib.sha256()
+        # Whether rsync exited without errors
+        self.complete = False
+
+    @property
+    def digest(self):
+        """A digest of the whole listing, directories included"""
+        return self._digest.hexdigest()
+
+    def parse_line(self, line):
+        """Add a line of rsync's output to the listing.
+
+        The lines look like this::
+
+            -rw-r--r--      4,321 2017/01/01 12:00:00 path/to/file
+            lrwxrwxrwx         12 2017/01/01 12:00:00 path/to/link -> file
+        """
+        fields = line.rstrip("\n").split(None, 4)
+        if len(fields) != 5:
+            self.invalid_lines += 1
+            logger.debug("invalid rsync line: %s", line)
+            return
+        mode, size, date, time, path = fields
+        # Without the column alignment and the locale's thousands separators
+        normalized = "\0".join((mode, size.replace(",", "").replace(".", ""), date, time, path))
+        self._digest.update(normalized.encode() + b"\n")
+        if mode.startswith("d"):
+            return
+        is_symlink = mode.startswith("l")
+        if is_symlink:
+            path = path.split(" -> ", 1)[0]
+        try:
+            # rsync adds thousands separators unless --no-human-readable is used
+            size = int(size.replace(",", "").replace(".", ""))
+        except ValueError:
+            logger.debug("Invalid size value for file %s: %s", path, size)
+            size = INVALID_SIZE
+        self.add(path, size, is_symlink)
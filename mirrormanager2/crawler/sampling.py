@@ -0,0 +1,97 @@
+import dataclasses
+import random
+from types import MappingProxyType
+
+from .constants import PACKAGES_DIR, REPODATA_FILE
+
+
+def _get_timestamp(filedata):
+    try:
+        return int(filedata.get("stat") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def order_files(files):
+    """Return the items of the files of a directory in the order they should be checked.
+
+    The connectors stop at the first file that is missing or has the wrong size, and a stale
+    mirror is usually missing the newest files: check repomd.xml first, then the newest files.
+    """
+    return sorted(
+        files.items(),
+        key=lambda item: (item[0] != REPODATA_FILE, -_get_timestamp(item[1]), item[0]),
+    )
+
+
+class DirectorySampler:
+    """Only check the ``newest`` newest files of the directories, and ``random_count`` other
+    files chosen at random."""
+
+    def __init__(self, newest, random_count=None, rng=None):
+        self.newest = newest
+        self.random_count = newest if random_count is None else random_count
+        self._random = rng or random.Random()
+
+    def sample(self, directory):
+        """Return the directory with only the files to check"""
+        if len(directory.files) <= self.newest + self.random_count:
+            return directory
+        ordered = order_files(directory.files)
+        selected = ordered[: self.newest] + self._random.sample(
+            ordered[self.newest :], self.random_count
+        )
+        return dataclasses.replace(directory, files=MappingProxyType(dict(selected)))
+
+
+def get_packages_root(name):
+    """Return the root of the repository if the directory is in its Packages subtree"""
+    parts = name.split("/")
+    if PACKAGES_DIR not in parts:
+        return None
+    index = len(parts) - 1 - parts[::-1].index(PACKAGES_DIR)
+    return "/".join(parts[:index])
+
+
+@dataclasses.dataclass
+class RepositorySample:
+    repodata: object
+    # Some directories of the Packages subtree
+    packages: list = dataclasses.field(default_factory=list)
+    seen: int = 0
+
+
+class RepositorySampler:
+    """Choose the directories to check in each yum repository of a category.
+
+    If the repomd.xml file of a repository is up to date, its Packages subtree most likely is
+    too: only ``size`` of its directories, chosen at random, are checked.
+    """
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self._random = rng or random.Random()
+
+    def _add(self, sample, directory):
+        # Reservoir sampling, the directories are only iterated once
+        sample.seen += 1
+        if len(sample.packages) < self.size:
+            sample.packages.append(directory)
+            return
+        index = self._random.randrange(sample.seen)
+        if index < self.size:
+            sample.packages[index] = directory
+
+    def sample(self, directories):
+        """Return the repository roots mapped to their repodata directory and sample"""
+        samples = {}
+        for directory in directories:
+            if directory.is_repodata:
+                root = directory.name.rpartition("/")[0]
+                samples.setdefault(root, RepositorySample(repodata=None)).repodata = directory
+                continue
+            root = get_packages_root(directory.name)
+            if root is not None:
+                self._add(samples.setdefault(root, RepositorySample(repodata=None)), directory)
+        # Not a yum repository
+        return {root: sample for root, sample in samples.items() if sample.repodata is not None}
@@ -0,0 +1,140 @@
+import dataclasses
+import heapq
+import logging
+import statistics
+
+from .states import CrawlMode
+
+logger = logging.getLogger(__name__)
+
+
+def get_run_mode(options):
+    """The name under which the durations of the crawls of this run are recorded"""
+    if options.get("propagation"):
+        return "propagation"
+    if options.get("canary"):
+        return "canary"
+    if options.get("repodata"):
+        return CrawlMode.REPODATA.value
+    if options.get("incremental"):
+        return CrawlMode.INCREMENTAL.value
+    return CrawlMode.FULL.value
+
+
+def record_crawl_duration(host, mode, duration, history_length):
+    """Add the duration of a crawl to the rolling history in Host.last_crawls"""
+    last_crawls = dict(host.last_crawls or {})
+    durations = dict(last_crawls.get("durations", {}))
+    history = list(durations.get(mode, []))
+    history.append(int(duration))
+    durations[mode] = history[-history_length:]
+    last_crawls["durations"] = durations
+    # Assign a new object, changes inside a PickleType are not tracked
+    host.last_crawls = last_crawls
+
+
+@dataclasses.dataclass(frozen=True)
+class HostEstimate:
+    host_id: int
+    # The predicted duration of the crawl, None if the host has no history in this mode
+    duration: float | None
+    # The longest crawl in the history
+    longest: float | None = None
+
+
+class Schedule:
+    """The order in which the hosts are crawled, and the timeout of each host.
+
+    The durations are predicted from the previous crawls in the same mode, and the hosts are
+    dispatched longest first: the slowest hosts then don't start at the end of the run.
+    """
+
+    def __init__(self, estimates, default_timeout=None, timeout_factor=None, timeout_min=0):
+        self.default_timeout = default_timeout
+        self.timeout_factor = timeout_factor
+        self.timeout_min = timeout_min
+        known = [e.duration for e in estimates if e.duration is not None]
+        # Hosts without history are expected to take as long as the typical host
+        self._fallback_duration = statistics.median(known) if known else 0
+        # The sort is stable, hosts with the same prediction keep their order
+        self.estimates = sorted(estimates, key=self.get_duration, reverse=True)
+        self._by_host_id = {e.host_id: e for e in self.estimates}
+
+    @classmethod
+    def build(cls, config, options, histories, host_ids):
+        """Predict the duration of the crawl of each host.
+
+        :arg histories: the result of :func:`mirrormanager2.lib.get_crawl_histories`.
+        """
+        mode = get_run_mode(options)
+        estimates = []
+        for host_id in host_ids:
+            last_crawl_duration, last_crawls = histories.get(host_id, (None, None))
+            history = ((last_crawls or {}).get("durations") or {}).get(mode)
+            if not history and mode == CrawlMode.FULL.value and last_crawl_duration:
+                # Before the history was recorded
+                history = [last_crawl_duration]
+            if history:
+                estimate = HostEstimate(
+                    host_id=host_id, duration=statistics.median(history), longest=max(history)
+                )
+            else:
+                estimate = HostEstimate(host_id=host_id, duration=None)
+            estimates.append(estimate)
+        return cls(
+            estimates,
+            default_timeout=options.get("host_timeout"),
+            timeout_factor=config.get("CRAWLER_HOST_TIMEOUT_FACTOR"),
+            timeout_min=config.get("CRAWLER_HOST_TIMEOUT_MIN", 30) * 60,
+        )
+
+    @property
+    def host_ids(self):
+        return [e.host_id for e in self.estimates]
+
+    def get_duration(self, estimate):
+        if estimate.duration is None:
+            return self._fallback_duration
+        return estimate.duration
+
+    def get_timeout(self, host_id):
+        """The timeout of a host: a multiple of its longest recent crawl, but not more than
+        the --host-timeout option."""
+        estimate = self._by_host_id.get(host_id)
+        if not self.timeout_factor or estimate is None or estimate.longest is None:
+            return self.default_timeout
+        timeout = max(self.timeout_min, estimate.longest * self.timeout_factor)
+        if self.default_timeout is not None:
+            timeout = min(timeout, self.default_timeout)
+        return timeout
+
+    def shard(self, count):
+        """Split the hosts into ``count`` groups with about the same predicted duration.
+
+        Each host goes to the group with the smallest total so far, longest hosts first. The
+        hosts keep their order in each group.
+        """
+        shards = [(0.0, index, []) for index in range(max(1, count))]
+        for estimate in self.estimates:
+            total, index, host_ids = heapq.heappop(shards)
+            host_ids.append(estimate.host_id)
+            heapq.heappush(shards, (total + self.get_duration(estimate), index, host_ids))
+        return [host_ids for _total, _index, host_ids in sorted(shards, key=lambda s: s[1])]
+
+    def _simulate(self, threads):
+        """Yield each estimate with its expected end time if the hosts are dispatched in
+        order to the first available thread."""
+        workers = [0.0] * max(1, threads)
+        for estimate in self.estimates:
+            end = heapq.heappop(workers) + self.get_duration(estimate)
+            heapq.heappush(workers, end)
+            yield estimate, end
+
+    def get_expected_overruns(self, threads, global_timeout):
+        """Return the estimates of the hosts that are expected to end after the global
+        timeout, with their expected end time."""
+        return [(e, end) for e, end in self._simulate(threads) if end > global_timeout]
+
+    def get_makespan(self, threads):
+        """The expected duration of the whole run"""
+        return max((end for _e, end in self._simulate(threads)), default=0)
@@ -0,0 +1,215 @@
+import dataclasses
+import functools
+import hashlib
+import logging
+from types import MappingProxyType
+
+import mirrormanager2.lib as mmlib
+from mirrormanager2.lib import model
+
+from .constants import REPODATA_DIR, REPODATA_FILE
+from .continents import get_country_continents
+
+logger = logging.getLogger(__name__)
+
+# Number of directories loaded at once when they are read from the database during the crawl
+DIRECTORY_BATCH_SIZE = 1000
+
+
+def get_ctimes_digest(directories):
+    """Return a digest of the names and ctimes of the directories, it changes when a
+    directory is added, removed or updated on the master mirror."""
+    digest = hashlib.sha256()
+    for name, ctime in directories:
+        digest.update(f"{name}\0{ctime or 0}\n".encode())
+    return digest.hexdigest()
+
+
+@dataclasses.dataclass(frozen=True)
+class DirectorySnapshot:
+    """What the crawler needs to know about a Directory, without the ORM object."""
+
+    id: int
+    name: str
+    readable: bool
+    ctime: int
+    # filename -> {"size": size, "stat": timestamp}
+    files: MappingProxyType
+    # filename -> sha256 of the latest FileDetail, only for the files that are checksummed.
+    sha256sums: MappingProxyType = dataclasses.field(default_factory=lambda: MappingProxyType({}))
+
+    @property
+    def is_repodata(self):
+        return self.name.endswith(f"/{REPODATA_DIR}")
+
+    @classmethod
+    def from_row(cls, row, sha256sums):
+        """Build it from a row of :func:`mirrormanager2.lib.get_directory_rows_by_category`
+        and the checksums of the repomd.xml files, by directory ID."""
+        directory_sha256sums = {}
+        if row.id in sha256sums:
+            directory_sha256sums[REPODATA_FILE] = sha256sums[row.id]
+        return cls(
+            id=row.id,
+            name=row.name,
+            readable=row.readable,
+            ctime=row.ctime,
+            # Decode the JSON once for the whole crawl
+            files=MappingProxyType(dict(row.files)),
+            sha256sums=MappingProxyType(directory_sha256sums),
+        )
+
+    @classmethod
+    def from_directory(cls, session, directory):
+        with mmlib.instance_attribute(directory, "files") as files:
+            # Getting Directory.files is a bit expensive, involves json decoding
+            files = dict(files)
+        sha256sums = {}
+        if REPODATA_FILE in files:
+            file_detail = mmlib.get_file_detail(
+                session, REPODATA_FILE, directory_id=directory.id, reverse=True
+            )
+            if file_detail is not None:
+                sha256sums[REPODATA_FILE] = file_detail.sha256
+        return cls(
+            id=directory.id,
+            name=directory.name,
+            readable=directory.readable,
+            ctime=directory.ctime,
+            files=MappingProxyType(files),
+            sha256sums=MappingProxyType(sha256sums),
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class CategorySnapshot:
+    """An immutable copy of the crawlable directories of a category.
+
+    It is built once before the crawl and shared by all the worker threads.
+    """
+
+    id: int
+    name: str
+    topdir_name: str
+    # Sorted by name, like get_directories_by_category() does.
+    directories: tuple
+    only_repodata: bool = False
+
+    def count_directories(self, only_repodata=False):
+        return sum(1 for _ in self.get_directories(only_repodata))
+
+    @functools.cached_property
+    def ctimes_digest(self):
+        return get_ctimes_digest((d.name, d.ctime) for d in self.directories)
+
+    def get_directories(self, only_repodata=False):
+        if self.only_repodata and not only_repodata:
+            raise ValueError(f"The snapshot of {self.name} only has the repodata directories")
+        if only_repodata:
+            return (d for d in self.directories if d.is_repodata)
+        return iter(self.directories)
+
+    @classmethod
+    def build(cls, session, category, only_repodata=False):
+        rows = mmlib.get_directory_rows_by_category(session, category, only_repodata)
+        sha256sums = mmlib.get_latest_sha256sums(
+            session, [row.id for row in rows if REPODATA_FILE in row.files], REPODATA_FILE
+        )
+        return cls(
+            id=category.id,
+            name=category.name,
+            topdir_name=category.topdir.name,
+            directories=tuple(DirectorySnapshot.from_row(row, sha256sums) for row in rows),
+            only_repodata=only_repodata,
+        )
+
+
+class DatabaseCategory:
+    """Same interface as CategorySnapshot, but the directories are read from the database.
+
+    This is used when there is no snapshot for the category. The directories are read as
+    rows, ``batch_size`` at a time, and only the current batch is kept in memory: there are
+    no Directory objects piling up in the session until it is committed.
+    """
+
+    def __init__(self, session, category, batch_size=DIRECTORY_BATCH_SIZE):
+        self.session = session
+        self.category = category
+        self.id = category.id
+        self.name = category.name
+        self.batch_size = batch_size
+
+    @property
+    def topdir_name(self):
+        return self.category.topdir.name
+
+    def count_directories(self, only_repodata=False):
+        return mmlib.count_directories_by_category(self.session, self.category, only_repodata)
+
+    @functools.cached_property
+    def ctimes_digest(self):
+        return get_ctimes_digest(
+            mmlib.get_directory_ctimes_by_category(self.session, self.category)
+        )
+
+    def get_directories(self, only_repodata=False):
+        for rows in mmlib.iter_directory_rows_by_category(
+            self.session, self.category, only_repodata, batch_size=self.batch_size
+        ):
+            sha256sums = mmlib.get_latest_sha256sums(
+                self.session, [row.id for row in rows if REPODATA_FILE in row.files], REPODATA_FILE
+            )
+            for row in rows:
+                yield DirectorySnapshot.from_row(row, sha256sums)
+
+
+@dataclasses.dataclass(frozen=True)
+class CrawlSnapshot:
+    """The read-only data shared by all the crawler threads."""
+
+    categories: MappingProxyType
+    # Only loaded when the crawl is limited to some continents
+    country_continents: MappingProxyType | None = None
+
+    @classmethod
+    def build(
+        cls,
+        session,
+        host_ids,
+        category_ids=None,
+        only_repodata=False,
+        with_continents=False,
+        max_directories=None,
+    ):
+        """Load the categories of the hosts, except those with more than ``max_directories``
+        directories: the threads read them from the database, batch by batch."""
+        if not category_ids:
+            category_ids = mmlib.get_category_ids_by_hosts(session, host_ids)
+        categories = {}
+        for category_id in category_ids:
+            category = session.get(model.Category, category_id)
+            if max_directories is not None:
+                count = mmlib.count_directories_by_category(session, category, only_repodata)
+                if count > max_directories:
+                    logger.debug(
+                        "Category %s has %s directories, they will be read from the database",
+                        category.name,
+                        count,
+                    )
+                    continue
+            categories[category_id] = CategorySnapshot.build(session, category, only_repodata)
+            logger.debug(
+                "Snapshot of category %s: %s directories",
+                category.name,
+                len(categories[category_id].directories),
+            )
+        country_continents = None
+        if with_continents:
+            country_continents = MappingProxyType(dict(get_country_continents(session)))
+        return cls(categories=MappingProxyType(categories), country_continents=country_continents)
+
+    def get_category(self, session, category):
+        try:
+            return self.categories[category.id]
+        except KeyError:
+            return DatabaseCategory(session, category)
@@ -19,6 +19,12 @@ class SyncStatus(Enum):
     DELETED = "deleted"
 
 
+class CrawlMode(Enum):
+    FULL = "full"
+    INCREMENTAL = "incremental"
+    REPODATA = "repodata"
+
+
 # Keep this in sync with the fields in models.PropagationStat
 class PropagationStatus(Enum):
     SAME_DAY = "same_day"
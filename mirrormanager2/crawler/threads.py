@@ -1,12 +1,18 @@
+import dataclasses
 import datetime
 import hashlib
+import heapq
+import itertools
 import logging
 import signal
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
 from functools import partial
 
+# Import the module: it needs threadlocal, which is defined below
+from . import metrics as crawler_metrics
+
 logger = logging.getLogger(__name__)
 
 # Variable used to coordinate graceful shutdown of all threads
@@ -43,6 +49,15 @@ def on_thread_started(host_id, host_name):
     threadlocal.host_name = host_name
 
 
+@dataclasses.dataclass
+class Continuation:
+    """Returned by the function run in the thread pool to be called again with ``item``
+    after ``delay`` seconds. The thread is free to run other items in the meantime."""
+
+    item: object
+    delay: float
+
+
 def run_in_threadpool(fn, iterable, fn_args, timeout, executor_kwargs):
     global shutdown, max_global_execution_dt
 
@@ -56,12 +71,32 @@ def run_in_threadpool(fn, iterable, fn_args, timeout, executor_kwargs):
         threadpool.shutdown(cancel_futures=True)
 
     futures = {threadpool.submit(fn, *fn_args, item) for item in iterable}
+    # The continuations waiting for their delay to expire: (due time, sequence, item)
+    delayed = []
+    sequence = itertools.count()
     try:
-        for future in as_completed(futures):
-            try:
-                yield future.result()
-            except Exception:
-                logger.exception("Crawler failed!")
+        while futures or delayed:
+            wait_for = max(0, delayed[0][0] - time.monotonic()) if delayed else None
+            if futures:
+                done, futures = wait(futures, timeout=wait_for, return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                time.sleep(wait_for)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception:
+                    logger.exception("Crawler failed!")
+                    continue
+                if isinstance(result, Continuation):
+                    due = time.monotonic() + result.delay
+                    heapq.heappush(delayed, (due, next(sequence), result.item))
+                    continue
+                yield result
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _due, _sequence, item = heapq.heappop(delayed)
+                futures.add(threadpool.submit(fn, *fn_args, item))
     except Exception as e:
         if isinstance(e, KeyboardInterrupt):
             logger.info("Shutting down the thread pool")
@@ -79,10 +114,19 @@ class ThreadTimeout:
         if self.max_duration is not None:
             logger.debug("Host timeout will be %ss", self.max_duration)
 
-    def start(self):
-        threadlocal.starttime = time.monotonic()
+    def start(self, starttime=None):
+        """Start counting, or go on counting from ``starttime`` when the host is resumed"""
+        threadlocal.starttime = time.monotonic() if starttime is None else starttime
 
     def check(self):
+        start = time.monotonic()
+        try:
+            self._check()
+        finally:
+            crawler_metrics.metrics.inc("timeout_checks_total")
+            crawler_metrics.metrics.inc("timeout_checks_seconds_total", time.monotonic() - start)
+
+    def _check(self):
         global max_global_execution_dt
         elapsed = self.elapsed()
         if self.max_duration is not None and elapsed > self.max_duration:
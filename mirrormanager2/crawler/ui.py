@@ -75,6 +75,9 @@ class ProgressTask:
             self._progress.reset(self._task_id, **kwargs)
 
     def advance(self, amount=1):
+        if self._progress is None:
+            # In the worker processes of a multi-process run
+            return
         if self._task_id is None:
             self._task_id = self._progress.add_task(self.name, total=self._total)
         self._progress.advance(self._task_id, amount)
@@ -0,0 +1,157 @@
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+from .database import get_crawler_db_manager
+from .metrics import metrics
+from .reconcile import HostCategoryChanges
+from .reporter import store_crawl_result
+
+logger = logging.getLogger(__name__)
+
+# Put in the queue to stop the writer thread
+_STOP = object()
+
+
+class DatabaseWriter:
+    """Write the changes found by the crawler threads to the database from a single thread.
+
+    The crawler threads put the changes of the host categories they crawl
+    (:class:`~mirrormanager2.crawler.reconcile.HostCategoryChanges`) and the results of the
+    hosts in a queue. The writer thread writes up to ``batch_size`` of them in each
+    transaction, so the threads that wait for the mirrors don't wait for the database, and
+    don't compete for the locks of the ``host_category_dir`` rows.
+
+    The queue holds at most ``max_pending`` items: when the writer falls behind, the crawler
+    threads wait for it.
+    """
+
+    def __init__(self, config, options, max_pending=100, batch_size=50):
+        self.config = config
+        self.options = options
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        # host category ID -> number of changes in the queue
+        self._pending = collections.Counter()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopped = False
+
+    @classmethod
+    def from_options(cls, config, options):
+        return cls(
+            config,
+            options,
+            max_pending=config.get("CRAWLER_WRITER_QUEUE_SIZE", 100),
+            batch_size=config.get("CRAWLER_WRITER_BATCH_SIZE", 50),
+        )
+
+    @property
+    def _db_manager(self):
+        return get_crawler_db_manager(self.config)
+
+    def _start(self):
+        with self._lock:
+            # Threads don't survive a fork, each process has its own writer
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._pending = collections.Counter()
+            self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _is_running(self):
+        return self._pid == os.getpid() and not self._stopped
+
+    def put(self, item):
+        """Queue a :class:`~mirrormanager2.crawler.reconcile.HostCategoryChanges` or a
+        :class:`~mirrormanager2.crawler.crawler.CrawlResult`, wait if the queue is full."""
+        self._start()
+        if self._stopped:
+            # A thread that was still running after the end of the run
+            self._write([item])
+            return
+        if isinstance(item, HostCategoryChanges):
+            with self._lock:
+                self._pending[item.host_category_id] += 1
+        start = time.monotonic()
+        self._queue.put(item)
+        metrics.observe("db_writer_wait_seconds", time.monotonic() - start, host=None)
+
+    def wait_for(self, host_category_id):
+        """Wait until the queued changes of the host category have been written"""
+        if not self._is_running():
+            return
+        with self._written:
+            self._written.wait_for(lambda: not self._pending[host_category_id])
+
+    def flush(self):
+        """Wait until everything in the queue has been written"""
+        if self._is_running():
+            self._queue.join()
+
+    def stop(self):
+        """Write what is left in the queue and stop the writer thread"""
+        if not self._is_running():
+            return
+        # From now on, the changes are written by the threads that send them
+        self._stopped = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not _STOP]
+            try:
+                self._write(items)
+            finally:
+                with self._written:
+                    for item in items:
+                        if isinstance(item, HostCategoryChanges):
+                            self._pending[item.host_category_id] -= 1
+                    self._written.notify_all()
+                for _item in batch:
+                    self._queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    def _write_item(self, session, item):
+        if isinstance(item, HostCategoryChanges):
+            item.write(session)
+        else:
+            store_crawl_result(self.config, self.options, session, item, commit=False)
+
+    def _write(self, items):
+        if not items:
+            return
+        try:
+            with metrics.timer("db_duration_seconds", operation="writer", host=None):
+                with self._db_manager.Session() as session:
+                    for item in items:
+                        self._write_item(session, item)
+                    session.commit()
+        except Exception:
+            if len(items) == 1:
+                logger.exception("Could not write %r", items[0])
+                metrics.inc("db_writer_errors_total", host=None)
+                return
+            logger.exception(
+                "Could not write %s crawl results at once, writing them one by one", len(items)
+            )
+            # Don't lose the whole batch because of one of them
+            for item in items:
+                self._write([item])
@@ -135,6 +135,12 @@ MM_COOKIE_NAME = "MirrorManager"
 # decide where to store log files.
 MM_LOG_DIR = "/var/log/mirrormanager"
 
+# The crawler keeps at most CRAWLER_LOG_MAX_OPEN_FILES per host log files open
+# at the same time. With CRAWLER_LOG_GZIP, they are compressed with gzip, in
+# MM_LOG_DIR/crawler/<hostid>.log.gz.
+CRAWLER_LOG_MAX_OPEN_FILES = 32
+CRAWLER_LOG_GZIP = False
+
 # This is used to exclude certain protocols to be entered
 # for host category URLs at all.
 # The following is the default for Fedora to exclude FTP based
@@ -175,10 +181,118 @@ CRAWLER_RSYNC_PARAMETERS = "--no-motd"
 # can be used decrease the probability of stale rsync processes
 CRAWLER_RSYNC_PARAMETERS = "--no-motd --timeout 14400"
 
+# Maximum number of files kept in memory from the rsync listing or the
+# recursive FTP listing of a host category. Each file uses around 100 bytes
+# plus the length of its path. Above this limit the crawler stops using this
+# listing for the category, and checks it another way.
+CRAWLER_LISTING_MAX_ENTRIES = 10000000
+
 # If a host fails for CRAWLER_AUTO_DISABLE times in a row
 # the host will be disable automatically (user_active)
 CRAWLER_AUTO_DISABLE = 4
 
+# Incremental crawls (mm2_crawler crawl --incremental) only check the
+# directories that changed since the last crawl of a category, and a random
+# sample (CRAWLER_INCREMENTAL_SAMPLE) of the other directories.
+# A full crawl is done instead if more than CRAWLER_INCREMENTAL_MAX_CHANGED
+# of the directories changed, or if the last full crawl is older than
+# CRAWLER_INCREMENTAL_FULL_INTERVAL hours.
+CRAWLER_INCREMENTAL_SAMPLE = 0.05
+CRAWLER_INCREMENTAL_MAX_CHANGED = 0.5
+CRAWLER_INCREMENTAL_FULL_INTERVAL = 24
+
+# The durations of the last CRAWLER_DURATION_HISTORY crawls of each host are
+# kept for each crawl mode (full, repodata, incremental, canary). They are
+# used to crawl the slowest hosts first, and to give each host a timeout of
+# CRAWLER_HOST_TIMEOUT_FACTOR times its longest recent crawl, but at least
+# CRAWLER_HOST_TIMEOUT_MIN minutes and at most the --host-timeout option.
+# With None (the default), all the hosts get the --host-timeout option. A host
+# that times out counts as a crawl failure, so a low factor can get hosts
+# that are only slower than usual disabled after CRAWLER_AUTO_DISABLE runs.
+CRAWLER_DURATION_HISTORY = 10
+CRAWLER_HOST_TIMEOUT_FACTOR = None
+CRAWLER_HOST_TIMEOUT_MIN = 30
+
+# The crawler commits the statuses of the directories it checked every
+# CRAWLER_CHECKPOINT_INTERVAL directories, and remembers the last one. If a
+# full crawl of a category is interrupted (timeout), the next crawl resumes
+# after this directory, unless the interrupted crawl started more than
+# CRAWLER_CHECKPOINT_MAX_AGE hours ago.
+CRAWLER_CHECKPOINT_INTERVAL = 1000
+CRAWLER_CHECKPOINT_MAX_AGE = 24
+
+# With mm2_crawler crawl --sample N, only the N newest files of each directory
+# and N other files chosen at random are checked. All the files of a category
+# are still checked if they have not been for CRAWLER_SAMPLE_FULL_INTERVAL hours.
+CRAWLER_SAMPLE_FULL_INTERVAL = 168
+
+# With mm2_crawler crawl --trust-repodata, the Packages subtree of a repository
+# whose repomd.xml file is up to date is considered up to date too if the
+# CRAWLER_TRUST_REPODATA_SAMPLE directories of it that are checked are. The
+# CRAWLER_SAMPLE_FULL_INTERVAL full checks are still done.
+CRAWLER_TRUST_REPODATA_SAMPLE = 3
+
+# The crawler threads share one database engine. Its connection pool has one
+# connection per thread (--threads) plus 2, unless CRAWLER_DB_POOL_SIZE is set,
+# and up to CRAWLER_DB_MAX_OVERFLOW more connections when it is exhausted. A
+# thread waits at most CRAWLER_DB_POOL_TIMEOUT seconds for a connection.
+CRAWLER_DB_POOL_SIZE = None
+CRAWLER_DB_MAX_OVERFLOW = 5
+CRAWLER_DB_POOL_TIMEOUT = 30
+
+# The statuses found by the crawler threads and the results of the hosts are
+# written by a single thread (unless --no-db-writer is used), with up to
+# CRAWLER_WRITER_BATCH_SIZE of them in each transaction. The crawler threads
+# wait when CRAWLER_WRITER_QUEUE_SIZE of them are waiting to be written.
+CRAWLER_WRITER_QUEUE_SIZE = 100
+CRAWLER_WRITER_BATCH_SIZE = 50
+
+# The directories of the crawled categories are loaded once for all the
+# threads, except in the categories with more than
+# CRAWLER_SNAPSHOT_MAX_DIRECTORIES directories: those are read from the
+# database by each thread, 1000 directories at a time. None loads them all.
+CRAWLER_SNAPSHOT_MAX_DIRECTORIES = 10000
+
+# Memory ceiling of each crawler thread, in MiB. The crawler processes check
+# their resident memory against it (times their number of threads), and when
+# they exceed it they report it and write the pending changes right away.
+# None disables the check.
+CRAWLER_WORKER_MEMORY_LIMIT = None
+
+# With mm2_crawler crawl --shared-http-pool, the hosts crawled by a process
+# share their HTTP connections by scheme and netloc, with at most
+# CRAWLER_HTTP_POOL_MAX_CONNECTIONS connections to each netloc. The connections
+# that no host has used for CRAWLER_HTTP_POOL_IDLE_TIMEOUT seconds are closed.
+# The host names are resolved once per run, with the addresses of
+# CRAWLER_DNS_FAMILY ("ipv4", "ipv6" or None for the system's order) first.
+CRAWLER_HTTP_POOL_MAX_CONNECTIONS = 4
+CRAWLER_HTTP_POOL_IDLE_TIMEOUT = 60
+CRAWLER_DNS_FAMILY = None
+
+# With mm2_crawler crawl --canary --canary-engine asyncio, the base URLs of
+# CRAWLER_CANARY_CONCURRENCY hosts at most are checked at the same time.
+CRAWLER_CANARY_CONCURRENCY = 100
+
+# With mm2_crawler crawl --work-queue, the crawler nodes lease the hosts they
+# crawl for CRAWLER_LEASE_DURATION seconds, and renew the leases every
+# CRAWLER_LEASE_HEARTBEAT seconds while they crawl. The hosts of a node that
+# stopped are taken over by the other nodes when its leases expire.
+CRAWLER_LEASE_DURATION = 300
+CRAWLER_LEASE_HEARTBEAT = 60
+
+# At the end of each run, the crawler writes its metrics (requests, bytes
+# received, retries, request and database latencies per host and protocol)
+# in the format of the textfile collector of the Prometheus node exporter, and
+# as a JSON summary. Nothing is written if the path is unset.
+CRAWLER_METRICS_TEXTFILE = None
+CRAWLER_METRICS_JSON = None
+
+# The propagation check (mm2_crawler propagation) remembers the ETag,
+# Last-Modified date and checksum of the repomd.xml files on the mirrors in
+# this JSON file, and uses conditional requests to avoid downloading the files
+# that have not changed since the previous run. Disabled if unset.
+CRAWLER_PROPAGATION_CACHE = None
+
 # This is a list of directories which MirrorManager will ignore while guessing
 # the version and architecture from a path.
 SKIP_PATHS_FOR_VERSION = ["pub/alt"]
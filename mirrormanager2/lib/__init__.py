@@ -28,6 +28,7 @@ from collections import defaultdict
 from contextlib import contextmanager
 
 import sqlalchemy as sa
+from sqlalchemy.orm import aliased
 
 from mirrormanager2 import default_config
 from mirrormanager2.lib import model
@@ -123,6 +124,61 @@ def get_host(session, host_id):
     return query.first()
 
 
+def get_crawl_histories(session, host_ids):
+    """Return the durations of the previous crawls of the specified Hosts.
+
+    :arg session: the session with which to connect to the database.
+    :arg host_ids: the IDs of the Hosts.
+    :returns: a dict of host ID to a tuple of the duration of the last full crawl and the
+        history stored in Host.last_crawls.
+
+    """
+    if not host_ids:
+        return {}
+    query = sa.select(model.Host.id, model.Host.last_crawl_duration, model.Host.last_crawls).where(
+        model.Host.id.in_(host_ids)
+    )
+    return {row.id: (row.last_crawl_duration, row.last_crawls) for row in session.execute(query)}
+
+
+def get_host_category_urls(session, host_ids, category_ids=None):
+    """Return the URLs of the HostCategories of the specified Hosts.
+
+    :arg session: the session with which to connect to the database.
+    :arg host_ids: the IDs of the Hosts.
+    :arg category_ids: only return the HostCategories of those Categories, if set.
+    :returns: rows of host ID, host name, max_connections, HostCategory ID, always_up2date
+        and URL, sorted by host and HostCategory. The HostCategory columns are None for the
+        Hosts without any, and the URL for the HostCategories without any.
+
+    """
+    if not host_ids:
+        return []
+    host_category_filter = model.HostCategory.host_id == model.Host.id
+    if category_ids:
+        host_category_filter = sa.and_(
+            host_category_filter, model.HostCategory.category_id.in_(category_ids)
+        )
+    query = (
+        sa.select(
+            model.Host.id.label("host_id"),
+            model.Host.name.label("host_name"),
+            model.Host.max_connections,
+            model.HostCategory.id.label("host_category_id"),
+            model.HostCategory.always_up2date,
+            model.HostCategoryUrl.url,
+        )
+        .outerjoin(model.HostCategory, host_category_filter)
+        .outerjoin(
+            model.HostCategoryUrl,
+            model.HostCategoryUrl.host_category_id == model.HostCategory.id,
+        )
+        .where(model.Host.id.in_(host_ids))
+        .order_by(model.Host.id, model.HostCategory.id, model.HostCategoryUrl.id)
+    )
+    return session.execute(query).all()
+
+
 def get_host_by_name(session, host_name):
     """Return a specified Host via its name.
 
@@ -639,6 +695,25 @@ def get_directory_by_name(session, dirname):
     return query.one_or_none()
 
 
+def get_category_directory_by_name(session, category, dirname):
+    """Return a specified Directory via its name, if it is one of the directories of the
+    category.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = (
+        session.query(model.Directory)
+        .join(model.CategoryDirectory)
+        .filter(
+            model.CategoryDirectory.category_id == category.id,
+            model.Directory.name == dirname,
+        )
+    )
+
+    return query.one_or_none()
+
+
 def get_file_detail(
     session,
     filename,
@@ -732,6 +807,77 @@ def get_file_details_with_checksum(session, file_detail, checksum, age_threshold
     return query.first()
 
 
+def get_latest_sha256sums(session, directory_ids, filename):
+    """Return the SHA256 checksum of the latest FileDetail of a file in each of the
+    specified Directories.
+
+    :arg session: the session with which to connect to the database.
+    :arg directory_ids: the IDs of the Directories.
+    :arg filename: the name of the file.
+    :returns: a dict of directory ID to SHA256 checksum.
+
+    """
+    if not directory_ids:
+        return {}
+    latest = (
+        sa.select(sa.func.max(model.FileDetail.id))
+        .where(
+            model.FileDetail.filename == filename,
+            model.FileDetail.directory_id.in_(directory_ids),
+        )
+        .group_by(model.FileDetail.directory_id)
+    )
+    query = sa.select(model.FileDetail.directory_id, model.FileDetail.sha256).where(
+        model.FileDetail.id.in_(latest)
+    )
+    return {row.directory_id: row.sha256 for row in session.execute(query)}
+
+
+def get_recent_sha256_timestamps(session, directory_ids, filename, max_age):
+    """Return the recent SHA256 checksums of a file in each of the specified Directories.
+
+    :arg session: the session with which to connect to the database.
+    :arg directory_ids: the IDs of the Directories.
+    :arg filename: the name of the file.
+    :arg max_age: only the FileDetails that are less than ``max_age`` seconds older than
+        the latest FileDetail of the file in the Directory are returned.
+    :returns: a dict of directory ID to a tuple of the ID of the latest FileDetail of the
+        file, and a dict of SHA256 checksum to the newest timestamp with that checksum.
+
+    """
+    if not directory_ids:
+        return {}
+    latest_ids = (
+        sa.select(sa.func.max(model.FileDetail.id))
+        .where(
+            model.FileDetail.filename == filename,
+            model.FileDetail.directory_id.in_(directory_ids),
+        )
+        .group_by(model.FileDetail.directory_id)
+    )
+    latest = aliased(model.FileDetail)
+    query = (
+        sa.select(
+            model.FileDetail.directory_id,
+            model.FileDetail.sha256,
+            model.FileDetail.timestamp,
+            latest.id.label("latest_id"),
+        )
+        .join(latest, latest.directory_id == model.FileDetail.directory_id)
+        .where(
+            latest.id.in_(latest_ids),
+            model.FileDetail.filename == filename,
+            model.FileDetail.timestamp > latest.timestamp - max_age,
+        )
+    )
+    result = {}
+    for row in session.execute(query):
+        _latest_id, timestamps = result.setdefault(row.directory_id, (row.latest_id, {}))
+        if row.sha256 and row.timestamp > timestamps.get(row.sha256, 0):
+            timestamps[row.sha256] = row.timestamp
+    return result
+
+
 def get_directory_by_id(session, id):
     """Return a specified Directory via its identifier.
 
@@ -775,6 +921,76 @@ def get_directories_by_category(session, category, only_repodata=False):
     return session.scalars(query)
 
 
+def get_directory_rows_by_category(session, category, only_repodata=False):
+    """Return the id, name, readable, ctime and files of the Directories linked to the
+    specified Category, as rows instead of Directory objects.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = _get_directories_by_category_query(category, only_repodata)
+    query = query.with_only_columns(
+        model.Directory.id,
+        model.Directory.name,
+        model.Directory.readable,
+        model.Directory.ctime,
+        model.Directory.files,
+        maintain_column_froms=True,
+    ).order_by(model.Directory.name)
+    return session.execute(query).all()
+
+
+def iter_directory_rows_by_category(session, category, only_repodata=False, batch_size=1000):
+    """Yield the rows of :func:`get_directory_rows_by_category` in lists of at most
+    ``batch_size`` rows, sorted by name.
+
+    Each list is fetched with its own query, after the last name of the previous one, so that
+    no cursor stays open while the rows are used and the session can be committed between
+    them.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = (
+        _get_directories_by_category_query(category, only_repodata)
+        .with_only_columns(
+            model.Directory.id,
+            model.Directory.name,
+            model.Directory.readable,
+            model.Directory.ctime,
+            model.Directory.files,
+            maintain_column_froms=True,
+        )
+        .order_by(model.Directory.name)
+        .limit(batch_size)
+    )
+    last_name = None
+    while True:
+        batch_query = query
+        if last_name is not None:
+            batch_query = query.where(model.Directory.name > last_name)
+        rows = session.execute(batch_query).all()
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_name = rows[-1].name
+
+
+def get_directory_ctimes_by_category(session, category):
+    """Return the name and ctime of the Directories linked to the specified Category,
+    sorted by name.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = _get_directories_by_category_query(category, False)
+    query = query.with_only_columns(
+        model.Directory.name, model.Directory.ctime, maintain_column_froms=True
+    ).order_by(model.Directory.name)
+    return session.execute(query).all()
+
+
 def count_directories_by_category(session, category, only_repodata=False):
     """Count the Directory objects linked to the specified Category
 
@@ -801,6 +1017,36 @@ def get_hostcategorydir_by_hostcategoryid_and_path(session, host_category_id, pa
     return query.first()
 
 
+def get_category_ids_by_hosts(session, host_ids):
+    """Return the IDs of the Categories that the specified Hosts carry.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = (
+        sa.select(sa.func.distinct(model.HostCategory.category_id))
+        .where(model.HostCategory.host_id.in_(host_ids))
+        .order_by(model.HostCategory.category_id)
+    )
+    return list(session.scalars(query))
+
+
+def get_hostcategorydirs_by_hostcategory(session, hc):
+    """Return the id, path, up2date and directory_id of all the HostCategoryDir of a
+    HostCategory, without loading the objects.
+
+    :arg session: the session with which to connect to the database.
+
+    """
+    query = sa.select(
+        model.HostCategoryDir.id,
+        model.HostCategoryDir.path,
+        model.HostCategoryDir.up2date,
+        model.HostCategoryDir.directory_id,
+    ).where(model.HostCategoryDir.host_category_id == hc.id)
+    return session.execute(query).all()
+
+
 def count_hostcategorydirs_with_unreadable_dir(session, hc):
     """Return the number of HostCategoryDir objects linked to a HostCategory
     that are linked to an unreadable Directory.
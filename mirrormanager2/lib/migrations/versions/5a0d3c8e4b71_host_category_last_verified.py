@@ -0,0 +1,26 @@
+"""HostCategory crawl timestamps
+
+Revision ID: 5a0d3c8e4b71
+Revises: e67aacbf9f4f
+Create Date: 2026-10-18 09:12:31.208473
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5a0d3c8e4b71"
+down_revision = "e67aacbf9f4f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("host_category", sa.Column("last_verified", sa.BigInteger(), nullable=True))
+    op.add_column("host_category", sa.Column("last_full_crawl", sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("host_category", "last_full_crawl")
+    op.drop_column("host_category", "last_verified")
@@ -0,0 +1,24 @@
+"""HostCategory listing digest
+
+Revision ID: 9b2e64d1a7c5
+Revises: f3a86b5c0e27
+Create Date: 2026-10-18 17:12:44.206315
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9b2e64d1a7c5"
+down_revision = "f3a86b5c0e27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("host_category", sa.Column("listing_digest", sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("host_category", "listing_digest")
@@ -0,0 +1,39 @@
+"""Crawl leases
+
+Revision ID: c4e1f7a9d2b3
+Revises: 5a0d3c8e4b71
+Create Date: 2026-10-18 14:05:12.734102
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c4e1f7a9d2b3"
+down_revision = "5a0d3c8e4b71"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "crawl_lease",
+        sa.Column("host_id", sa.Integer(), nullable=False),
+        sa.Column("run_id", sa.Text(), nullable=True),
+        sa.Column("node_id", sa.Text(), nullable=True),
+        sa.Column("expires_at", sa.BigInteger(), nullable=True),
+        sa.Column("finished_at", sa.BigInteger(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["host_id"],
+            ["host.id"],
+            name=op.f("fk_crawl_lease_host_id_host"),
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("host_id", name=op.f("pk_crawl_lease")),
+    )
+
+
+def downgrade():
+    op.drop_table("crawl_lease")
@@ -0,0 +1,28 @@
+"""HostCategory crawl checkpoint
+
+Revision ID: f3a86b5c0e27
+Revises: c4e1f7a9d2b3
+Create Date: 2026-10-18 15:41:08.519027
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f3a86b5c0e27"
+down_revision = "c4e1f7a9d2b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("host_category", sa.Column("crawl_checkpoint", sa.Text(), nullable=True))
+    op.add_column(
+        "host_category", sa.Column("crawl_checkpoint_started", sa.BigInteger(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("host_category", "crawl_checkpoint_started")
+    op.drop_column("host_category", "crawl_checkpoint")
@@ -206,6 +206,12 @@ class Host(BASE):
             .values(up2date=False)
         )
         session.execute(statement)
+        # The statuses must be checked again, even if the mirror has not changed
+        session.execute(
+            sa.update(HostCategory)
+            .where(HostCategory.id.in_(hc_ids))
+            .values(listing_digest=None)
+        )
 
     def is_active(self):
         return self.admin_active and self.user_active and self.site.user_active
@@ -512,6 +518,18 @@ class HostCategory(BASE):
         sa.Integer, sa.ForeignKey("category.id", ondelete="CASCADE"), nullable=True
     )
     always_up2date = sa.Column(sa.Boolean(), default=False, nullable=False)
+    # Used by the crawler's incremental mode: the newest Directory.ctime of
+    # the category when it was last successfully crawled, and the timestamp
+    # of the last crawl that checked all the directories.
+    last_verified = sa.Column(sa.BigInteger, nullable=True)
+    last_full_crawl = sa.Column(sa.BigInteger, nullable=True)
+    # The last directory checked by a full crawl that was interrupted, and when that
+    # crawl started. The next crawl resumes after this directory.
+    crawl_checkpoint = sa.Column(sa.Text(), nullable=True)
+    crawl_checkpoint_started = sa.Column(sa.BigInteger, nullable=True)
+    # The digest of the rsync listing and of the directories of the category when it was last
+    # fully crawled. The next crawls are skipped while it does not change.
+    listing_digest = sa.Column(sa.Text(), nullable=True)
 
     # Relations
     category = relationship("Category", back_populates="host_categories")
@@ -1095,3 +1113,21 @@ class PropagationStat(BASE):
     no_info = sa.Column(sa.Integer, nullable=False, default=0)
 
     repository = relationship("Repository", back_populates="propagation_stats")
+
+
+class CrawlLease(BASE):
+    """A host being crawled by one of the crawler nodes sharing a work queue"""
+
+    __tablename__ = "crawl_lease"
+
+    host_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey("host.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    # The name of the crawl run shared by the nodes
+    run_id = sa.Column(sa.Text(), nullable=True)
+    node_id = sa.Column(sa.Text(), nullable=True)
+    # Timestamps
+    expires_at = sa.Column(sa.BigInteger, nullable=True)
+    finished_at = sa.Column(sa.BigInteger, nullable=True)
@@ -108,3 +108,65 @@ def run_rsync(rsyncpath, extra_rsync_args=None, logger=None, timeout=None):
     tmpfile.flush()
     tmpfile.seek(0)
     return (result, tmpfile)
+
+
+def stream_rsync(rsyncpath, callback, extra_rsync_args=None, logger=None, timeout=None):
+    """
+    This functions runs 'rsync' on :rsyncpath: like run_rsync() does, but
+    instead of storing the output listing it calls :callback: with each line
+    as soon as rsync prints it. The listing is never kept in memory or on disk.
+
+    If :callback: raises an exception, rsync is killed and the exception is
+    propagated.
+
+    :param rsyncpath: The path 'rsync' should use to do a recursive listing.
+                      This can be anything 'rsync' accepts.
+    :param callback: A function called with each line of the listing.
+    :param extra_rsync_args: Additional parameters added to 'rsync' like
+                             excludes or includes or anything else.
+    :param logger: If a logger is available it will be used for messages
+    :param timeout: The timeout after which the rsync process should
+                    definitely end. Will be p.kill()-ed.
+    :returns: return code
+    """
+
+    cmd = "rsync --temp-dir=/tmp -r --exclude=.snapshot --exclude='*.~tmp~'"
+    if extra_rsync_args is not None:
+        cmd += " " + extra_rsync_args
+    cmd += " " + rsyncpath
+    if logger is not None:
+        logger.debug("About to run the following rsync command: " + cmd)
+    p = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        text=True,
+        errors="replace",
+    )
+
+    timeout_thread = None
+    e = None
+    if timeout:
+        # Start a thread to check the status of the process after ``timeout``
+        # seconds. If the process is still running then, kill it.
+        e = threading.Event()
+        timeout_thread = threading.Thread(target=check_timeout, args=[logger, p, timeout, e])
+        timeout_thread.start()
+
+    try:
+        for line in p.stdout:
+            callback(line)
+    except BaseException:
+        p.kill()
+        raise
+    finally:
+        p.stdout.close()
+        p.wait()
+        if e:
+            e.set()
+            timeout_thread.join()
+
+    return p.returncode
@@ -1,4 +1,5 @@
 import datetime
+import gzip
 import os
 import re
 from urllib.parse import urlsplit
@@ -1235,4 +1236,20 @@ def mirrors_location():
 @views.route("/crawler/<int:host_id>.log")
 def crawler_log(host_id):
     crawler_log_dir = os.path.join(flask.current_app.config["MM_LOG_DIR"], "crawler")
+    log_path = os.path.join(crawler_log_dir, f"{host_id}.log")
+    compressed_path = f"{log_path}.gz"
+    if os.path.exists(compressed_path) and (
+        not os.path.exists(log_path)
+        or os.path.getmtime(compressed_path) > os.path.getmtime(log_path)
+    ):
+        # The crawler writes compressed logs with CRAWLER_LOG_GZIP
+        def _read():
+            with gzip.open(compressed_path, "rt", encoding="utf-8", errors="replace") as log:
+                try:
+                    yield from log
+                except EOFError:
+                    # The crawler is still writing it
+                    return
+
+        return flask.Response(_read(), mimetype="text/plain")
     return flask.helpers.send_from_directory(crawler_log_dir, f"{host_id}.log", max_age=None)
@@ -3,8 +3,14 @@ mirrormanager2 tests.
 """
 
 import datetime
+import hashlib
 import logging
 import os
+import posixpath
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 import responses
@@ -46,6 +52,214 @@ def mocked_responses():
         yield rsps
 
 
+class MirrorHTTPServer(ThreadingHTTPServer):
+    """A fake mirror serving files from a dict of path to content.
+
+    The value can also be an integer, it will then be returned as the HTTP status code.
+    The status codes in ``get_errors`` are only returned to the GET requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MirrorHTTPRequestHandler)
+        self.files = {}
+        self.get_errors = {}
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class MirrorHTTPRequestHandler(BaseHTTPRequestHandler):
+    def _respond(self, with_body):
+        self.server.requests.append((self.command, self.path))
+        path = self.path.split("?")[0]
+        content = self.server.files.get(path, 404)
+        if with_body:
+            content = self.server.get_errors.get(path, content)
+        if isinstance(content, int):
+            self.send_response(content)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if with_body:
+            self.wfile.write(content)
+
+    def do_HEAD(self):
+        self._respond(with_body=False)
+
+    def do_GET(self):
+        self._respond(with_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def http_server():
+    server = MirrorHTTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class MirrorFTPServer(socketserver.ThreadingTCPServer):
+    """A fake anonymous FTP mirror serving files from a dict of path to content.
+
+    It only implements the commands that the crawler uses. MLSD and ``LIST -R`` can be
+    turned off to emulate the older servers.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MirrorFTPRequestHandler)
+        self.files = {}
+        self.commands = []
+        self.mlsd = True
+        self.recursive = True
+
+    @property
+    def url(self):
+        return f"ftp://127.0.0.1:{self.server_address[1]}"
+
+    def list_dir(self, path):
+        """Return the files and the sub-directories of a directory, or None if it's missing"""
+        path = path.rstrip("/") or "/"
+        prefix = "/" if path == "/" else f"{path}/"
+        files, dirs = {}, set()
+        for file_path, content in self.files.items():
+            if not file_path.startswith(prefix):
+                continue
+            name, sep, _rest = file_path[len(prefix) :].partition("/")
+            if sep:
+                dirs.add(name)
+            else:
+                files[name] = content
+        if not files and not dirs and path != "/":
+            return None
+        return files, sorted(dirs)
+
+
+class MirrorFTPRequestHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def _send_data(self, lines):
+        self._reply("150 Here comes the listing")
+        conn, _addr = self._data_socket.accept()
+        with conn:
+            conn.sendall("".join(f"{line}\r\n" for line in lines).encode())
+        self._data_socket.close()
+        self._reply("226 Transfer complete")
+
+    def _path(self, arg):
+        return posixpath.normpath(posixpath.join(self._cwd, arg or "."))
+
+    def _ls_lines(self, path):
+        files, dirs = self.server.list_dir(path)
+        lines = [f"drwxr-xr-x    2 ftp      ftp          4096 Jul 05  2017 {d}" for d in dirs]
+        lines.extend(
+            f"-rw-r--r--    1 ftp      ftp      {len(content):>8} Jul 05  2017 {name}"
+            for name, content in sorted(files.items())
+        )
+        return lines
+
+    def _ls_recursive_lines(self, path, relative="."):
+        lines = [f"{relative}:", *self._ls_lines(path), ""]
+        for subdir in self.server.list_dir(path)[1]:
+            lines.extend(
+                self._ls_recursive_lines(posixpath.join(path, subdir), f"{relative}/{subdir}")
+            )
+        return lines
+
+    def handle(self):
+        self._cwd = "/"
+        self._data_socket = None
+        self._reply("220 Fake mirror")
+        for raw_line in self.rfile:
+            command, _sep, arg = raw_line.decode().strip().partition(" ")
+            command = command.upper()
+            self.server.commands.append((command, arg))
+            if command == "USER":
+                self._reply("331 Please specify the password")
+            elif command == "PASS":
+                self._reply("230 Login successful")
+            elif command == "FEAT":
+                if self.server.mlsd:
+                    self._reply("211-Features:\r\n MLST type*;size*;modify*;\r\n PASV\r\n211 End")
+                else:
+                    self._reply("211-Features:\r\n PASV\r\n211 End")
+            elif command == "TYPE":
+                self._reply("200 Switching mode")
+            elif command == "PWD":
+                self._reply(f'257 "{self._cwd}"')
+            elif command == "CWD":
+                path = self._path(arg)
+                if self.server.list_dir(path) is None:
+                    self._reply("550 Failed to change directory")
+                else:
+                    self._cwd = path
+                    self._reply("250 Directory successfully changed")
+            elif command == "PASV":
+                self._data_socket = socket.create_server(("127.0.0.1", 0))
+                port = self._data_socket.getsockname()[1]
+                self._reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF})")
+            elif command == "LIST":
+                options = [a for a in arg.split() if a.startswith("-")]
+                path = self._path(" ".join(a for a in arg.split() if not a.startswith("-")))
+                if self.server.list_dir(path) is None:
+                    self._data_socket.close()
+                    self._reply("550 No such directory")
+                elif "-R" in options and self.server.recursive:
+                    self._send_data(self._ls_recursive_lines(path))
+                else:
+                    self._send_data(self._ls_lines(path))
+            elif command == "MLSD" and self.server.mlsd:
+                path = self._path(arg)
+                if self.server.list_dir(path) is None:
+                    self._data_socket.close()
+                    self._reply("550 No such directory")
+                    continue
+                files, dirs = self.server.list_dir(path)
+                lines = [f"type=dir; {d}" for d in dirs]
+                lines.extend(
+                    f"type=file;size={len(content)}; {name}"
+                    for name, content in sorted(files.items())
+                )
+                self._send_data(lines)
+            elif command == "QUIT":
+                self._reply("221 Goodbye")
+                return
+            else:
+                self._reply("500 Unknown command")
+
+
+@pytest.fixture()
+def ftp_server():
+    server = MirrorFTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture()
 def db(app):
     DB.manager.sync()
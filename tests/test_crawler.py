@@ -15,8 +15,67 @@
 mirrormanager2 tests for the crawler.
 """
 
+import datetime
+import gzip
+import io
+import logging
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType, SimpleNamespace
 
+import pytest
+import sqlalchemy as sa
+from rich.console import Console
+
+import mirrormanager2.lib as mmlib
+from mirrormanager2.crawler.canary import CanaryEngine, CanaryHost
+from mirrormanager2.crawler.cli import build_snapshot, record_canary
+from mirrormanager2.crawler.connector import Connector, TryLater
+from mirrormanager2.crawler.crawler import (
+    CANARY_FAILED_DETAILS,
+    CategoryUnchanged,
+    Crawler,
+    CrawlResult,
+    ListingDigest,
+    WorkerContext,
+    get_preferred_urls,
+    worker,
+)
+from mirrormanager2.crawler.database import get_crawler_db_manager
+from mirrormanager2.crawler.incremental import plan_crawl
+from mirrormanager2.crawler.leases import LeaseManager
+from mirrormanager2.crawler.log import HostLogRouter
+from mirrormanager2.crawler.memory import MemoryCeiling
+from mirrormanager2.crawler.metrics import metrics
+from mirrormanager2.crawler.processes import WorkerProcesses
+from mirrormanager2.crawler.propagation import ChecksumIndex, PropagationCache
+from mirrormanager2.crawler.reconcile import HostCategoryDirReconciler
+from mirrormanager2.crawler.reporter import store_crawl_result
+from mirrormanager2.crawler.sampling import (
+    DirectorySampler,
+    RepositorySampler,
+    get_packages_root,
+    order_files,
+)
+from mirrormanager2.crawler.scheduler import Schedule, record_crawl_duration
+from mirrormanager2.crawler.snapshot import (
+    CategorySnapshot,
+    CrawlSnapshot,
+    DatabaseCategory,
+    DirectorySnapshot,
+)
+from mirrormanager2.crawler.states import CrawlMode, CrawlStatus, SyncStatus
+from mirrormanager2.crawler.threads import (
+    Continuation,
+    HostTimeoutError,
+    on_thread_started,
+    run_in_threadpool,
+)
+from mirrormanager2.crawler.ui import ProgressTask
+from mirrormanager2.crawler.writer import DatabaseWriter
+from mirrormanager2.lib import model
 from mirrormanager2.lib.sync import run_rsync
 
 FOLDER = os.path.dirname(os.path.abspath(__file__))
@@ -82,3 +141,906 @@ def test_run_rsync():
 
     # Check that non-excluded files are still included
     assert "fedora/linux/development/22/" in output
+
+
+def test_hostcategorydir_reconciler(db, db_items):
+    """Test the batched reconciliation of HostCategoryDirs"""
+    hc = db.get(model.HostCategory, 3)
+    db.add_all(
+        [
+            model.HostCategoryDir(
+                host_category_id=hc.id, path="/releases/26", directory_id=4, up2date=False
+            ),
+            model.HostCategoryDir(
+                host_category_id=hc.id, path="/extras", directory_id=None, up2date=True
+            ),
+        ]
+    )
+    db.commit()
+
+    reconciler = HostCategoryDirReconciler(db, hc, hc.category.topdir.name)
+    directories = {d.id: d for d in db.scalars(sa.select(model.Directory))}
+    assert reconciler.get_stale_names() == {directories[4].name}
+    assert reconciler.sync_dir(directories[4], True) == SyncStatus.UP2DATE
+    assert reconciler.sync_dir(directories[2], True) == SyncStatus.UNCHANGED
+    # New HostCategoryDir
+    assert reconciler.sync_dir(directories[1], True) == SyncStatus.UNCHANGED
+    # Not up2date and unknown: not created
+    assert reconciler.sync_dir(directories[5], False) == SyncStatus.UNKNOWN
+    assert reconciler.sync_dir(directories[3], None) == SyncStatus.UNKNOWN
+    # Nothing has been written yet
+    assert len(mmlib.get_hostcategorydirs_by_hostcategory(db, hc)) == 3
+
+    # The HostCategoryDir from the fixture has not been seen
+    assert reconciler.apply(db, mark_unseen_not_up2date=True) == 1
+    db.commit()
+
+    hcds = {
+        row.path: (row.up2date, row.directory_id)
+        for row in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)
+    }
+    assert hcds == {
+        "": (True, 1),
+        "/releases/26": (True, 4),
+        "/extras": (True, 2),
+        "pub/fedora/linux/releases/27": (False, 5),
+    }
+
+
+def test_hostcategorydir_reconciler_checked_twice(db, db_items):
+    """Test a directory checked again, for example with the next URL of the category"""
+    hc = db.get(model.HostCategory, 3)
+    reconciler = HostCategoryDirReconciler(db, hc, hc.category.topdir.name)
+    directory = db.get(model.Directory, 1)
+    assert reconciler.sync_dir(directory, True) == SyncStatus.UNCHANGED
+    assert reconciler.sync_dir(directory, True) == SyncStatus.UNCHANGED
+    assert reconciler.sync_dir(directory, False) == SyncStatus.NOT_UP2DATE
+    # Written in chunks, like with the checkpoints
+    reconciler.apply(db)
+    db.commit()
+    assert reconciler.sync_dir(directory, False) == SyncStatus.UNCHANGED
+    assert reconciler.sync_dir(directory, True) == SyncStatus.UP2DATE
+    reconciler.apply(db)
+    db.commit()
+    hcds = [
+        (row.path, row.up2date)
+        for row in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)
+        if row.directory_id == directory.id
+    ]
+    assert hcds == [("", True)]
+
+
+def test_crawl_checkpoint(app, db, db_items):
+    """Test resuming a full crawl that was interrupted"""
+    hc = db.get(model.HostCategory, 3)
+    db.add(model.HostCategoryDir(host_category_id=hc.id, path="/extras", up2date=True))
+    db.commit()
+    directories = {d.id: d for d in db.scalars(sa.select(model.Directory))}
+
+    # The statuses are applied in chunks
+    reconciler = HostCategoryDirReconciler(db, hc, hc.category.topdir.name)
+    assert reconciler.sync_dir(directories[1], True) == SyncStatus.UNCHANGED
+    reconciler.apply(db)
+    db.commit()
+    # Checked by the crawl that was interrupted
+    reconciler.mark_seen(directories[2])
+    assert reconciler.sync_dir(directories[4], True) == SyncStatus.UNCHANGED
+    # Only the HostCategoryDir from the fixture has not been seen, the one created in the
+    # first chunk is not marked as not up2date
+    assert reconciler.apply(db, mark_unseen_not_up2date=True) == 1
+    db.commit()
+    hcds = {row.path: row.up2date for row in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)}
+    assert hcds == {
+        "": True,
+        "/extras": True,
+        "/releases/26": True,
+        "pub/fedora/linux/releases/27": False,
+    }
+
+    options = {"host_timeout": None, "debug": False}
+    crawler = Crawler(app.config, db, options, None, hc.host)
+    assert crawler._get_checkpoint(hc) is None
+    hc.crawl_checkpoint = directories[4].name
+    hc.crawl_checkpoint_started = int(time.time()) - 3600
+    assert crawler._get_checkpoint(hc) == directories[4].name
+    # Too old
+    hc.crawl_checkpoint_started = int(time.time()) - 2 * 86400
+    assert crawler._get_checkpoint(hc) is None
+    # The directory has been deleted
+    hc.crawl_checkpoint = "pub/fedora/linux/releases/25"
+    hc.crawl_checkpoint_started = int(time.time())
+    assert crawler._get_checkpoint(hc) is None
+    # The directory is not in the category anymore
+    db.add(model.Directory(name="pub/fedora/linux/moved", readable=True))
+    db.commit()
+    hc.crawl_checkpoint = "pub/fedora/linux/moved"
+    assert crawler._get_checkpoint(hc) is None
+
+
+def test_crawl_checkpoint_timeout(app, db, db_items, monkeypatch):
+    """Test that the crawl of a host that timed out is resumed from its checkpoint"""
+    hc = db.get(model.HostCategory, 3)
+    for directory in db.scalars(sa.select(model.Directory)):
+        directory.files = {}
+    db.commit()
+    options = {"canary": False, "repodata": False, "host_timeout": None, "debug": False}
+    resumed_after = []
+
+    def _get_directory_statuses(self, hc, category, resume_after, *args):
+        resumed_after.append(resume_after)
+        if resume_after is None:
+            yield next(category.get_directories()), True
+            raise HostTimeoutError()
+
+    monkeypatch.setattr(Crawler, "_get_directory_statuses", _get_directory_statuses)
+    crawler = Crawler(app.config, db, options, ProgressTask(None, hc.host_id), hc.host)
+    crawler.timeout.start()
+    with pytest.raises(HostTimeoutError):
+        crawler._scan_host_category(hc)
+    db.commit()
+    checkpoint = hc.crawl_checkpoint
+    assert checkpoint is not None
+    result = CrawlResult(
+        host_id=hc.host_id,
+        host_name=hc.host.name,
+        status=CrawlStatus.TIMEOUT.value,
+        details="Timed out",
+        finished_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+        duration=10,
+    )
+    store_crawl_result(app.config, options, db, result)
+    db.expire_all()
+    assert hc.crawl_checkpoint == checkpoint
+
+    # The next crawl goes on after the directory checked before the timeout
+    crawler = Crawler(app.config, db, options, ProgressTask(None, hc.host_id), hc.host)
+    crawler.timeout.start()
+    crawler._scan_host_category(hc)
+    assert resumed_after == [None, checkpoint]
+    assert hc.crawl_checkpoint is None
+
+
+def test_crawl_snapshot(db, db_items):
+    """Test that the snapshot has the same directories as the database"""
+    hc = db.get(model.HostCategory, 3)
+    directory = db.get(model.Directory, 4)
+    directory.files = {"repomd.xml": {"size": 42, "stat": 1500000000}}
+    db.add(
+        model.FileDetail(
+            filename="repomd.xml", directory_id=directory.id, timestamp=1500000000, sha256="abc"
+        )
+    )
+    db.add(
+        model.FileDetail(
+            filename="repomd.xml", directory_id=directory.id, timestamp=1500000001, sha256="def"
+        )
+    )
+    db.commit()
+
+    snapshot = CrawlSnapshot.build(db, [hc.host_id])
+    assert snapshot.country_continents is None
+    category = snapshot.get_category(db, hc.category)
+    assert isinstance(category, CategorySnapshot)
+    assert category.topdir_name == hc.category.topdir.name
+    expected = [
+        d.name for d in mmlib.get_directories_by_category(db, hc.category, only_repodata=False)
+    ]
+    assert [d.name for d in category.get_directories()] == expected
+    assert category.count_directories() == len(expected)
+    by_id = {d.id: d for d in category.get_directories()}
+    assert by_id[4].files == {"repomd.xml": {"size": 42, "stat": 1500000000}}
+    # The latest checksum is used
+    assert by_id[4].sha256sums == {"repomd.xml": "def"}
+    assert by_id[4] == DirectorySnapshot.from_directory(db, directory)
+
+    # Categories that are not in the snapshot are read from the database
+    other_id = next(c.id for c in mmlib.get_categories(db) if c.id != hc.category.id)
+    other = CrawlSnapshot.build(db, [hc.host_id], category_ids=[other_id])
+    assert list(other.categories) == [other_id]
+    assert isinstance(other.get_category(db, hc.category), DatabaseCategory)
+
+    # The database is read in batches, with the same result
+    from_database = DatabaseCategory(db, hc.category, batch_size=2)
+    db.expunge_all()
+    assert sorted(from_database.get_directories(), key=lambda d: d.name) == sorted(
+        category.get_directories(), key=lambda d: d.name
+    )
+    # Without loading the Directory objects
+    assert not any(isinstance(obj, model.Directory) for obj in db.identity_map.values())
+
+
+def test_crawl_snapshot_max_directories(app, db, db_items, monkeypatch):
+    """Test that the categories that are too large for the snapshot are streamed"""
+    hc = db.get(model.HostCategory, 3)
+    for directory in db.scalars(sa.select(model.Directory)):
+        directory.files = {}
+    db.commit()
+    count = mmlib.count_directories_by_category(db, hc.category)
+    assert count > 1
+    options = {
+        "canary": False,
+        "repodata": False,
+        "continents": None,
+        "host_timeout": None,
+        "debug": False,
+    }
+    ctx_obj = {"config": app.config, "category_ids": None}
+    snapshot = build_snapshot(ctx_obj, options, [hc.host_id])
+    assert hc.category_id in snapshot.categories
+    config = dict(app.config, CRAWLER_SNAPSHOT_MAX_DIRECTORIES=count)
+    snapshot = build_snapshot(dict(ctx_obj, config=config), options, [hc.host_id])
+    assert hc.category_id in snapshot.categories
+
+    config = dict(app.config, CRAWLER_SNAPSHOT_MAX_DIRECTORIES=count - 1)
+    snapshot = build_snapshot(dict(ctx_obj, config=config), options, [hc.host_id])
+    assert hc.category_id not in snapshot.categories
+
+    crawler = Crawler(config, db, options, ProgressTask(None, hc.host_id), hc.host, snapshot)
+    crawler.timeout.start()
+    crawled = []
+
+    def _get_directory_statuses(hc, category, *args):
+        crawled.append(category)
+        return iter(())
+
+    monkeypatch.setattr(crawler, "_get_directory_statuses", _get_directory_statuses)
+    stats = crawler._scan_host_category(hc)
+    assert len(crawled) == 1
+    assert isinstance(crawled[0], DatabaseCategory)
+    assert stats.total_directories == count
+
+
+def _directory_snapshot(id, name, ctime):
+    return DirectorySnapshot(
+        id=id, name=name, readable=True, ctime=ctime, files=MappingProxyType({})
+    )
+
+
+def test_plan_crawl():
+    """Test the choice of the crawl mode in incremental crawls"""
+    category = CategorySnapshot(
+        id=1,
+        name="Fedora Linux",
+        topdir_name="pub/fedora",
+        directories=(
+            _directory_snapshot(1, "pub/fedora/linux", 100),
+            _directory_snapshot(2, "pub/fedora/linux/releases", 100),
+            _directory_snapshot(3, "pub/fedora/linux/releases/26", 200),
+            _directory_snapshot(4, "pub/fedora/linux/releases/26/os/repodata", 100),
+        ),
+    )
+    config = {"CRAWLER_INCREMENTAL_SAMPLE": 0}
+    now = 1000000
+
+    # Never crawled
+    hc = model.HostCategory(last_verified=None, last_full_crawl=None)
+    plan = plan_crawl(config, hc, category, now=now)
+    assert plan.mode == CrawlMode.FULL
+    assert plan.category is category
+
+    # Last full crawl is too old
+    hc = model.HostCategory(last_verified=100, last_full_crawl=now - 25 * 3600)
+    assert plan_crawl(config, hc, category, now=now).mode == CrawlMode.FULL
+
+    # One directory changed
+    hc = model.HostCategory(last_verified=150, last_full_crawl=now - 3600)
+    plan = plan_crawl(config, hc, category, now=now)
+    assert plan.mode == CrawlMode.INCREMENTAL
+    assert plan.newest_ctime == 200
+    assert [d.id for d in plan.category.get_directories()] == [3]
+    assert plan.category.topdir_name == "pub/fedora"
+
+    # Nothing changed: only the repodata is checked
+    hc = model.HostCategory(last_verified=200, last_full_crawl=now - 3600)
+    plan = plan_crawl(config, hc, category, now=now)
+    assert plan.mode == CrawlMode.REPODATA
+    assert [d.id for d in plan.category.get_directories()] == [4]
+
+    # A directory is still not up to date on the host
+    hc = model.HostCategory(last_verified=200, last_full_crawl=now - 3600)
+    plan = plan_crawl(config, hc, category, stale={"pub/fedora/linux/releases"}, now=now)
+    assert plan.mode == CrawlMode.INCREMENTAL
+    assert [d.id for d in plan.category.get_directories()] == [2]
+
+    # Too many changes
+    hc = model.HostCategory(last_verified=50, last_full_crawl=now - 3600)
+    plan = plan_crawl(config, hc, category, now=now)
+    assert plan.mode == CrawlMode.FULL
+    assert plan.category is category
+
+    # The sample is checked too
+    hc = model.HostCategory(last_verified=150, last_full_crawl=now - 3600)
+    plan = plan_crawl({"CRAWLER_INCREMENTAL_SAMPLE": 1}, hc, category, now=now)
+    assert plan.mode == CrawlMode.INCREMENTAL
+    assert plan.category.count_directories() == 4
+    assert plan.category.count_directories(only_repodata=True) == 1
+
+
+def test_checksum_index(db, db_items):
+    """Test the shared index of the repomd.xml checksums"""
+    repodata = model.Directory(name="pub/fedora/linux/releases/27/repodata", readable=True)
+    db.add(repodata)
+    db.flush()
+    for timestamp, sha256 in [
+        (1500000000 - 5 * 86400, "a" * 64),
+        (1500000000 - 86400, "b" * 64),
+        (1500000000, "c" * 64),
+    ]:
+        db.add(
+            model.FileDetail(
+                filename="repomd.xml",
+                directory_id=repodata.id,
+                timestamp=timestamp,
+                sha256=sha256,
+            )
+        )
+    db.commit()
+    latest = mmlib.get_file_detail(db, "repomd.xml", repodata.id, reverse=True)
+
+    index = ChecksumIndex.build(db, [("Fedora", "27")], max_stale_days=4)
+    assert len(index) == 1
+    assert latest in index
+    assert index.get_timestamp(latest, "b" * 64) == 1500000000 - 86400
+    assert index.get_timestamp(latest, "c" * 64) == 1500000000
+    # Older than MAX_STALE_DAYS
+    assert index.get_timestamp(latest, "a" * 64) is None
+    # A newer file has been published since the index was built
+    db.add(
+        model.FileDetail(
+            filename="repomd.xml", directory_id=repodata.id, timestamp=1500000001, sha256="d" * 64
+        )
+    )
+    db.commit()
+    newest = mmlib.get_file_detail(db, "repomd.xml", repodata.id, reverse=True)
+    assert newest not in index
+
+
+def test_schedule(app):
+    """Test the prediction of the crawl durations"""
+    host = SimpleNamespace(last_crawls=None)
+    for duration in [100, 300, 200]:
+        record_crawl_duration(host, "full", duration, history_length=2)
+    record_crawl_duration(host, "repodata", 10, history_length=2)
+    assert host.last_crawls == {"durations": {"full": [300, 200], "repodata": [10]}}
+
+    histories = {
+        1: (50, None),
+        2: (None, host.last_crawls),
+        3: (None, None),
+        4: (None, {"durations": {"full": [1000, 3000]}}),
+    }
+    options = {"host_timeout": 7200}
+    config = {"CRAWLER_HOST_TIMEOUT_FACTOR": 3, "CRAWLER_HOST_TIMEOUT_MIN": 1}
+    schedule = Schedule.build(config, options, histories, [1, 2, 3, 4])
+    # Longest first, host 3 is expected to take the median duration
+    assert schedule.host_ids == [4, 2, 3, 1]
+    assert schedule.get_timeout(2) == 900
+    assert schedule.get_timeout(1) == 150
+    # Capped by --host-timeout
+    assert schedule.get_timeout(4) == 7200
+    # No history
+    assert schedule.get_timeout(3) == 7200
+    assert schedule.get_makespan(threads=2) == 2000
+    # Host 4 takes as long as all the others
+    assert schedule.shard(2) == [[4], [2, 3, 1]]
+    assert schedule.shard(3) == [[4], [2, 1], [3]]
+    overruns = schedule.get_expected_overruns(threads=1, global_timeout=2400)
+    assert [(estimate.host_id, end) for estimate, end in overruns] == [(3, 2500), (1, 2550)]
+
+    schedule = Schedule.build(config, {"repodata": True, "host_timeout": None}, histories, [1, 2])
+    # The history of the full crawls is not used
+    assert [estimate.duration for estimate in schedule.estimates] == [None, 10]
+    assert schedule.get_timeout(2) == 60
+    assert schedule.get_timeout(1) is None
+
+    # Off by default, every host gets --host-timeout
+    schedule = Schedule.build(app.config, options, histories, [1, 2, 3, 4])
+    assert [schedule.get_timeout(host_id) for host_id in (1, 2, 3, 4)] == [7200] * 4
+
+
+def test_crawler_db_manager(app):
+    """Test the database engine shared by the crawler threads"""
+    config = app.config
+    db_manager = get_crawler_db_manager(config, threads=10)
+    assert get_crawler_db_manager(config) is db_manager
+    # One connection per thread, plus the main thread and the reporting
+    assert db_manager.engine.pool.size() == 12
+    metrics.reset()
+    with db_manager.Session() as session:
+        session.execute(sa.text("SELECT 1"))
+        assert db_manager.pool_monitor.checked_out == 1
+    assert db_manager.pool_monitor.checked_out == 0
+    assert db_manager.pool_monitor.max_checked_out == 1
+    db_manager.pool_monitor.record_metrics()
+    textfile = metrics.to_textfile()
+    assert "mirrormanager_crawler_db_pool_size 12" in textfile
+    assert "mirrormanager_crawler_db_pool_checked_out_max 1" in textfile
+    assert "mirrormanager_crawler_db_pool_wait_seconds_count 1" in textfile
+    db_manager.engine.dispose()
+
+
+def _crawl_in_process(context, host_id):
+    metrics.inc("requests_total", host=f"mirror-{host_id}")
+    context.propagation_cache.set(f"http://mirror-{host_id}/repomd.xml", "a" * 64, etag="1")
+    if host_id == 3:
+        # Skipped
+        return None
+    return (os.getpid(), host_id)
+
+
+def test_worker_processes(app):
+    """Test crawling the hosts in several processes"""
+    metrics.reset()
+    context = SimpleNamespace(
+        config=app.config,
+        progress=None,
+        propagation_cache=PropagationCache(),
+        writer=None,
+        http_pool=None,
+    )
+    processes = WorkerProcesses(
+        _crawl_in_process, context, [[1, 2], [3, 4], []], threads=4, timeout=60
+    )
+    # The empty shard is dropped and the threads are shared
+    assert processes.threads == 2
+    processes.start()
+    results = list(processes.results())
+    assert sorted(host_id for _pid, host_id in filter(None, results)) == [1, 2, 4]
+    assert None in results
+    assert len({pid for pid, _host_id in filter(None, results)}) == 2
+    assert os.getpid() not in {pid for pid, _host_id in filter(None, results)}
+    # The metrics and the propagation cache are merged back
+    assert 'mirrormanager_crawler_requests_total{host="mirror-4"} 1' in metrics.to_textfile()
+    assert len(context.propagation_cache) == 4
+
+
+def test_crawl_leases(app, db, db_items):
+    """Test sharing the hosts between crawler nodes"""
+    node_a = LeaseManager(app.config, {}, run_id="run-1", node_id="node-a")
+    node_b = LeaseManager(app.config, {}, run_id="run-1", node_id="node-b")
+    try:
+        assert node_a.acquire(1) is True
+        assert node_b.acquire(1) is False
+        # Crawled in this run
+        node_a.release(1)
+        assert node_b.acquire(1) is False
+        assert node_b.acquire(2) is True
+        node_b.renew()
+        # Node B stops, its lease expires
+        db.execute(
+            sa.update(model.CrawlLease).where(model.CrawlLease.host_id == 2).values(expires_at=0)
+        )
+        db.commit()
+        assert node_a.acquire(2) is True
+        lease = db.get(model.CrawlLease, 2)
+        db.refresh(lease)
+        assert lease.node_id == "node-a"
+        assert lease.finished_at is None
+        # The next run crawls all the hosts again
+        node_c = LeaseManager(app.config, {}, run_id="run-2", node_id="node-c")
+        assert node_c.acquire(1) is True
+        node_c.stop()
+    finally:
+        node_a.stop()
+        node_b.stop()
+
+
+def test_crawl_leases_expired(app, db, db_items, monkeypatch):
+    """Test crawling the host of a node that stopped during the run"""
+    crawled = []
+
+    def _check_host(context, host_id, deferred=None):
+        crawled.append(host_id)
+
+    monkeypatch.setattr("mirrormanager2.crawler.crawler.check_host", _check_host)
+    node_a = LeaseManager(app.config, {}, run_id="run-1", node_id="node-a")
+    node_b = LeaseManager(app.config, {}, run_id="run-1", node_id="node-b")
+    try:
+        assert node_a.acquire(1) is True
+        # Node A stops, its lease expires in a second
+        node_a.stop()
+        db.execute(
+            sa.update(model.CrawlLease)
+            .where(model.CrawlLease.host_id == 1)
+            .values(expires_at=int(time.time()) + 1)
+        )
+        db.commit()
+        assert 1 <= node_b.get_retry_delay(1) <= 2
+        context = WorkerContext(options={}, config=app.config, progress=None, leases=node_b)
+        results = run_in_threadpool(
+            worker, [1], fn_args=(context,), timeout=60, executor_kwargs={"max_workers": 1}
+        )
+        assert list(results) == [None]
+        assert crawled == [1]
+        lease = db.get(model.CrawlLease, 1)
+        db.refresh(lease)
+        assert lease.node_id == "node-b"
+        assert lease.finished_at is not None
+        # Crawled in this run
+        assert node_a.get_retry_delay(1) is None
+    finally:
+        node_a.stop()
+        node_b.stop()
+
+
+def test_continuation():
+    """Test calling a function again later without holding a thread"""
+    calls = []
+
+    def _check(item):
+        calls.append(item)
+        if item < 10:
+            # Try again later
+            return Continuation(item=item * 10, delay=0.1)
+        return item
+
+    results = run_in_threadpool(
+        _check, [1, 20, 3], fn_args=(), timeout=60, executor_kwargs={"max_workers": 1}
+    )
+    assert sorted(results) == [10, 20, 30]
+    # The other items were checked in the meantime
+    assert calls[:3] == [1, 20, 3]
+
+
+def test_connector_defer_retries():
+    """Test that the connector does not sleep between the retries when they are deferred"""
+
+    class OverloadedConnector(Connector):
+        def _check_dir(self, url, directory):
+            raise TryLater("FTP error 421")
+
+    directory = SimpleNamespace(name="pub/fedora/linux/releases/27")
+    connector = OverloadedConnector(
+        config={}, netloc="mirror", debuglevel=0, on_closed=lambda c: None, defer_retries=True
+    )
+    with pytest.raises(TryLater):
+        connector.check_category("http://mirror/pub/fedora/linux", directory, 17)
+
+
+def test_directory_sampling():
+    """Test the order and the sample of the files checked in a directory"""
+    files = {f"file-{i}.rpm": {"size": i, "stat": 1000 + i} for i in range(10)}
+    files["old.rpm"] = {"size": 1, "stat": None}
+    files["repomd.xml"] = {"size": 1, "stat": 1}
+    directory = DirectorySnapshot(
+        id=1,
+        name="pub/fedora/linux/releases/27/os",
+        readable=True,
+        ctime=100,
+        files=MappingProxyType(files),
+    )
+    ordered = [name for name, _filedata in order_files(directory.files)]
+    assert ordered[:3] == ["repomd.xml", "file-9.rpm", "file-8.rpm"]
+    assert ordered[-1] == "old.rpm"
+
+    sampler = DirectorySampler(2, rng=random.Random(42))
+    sampled = sampler.sample(directory)
+    assert sampled.name == directory.name
+    assert len(sampled.files) == 4
+    assert list(sampled.files)[:2] == ["repomd.xml", "file-9.rpm"]
+    assert set(sampled.files) < set(files)
+    # Small directories are checked entirely
+    assert DirectorySampler(6).sample(directory) is directory
+
+
+def test_trust_repodata(app, db, db_items):
+    """Test checking a sample of the Packages subtree of the up to date repositories"""
+    prefix = "pub/fedora/linux/releases/27/Everything"
+    names = [
+        f"{prefix}/aarch64/os/Packages/a",
+        f"{prefix}/aarch64/os/Packages/b",
+        f"{prefix}/aarch64/os/repodata",
+        f"{prefix}/x86_64/os",
+        f"{prefix}/x86_64/os/Packages",
+        f"{prefix}/x86_64/os/Packages/a",
+        f"{prefix}/x86_64/os/Packages/b",
+        f"{prefix}/x86_64/os/Packages/c",
+        f"{prefix}/x86_64/os/repodata",
+    ]
+    category = CategorySnapshot(
+        id=1,
+        name="Fedora Linux",
+        topdir_name="pub/fedora",
+        directories=tuple(_directory_snapshot(i, name, 100) for i, name in enumerate(names)),
+    )
+    assert get_packages_root(names[0]) == f"{prefix}/aarch64/os"
+    assert get_packages_root(names[4]) == f"{prefix}/x86_64/os"
+    assert get_packages_root(names[3]) is None
+
+    samples = RepositorySampler(2, rng=random.Random(42)).sample(category.get_directories())
+    assert sorted(samples) == [f"{prefix}/aarch64/os", f"{prefix}/x86_64/os"]
+    assert samples[f"{prefix}/x86_64/os"].repodata.name == names[-1]
+    assert len(samples[f"{prefix}/x86_64/os"].packages) == 2
+    assert samples[f"{prefix}/x86_64/os"].seen == 4
+
+    class FakeConnector:
+        def __init__(self, statuses):
+            self.statuses = statuses
+            self.checked = []
+
+        def check_category(self, url, directory, category_prefix_length):
+            self.checked.append(directory.name)
+            return self.statuses.get(directory.name, True)
+
+    hc = db.get(model.HostCategory, 3)
+    crawler = Crawler(app.config, db, {"host_timeout": None, "debug": False}, None, hc.host)
+    # The repomd.xml file of the aarch64 repository is not up to date
+    connector = FakeConnector({names[2]: False})
+    statuses, trusted = crawler._check_repositories(
+        connector, "http://mirror/pub/fedora", category, 11, RepositorySampler(2)
+    )
+    assert trusted == {f"{prefix}/x86_64/os"}
+    assert statuses[names[2]] is False
+    assert len(connector.checked) == 4
+    # A directory of the sample is not up to date
+    connector = FakeConnector({name: False for name in names[4:8]})
+    statuses, trusted = crawler._check_repositories(
+        connector, "http://mirror/pub/fedora", category, 11, RepositorySampler(2)
+    )
+    assert trusted == {f"{prefix}/aarch64/os"}
+    # The checksum of repomd.xml is not compared over FTP and RSYNC
+    for url in ("ftp://mirror/pub/fedora", "rsync://mirror/pub/fedora"):
+        connector = FakeConnector({})
+        statuses, trusted = crawler._check_repositories(
+            connector, url, category, 11, RepositorySampler(2)
+        )
+        assert statuses == {}
+        assert trusted == set()
+        assert connector.checked == []
+
+
+def test_listing_digest(app, db, db_items):
+    """Test skipping the categories that did not change since the last crawl"""
+    hc = db.get(model.HostCategory, 3)
+    directory = db.get(model.Directory, 4)
+    directory.files = {"repomd.xml": {"size": 42, "stat": 1500000000}}
+    db.commit()
+    snapshot = CrawlSnapshot.build(db, [hc.host_id])
+    category = snapshot.get_category(db, hc.category)
+    assert category.count_directories() > 0
+    assert category.ctimes_digest == DatabaseCategory(db, hc.category).ctimes_digest
+    # A directory changed on the master mirror
+    directory.ctime = (directory.ctime or 0) + 1
+    db.commit()
+    assert DatabaseCategory(db, hc.category).ctimes_digest != category.ctimes_digest
+
+    class FakeConnector:
+        def __init__(self, listing_digest):
+            self.listing_digest = listing_digest
+
+        def get_listing_digest(self, url):
+            return self.listing_digest
+
+    crawler = Crawler(app.config, db, {"host_timeout": None, "debug": False}, None, hc.host)
+    url = "rsync://mirror/fedora"
+    digest = ListingDigest(category.ctimes_digest)
+    crawler._check_listing_digest(hc, FakeConnector("abc"), url, digest)
+    assert digest.value is not None
+    hc.listing_digest = digest.value
+    with pytest.raises(CategoryUnchanged):
+        crawler._check_listing_digest(hc, FakeConnector("abc"), url, digest)
+    # The mirror changed
+    crawler._check_listing_digest(hc, FakeConnector("def"), url, digest)
+    # The category changed
+    digest = ListingDigest(DatabaseCategory(db, hc.category).ctimes_digest)
+    crawler._check_listing_digest(hc, FakeConnector("abc"), url, digest)
+    # No listing
+    crawler._check_listing_digest(hc, FakeConnector(None), url, digest)
+    assert digest.value is None
+
+    # The digest is cleared when the host is marked as not up to date
+    hc.host.set_not_up2date(db)
+    db.commit()
+    db.refresh(hc)
+    assert hc.listing_digest is None
+
+
+def test_database_writer(app, db, db_items):
+    """Test writing the changes of the crawler threads from a single thread"""
+    hc = db.get(model.HostCategory, 3)
+    directories = {d.id: d for d in db.scalars(sa.select(model.Directory))}
+    options = {"canary": False, "repodata": False}
+    writer = DatabaseWriter(app.config, options, max_pending=1, batch_size=10)
+
+    reconciler = HostCategoryDirReconciler(db, hc, hc.category.topdir.name)
+    reconciler.sync_dir(directories[4], True)
+    changes = reconciler.take_changes(mark_unseen_not_up2date=True)
+    # The HostCategoryDir from the fixture has not been seen
+    assert len(changes.unseen_ids) == 1
+    changes.values = {"last_verified": 42}
+    writer.put(changes)
+    writer.wait_for(hc.id)
+    result = CrawlResult(
+        host_id=hc.host_id,
+        host_name=hc.host.name,
+        status=CrawlStatus.OK.value,
+        details=None,
+        finished_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+        duration=10,
+    )
+    writer.put(result)
+    writer.stop()
+
+    db.expire_all()
+    assert hc.last_verified == 42
+    assert hc.host.last_crawled is not None
+    assert hc.host.last_crawl_duration == 10
+    hcds = {row.path: row.up2date for row in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)}
+    assert hcds == {"/releases/26": True, "pub/fedora/linux/releases/27": False}
+
+    # Once the writer is stopped, the changes are written right away
+    changes = HostCategoryDirReconciler(db, hc, hc.category.topdir.name).take_changes()
+    changes.values = {"last_verified": 43}
+    writer.put(changes)
+    db.expire_all()
+    assert hc.last_verified == 43
+
+
+def test_database_writer_batch_failed(app, db, db_items, monkeypatch):
+    """Test that the items of a failed batch are not written until they are written again"""
+    hc = db.get(model.HostCategory, 3)
+    options = {"canary": False, "repodata": False}
+    writer = DatabaseWriter(app.config, options, batch_size=10)
+    up2date_before_retry = []
+
+    def store_or_fail(config, options, session, crawl_result, commit=True):
+        if crawl_result.host_id != hc.host_id:
+            # The first item of the batch must not have been committed yet
+            up2date_before_retry.append(
+                db.scalars(
+                    sa.select(model.HostCategoryDir.up2date).where(
+                        model.HostCategoryDir.host_category_id == hc.id
+                    )
+                ).all()
+            )
+            raise ValueError("Could not write this one")
+        store_crawl_result(config, options, session, crawl_result, commit=commit)
+
+    monkeypatch.setattr("mirrormanager2.crawler.writer.store_crawl_result", store_or_fail)
+    results = [
+        CrawlResult(
+            host_id=host_id,
+            host_name=f"host-{host_id}",
+            status=CrawlStatus.TIMEOUT.value,
+            details="Timed out",
+            finished_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+            duration=10,
+        )
+        for host_id in (hc.host_id, 1)
+    ]
+    writer._write(results)
+
+    # Once for the batch, once for the item alone
+    assert len(up2date_before_retry) == 2
+    assert up2date_before_retry[0] == [True]
+    db.expire_all()
+    assert [hcd.up2date for hcd in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)] == [False]
+    assert hc.host.crawl_failures == 1
+
+
+def test_canary_engine(db, db_items, http_server):
+    hosts = CanaryHost.load(db, [2, 1, 404])
+    assert [host.id for host in hosts] == [2, 1]
+    host = hosts[1]
+    assert host.name == db.get(model.Host, 1).name
+    # The URLs with the same scheme are in no particular order
+    assert [sorted(urls) for urls in host.categories] == [
+        sorted(url for url in get_preferred_urls(hc) if url.startswith(("http:", "https:")))
+        for hc in sorted(db.get(model.Host, 1).categories, key=lambda hc: hc.id)
+    ]
+
+    http_server.files["/pub"] = b"index"
+    unreachable = "http://127.0.0.1:1/pub"
+    hosts = [
+        CanaryHost(id=1, name="up", categories=[[f"{http_server.url}/missing"]] * 2),
+        CanaryHost(
+            id=2,
+            name="fallback",
+            categories=[[unreachable], [f"{http_server.url}/missing", f"{http_server.url}/pub"]],
+        ),
+        CanaryHost(id=3, name="no-category"),
+        CanaryHost(id=4, name="always-up2date", categories=[[unreachable]], always_up2date=True),
+        CanaryHost(id=5, name="down", categories=[[unreachable], [f"{unreachable}/other"]]),
+    ]
+    hosts[0].categories.append([f"{http_server.url}/pub"])
+    seen = []
+    results, timed_out = CanaryEngine(concurrency=2).run(hosts, on_result=seen.append)
+    assert not timed_out
+    assert sorted(result.host_id for result in seen) == [1, 2, 3, 4, 5]
+    assert [(result.host_name, result.status) for result in results] == [
+        ("up", "OK"),
+        ("fallback", "OK"),
+        ("no-category", "UNKNOWN"),
+        ("always-up2date", "OK"),
+        ("down", "FAILURE"),
+    ]
+    assert results[4].details == CANARY_FAILED_DETAILS
+
+
+def test_record_canary_atomic(app, db, db_items, monkeypatch):
+    """Test that the results of a canary crawl are written all at once or not at all"""
+    hc = db.get(model.HostCategory, 3)
+    options = {"canary": True, "repodata": False}
+    results = [
+        CrawlResult(
+            host_id=host_id,
+            host_name=f"host-{host_id}",
+            status=CrawlStatus.FAILURE.value,
+            details=CANARY_FAILED_DETAILS,
+            finished_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+            duration=1,
+        )
+        for host_id in (hc.host_id, 1)
+    ]
+
+    def store_or_fail(config, options, session, crawl_result, commit=True):
+        if crawl_result.host_id != hc.host_id:
+            raise ValueError("Could not write this one")
+        store_crawl_result(config, options, session, crawl_result, commit=commit)
+
+    monkeypatch.setattr("mirrormanager2.crawler.cli.store_crawl_result", store_or_fail)
+    ctx_obj = {"console": Console(file=io.StringIO()), "config": app.config}
+    with pytest.raises(ValueError):
+        record_canary(ctx_obj, options, results)
+
+    # The host of the first result has not been marked as not up2date
+    db.expire_all()
+    assert [hcd.up2date for hcd in mmlib.get_hostcategorydirs_by_hostcategory(db, hc)] == [True]
+    assert hc.host.last_crawled is None
+
+
+def test_memory_ceiling():
+    metrics.reset()
+    assert MemoryCeiling.from_options({}, {"threads": 4, "processes": 1}) is None
+    ceiling = MemoryCeiling.from_options(
+        {"CRAWLER_WORKER_MEMORY_LIMIT": 1}, {"threads": 4, "processes": 2}
+    )
+    assert ceiling.limit == 2 * 1024 * 1024
+    # The test process uses more than that
+    assert ceiling.check("testing")
+    assert metrics.export()["counters"]["memory_ceiling_exceeded_total"] == {(): 1}
+    assert not MemoryCeiling(1024 * 1024).check("testing")
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_host_log_router(tmp_path, compress):
+    """Test writing the logs of each host to its own file with a single handler"""
+    router = HostLogRouter(max_open_files=1, compress=compress)
+    router.setFormatter(logging.Formatter("%(message)s"))
+    test_logger = logging.getLogger("test_host_log_router")
+    test_logger.addHandler(router)
+    test_logger.setLevel(logging.DEBUG)
+    paths = {host_id: tmp_path / f"{host_id}.log" for host_id in (1, 2)}
+    router.add_host(1, paths[1], logging.INFO)
+    router.add_host(2, paths[2], logging.DEBUG)
+
+    def _log_as_host(host_id, *messages):
+        on_thread_started(host_id=host_id, host_name=f"mirror-{host_id}")
+        for level, message in messages:
+            test_logger.log(level, message)
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            executor.submit(
+                _log_as_host, 1, (logging.INFO, "one"), (logging.DEBUG, "debug one")
+            ).result()
+            # The file of the first host is closed to open this one
+            executor.submit(_log_as_host, 2, (logging.DEBUG, "debug two")).result()
+            executor.submit(_log_as_host, 1, (logging.WARNING, "one again")).result()
+            # Not crawling
+            executor.submit(_log_as_host, 3, (logging.WARNING, "three")).result()
+        router.remove_host(2)
+        _log_as_host(2, (logging.INFO, "after the crawl"))
+    finally:
+        test_logger.removeHandler(router)
+        router.close()
+
+    def _read(path):
+        if compress:
+            with gzip.open(path, "rt") as log:
+                return log.read()
+        return path.read_text()
+
+    assert _read(paths[1]) == "one\none again\n"
+    assert _read(paths[2]) == "debug two\n"
+    assert not (tmp_path / "3.log").exists()
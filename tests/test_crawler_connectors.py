@@ -0,0 +1,574 @@
+"""
+mirrormanager2 tests for the crawler connectors.
+"""
+
+import dataclasses
+import hashlib
+import json
+import socket
+
+import pytest
+
+from mirrormanager2.crawler import rsync_connector as rsync_connector_module
+from mirrormanager2.crawler.autoindex import (
+    ListedFile,
+    detect_autoindex_format,
+    parse_autoindex,
+)
+from mirrormanager2.crawler.connection_pool import HTTP_ENGINES, ConnectionPool
+from mirrormanager2.crawler.connector import SchemeNotAvailable
+from mirrormanager2.crawler.ftp_connector import RecursiveFTPListing, parse_list_line
+from mirrormanager2.crawler.http_pool import DNSCache, SharedHTTPPool
+from mirrormanager2.crawler.listing import ListingTooLarge
+from mirrormanager2.crawler.metrics import metrics
+from mirrormanager2.crawler.propagation import PropagationCache
+from mirrormanager2.crawler.rsync_listing import RsyncListing
+from mirrormanager2.crawler.snapshot import DirectorySnapshot
+from mirrormanager2.crawler.threads import on_thread_started
+from mirrormanager2.lib import model
+
+REPOMD = b"<repomd>the repo metadata</repomd>"
+
+
+@pytest.fixture()
+def repo_directory(db):
+    directory = model.Directory(
+        name="pub/fedora/linux/releases/26/Everything/x86_64/os/repodata",
+        readable=True,
+        files={
+            "repomd.xml": {"size": len(REPOMD), "stat": 1500000000},
+            "primary.xml.gz": {"size": 4, "stat": 1500000000},
+            "other.xml.gz": {"size": 5, "stat": 1500000000},
+        },
+    )
+    db.add(directory)
+    db.flush()
+    db.add(
+        model.FileDetail(
+            filename="repomd.xml",
+            directory_id=directory.id,
+            timestamp=1500000000,
+            size=len(REPOMD),
+            sha256=hashlib.sha256(REPOMD).hexdigest(),
+        )
+    )
+    db.commit()
+    return DirectorySnapshot.from_directory(db, directory)
+
+
+@pytest.fixture()
+def repo_files(http_server):
+    prefix = "/releases/26/Everything/x86_64/os/repodata"
+    http_server.files.update(
+        {
+            f"{prefix}/repomd.xml": REPOMD,
+            f"{prefix}/primary.xml.gz": b"1234",
+            f"{prefix}/other.xml.gz": b"12345",
+        }
+    )
+    return prefix
+
+
+@pytest.fixture(params=HTTP_ENGINES)
+def http_connector(request, http_server):
+    pool = ConnectionPool({}, max_connections=4, http_engine=request.param)
+    yield pool.get(http_server.url)
+    pool.close_all()
+
+
+def test_http_check_dir_up2date(http_server, http_connector, repo_directory, repo_files):
+    assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is True
+    requested = {(method, path.rsplit("/", 1)[-1]) for method, path in http_server.requests}
+    assert requested == {
+        ("HEAD", "repomd.xml"),
+        ("HEAD", "primary.xml.gz"),
+        ("HEAD", "other.xml.gz"),
+        ("GET", "repomd.xml"),
+    }
+
+
+def test_http_check_dir_missing_file(http_server, http_connector, repo_directory, repo_files):
+    del http_server.files[f"{repo_files}/other.xml.gz"]
+    assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is False
+
+
+def test_http_check_dir_wrong_size(http_server, http_connector, repo_directory, repo_files):
+    http_server.files[f"{repo_files}/primary.xml.gz"] = b"123"
+    assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is False
+
+
+def test_http_check_dir_wrong_checksum(http_server, http_connector, repo_directory, repo_files):
+    http_server.files[f"{repo_files}/repomd.xml"] = REPOMD.upper()
+    assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is False
+
+
+def test_http_check_dir_checksum_failed(http_server, http_connector, repo_directory, repo_files):
+    # The file exists but it can't be downloaded
+    http_server.get_errors[f"{repo_files}/repomd.xml"] = 403
+    assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is False
+
+
+@pytest.mark.parametrize("readable,expected", [(True, False), (False, None)])
+def test_http_check_dir_forbidden(
+    http_server, http_connector, repo_directory, repo_files, readable, expected
+):
+    directory = dataclasses.replace(repo_directory, readable=readable)
+    http_server.files[f"{repo_files}/other.xml.gz"] = 403
+    result = http_connector.check_dir(f"{http_server.url}{repo_files}", directory)
+    assert result is expected
+
+
+def test_http_check_url(http_server, http_connector, repo_files):
+    assert http_connector.check_url(f"{http_server.url}{repo_files}/repomd.xml") is True
+    assert http_connector.check_url(f"{http_server.url}/does-not-exist") is False
+
+
+def test_http_get_sha256_cached(tmp_path, http_server, http_connector, repo_files):
+    url = f"{http_server.url}{repo_files}/repomd.xml"
+    cache = PropagationCache.load(tmp_path.joinpath("propagation.json"))
+    assert len(cache) == 0
+    expected = hashlib.sha256(REPOMD).hexdigest()
+    assert http_connector.get_sha256_cached(url, cache) == expected
+    assert cache.get(url)["sha256"] == expected
+    cache.save()
+    # The file has not changed, the checksum comes from the cache
+    cache = PropagationCache.load(cache.path)
+    cache.set(url, "cached-checksum", etag=cache.get(url)["etag"])
+    assert http_connector.get_sha256_cached(url, cache) == "cached-checksum"
+    # The file has changed
+    changed = REPOMD.upper()
+    http_server.files[f"{repo_files}/repomd.xml"] = changed
+    assert http_connector.get_sha256_cached(url, cache) == hashlib.sha256(changed).hexdigest()
+
+
+def test_http_shared_pool(http_server, repo_directory, repo_files):
+    metrics.reset()
+    shared_pool = SharedHTTPPool(max_connections=2, idle_timeout=0)
+    # Two hosts on the same server
+    pools = [ConnectionPool({}, shared_pool=shared_pool) for _i in range(2)]
+    connectors = [pool.get(http_server.url) for pool in pools]
+    for connector in connectors:
+        assert connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is True
+    adapters = {
+        connector.get_connection().get_adapter(f"{http_server.url}/") for connector in connectors
+    }
+    assert len(adapters) == 1
+    # The host name was only resolved once
+    resolutions = metrics.export()["histograms"]["dns_duration_seconds"].values()
+    assert sum(histogram.count for histogram in resolutions) == 1
+
+    # Still used by the other host
+    pools[0].close_all()
+    adapter = adapters.pop()
+    assert shared_pool.acquire("http", connectors[0]._netloc) is adapter
+    shared_pool.release("http", connectors[0]._netloc)
+    pools[1].close_all()
+    # Idle for longer than the timeout
+    assert shared_pool.acquire("http", connectors[0]._netloc) is not adapter
+    shared_pool.close_all()
+
+
+def test_dns_cache_family(monkeypatch):
+    infos = [
+        (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("2001:db8::1", 80, 0, 0)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 80)),
+    ]
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: infos)
+    assert DNSCache("ipv4").resolve("mirror.example.com", 80) == ["192.0.2.1", "2001:db8::1"]
+    assert DNSCache("ipv6").resolve("mirror.example.com", 80) == ["2001:db8::1", "192.0.2.1"]
+    with pytest.raises(ValueError):
+        DNSCache("ipx")
+
+
+def test_propagation_cache_expiry(tmp_path):
+    cache = PropagationCache(tmp_path.joinpath("propagation.json"), max_age=3600)
+    cache.set("http://mirror/old/repomd.xml", "old", etag='"old"')
+    cache.set("http://mirror/new/repomd.xml", "new", last_modified="Wed, 05 Jul 2017 10:00:00 GMT")
+    # Without ETag or Last-Modified the file can't be requested conditionally
+    cache.set("http://mirror/none/repomd.xml", "none")
+    cache.get("http://mirror/old/repomd.xml")["checked_at"] -= 7200
+    cache.save()
+    cache = PropagationCache.load(cache.path)
+    assert len(cache) == 1
+    assert cache.get("http://mirror/new/repomd.xml")["sha256"] == "new"
+
+
+RSYNC_LISTING = """\
+drwxr-xr-x 4,096 2017/07/05 10:00:00 .
+drwxr-xr-x 4,096 2017/07/05 10:00:00 releases/26/Everything/x86_64/os/repodata
+-rw-r--r-- 34 2017/07/05 10:00:00 releases/26/Everything/x86_64/os/repodata/repomd.xml
+-rw-r--r-- 4 2017/07/05 10:00:00 releases/26/Everything/x86_64/os/repodata/primary.xml.gz
+lrwxrwxrwx 9 2017/07/05 10:00:00 releases/26/Everything/x86_64/os/repodata/other.xml.gz -> o
+-rw-r--r-- 12,345 2017/07/05 10:00:00 releases/26/Everything/x86_64/os/file with spaces.txt
+invalid line
+"""
+
+
+def test_rsync_listing():
+    listing = RsyncListing()
+    for line in RSYNC_LISTING.splitlines(keepends=True):
+        listing.parse_line(line)
+    # The directories are not stored
+    assert len(listing) == 4
+    assert listing.invalid_lines == 1
+    repodata = listing.get_directory("releases/26/Everything/x86_64/os/repodata")
+    assert repodata.get("repomd.xml") == (34, False)
+    assert repodata.get("other.xml.gz") == (9, True)
+    assert repodata.get("filelists.xml.gz") is None
+    os_dir = listing.get_directory("releases/26/Everything/x86_64/os")
+    assert os_dir.get("file with spaces.txt") == (12345, False)
+    assert listing.get_directory("releases/27") is None
+
+
+def test_rsync_listing_max_entries():
+    listing = RsyncListing(max_entries=2)
+    listing.add("a/b", 1)
+    listing.add("a/c", 1)
+    # Replacing an entry does not count
+    listing.add("a/c", 2)
+    with pytest.raises(ListingTooLarge):
+        listing.add("a/d", 1)
+
+
+def test_rsync_listing_digest():
+    lines = RSYNC_LISTING.splitlines(keepends=True)[:-1]
+
+    def _digest(lines):
+        listing = RsyncListing()
+        for line in lines:
+            listing.parse_line(line)
+        return listing.digest
+
+    digest = _digest(lines)
+    # The column alignment and the thousands separators don't matter
+    assert _digest([line.replace(" ", "    ", 1).replace(",", ".") for line in lines]) == digest
+    # A file changed
+    assert _digest(lines[:-1] + [lines[-1].replace("12,345", "12,346")]) != digest
+    # A directory was added
+    assert _digest(lines + ["drwxr-xr-x 4,096 2017/07/05 10:00:00 releases/27\n"]) != digest
+
+
+@pytest.fixture()
+def rsync_connector(monkeypatch):
+    def _stream_rsync(url, callback, *args, **kwargs):
+        for line in RSYNC_LISTING.splitlines(keepends=True):
+            callback(line)
+        return 0
+
+    monkeypatch.setattr(rsync_connector_module, "stream_rsync", _stream_rsync)
+    pool = ConnectionPool({"CRAWLER_RSYNC_PARAMETERS": "--no-motd"})
+    yield pool.get("rsync://rsync.example.com/fedora/")
+    pool.close_all()
+
+
+def test_rsync_check_category(rsync_connector, repo_directory):
+    url = "rsync://rsync.example.com/fedora"
+    prefix_length = len("pub/fedora/linux/")
+    # The symlink size is not checked
+    assert rsync_connector.check_category(url, repo_directory, prefix_length) is True
+    wrong_size = dataclasses.replace(
+        repo_directory,
+        files={**repo_directory.files, "primary.xml.gz": {"size": 5, "stat": 1500000000}},
+    )
+    assert rsync_connector.check_category(url, wrong_size, prefix_length) is False
+    missing = dataclasses.replace(
+        repo_directory,
+        files={**repo_directory.files, "filelists.xml.gz": {"size": 5, "stat": 1500000000}},
+    )
+    assert rsync_connector.check_category(url, missing, prefix_length) is False
+
+
+def test_rsync_get_listing_digest(rsync_connector, monkeypatch):
+    url = "rsync://rsync.example.com/fedora"
+    # The listing has an invalid line, it may not be complete
+    assert rsync_connector.get_listing_digest(url) is None
+
+    def _stream_rsync(url, callback, *args, **kwargs):
+        for line in RSYNC_LISTING.splitlines(keepends=True)[:-1]:
+            callback(line)
+        return 0
+
+    monkeypatch.setattr(rsync_connector_module, "stream_rsync", _stream_rsync)
+    rsync_connector.close()
+    assert len(rsync_connector.get_listing_digest(url)) == 64
+
+
+def test_rsync_check_category_too_large(rsync_connector, repo_directory):
+    rsync_connector._config["CRAWLER_LISTING_MAX_ENTRIES"] = 2
+    with pytest.raises(SchemeNotAvailable):
+        rsync_connector.check_category(
+            "rsync://rsync.example.com/fedora", repo_directory, len("pub/fedora/linux/")
+        )
+
+
+NGINX_INDEX = """<html>
+<head><title>Index of /repodata/</title></head>
+<body>
+<h1>Index of /repodata/</h1><hr><pre><a href="../">../</a>
+<a href="drpms/">drpms/</a>                    05-Jul-2017 10:00       -
+<a href="repomd.xml">repomd.xml</a>                05-Jul-2017 10:00      34
+<a href="primary.xml.gz">primary.xml.gz</a>            05-Jul-2017 10:00       4
+<a href="other%20file.gz">other file.gz</a>             05-Jul-2017 10:00      1K
+</pre><hr></body>
+</html>
+"""
+
+APACHE_INDEX = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">
+<html><head><title>Index of /repodata</title></head><body>
+<h1>Index of /repodata</h1>
+<table>
+<tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=S;O=A">Size</a></th></tr>
+<tr><td><a href="/releases/">Parent Directory</a></td><td align="right">  - </td></tr>
+<tr><td><a href="drpms/">drpms/</a></td><td align="right">2017-07-05 10:00  </td>
+<td align="right">  - </td></tr>
+<tr><td><a href="repomd.xml">repomd.xml</a></td><td align="right">2017-07-05 10:00  </td>
+<td align="right"> 34 </td></tr>
+<tr><td><a href="primary.xml.gz">primary.xml.gz</a></td>
+<td align="right">2017-07-05 10:00  </td><td align="right">4 </td><td>2 packages</td></tr>
+<tr><td><a href="other%20file.gz">other file.gz</a></td>
+<td align="right">2017-07-05 10:00  </td><td align="right">1.2K</td></tr>
+</table>
+<address>Apache/2.4.6 (CentOS) Server at mirror.example.com Port 80</address>
+</body></html>
+"""
+
+LIGHTTPD_INDEX = """<!DOCTYPE html>
+<html><head><title>Index of /repodata/</title></head>
+<body><h2>Index of /repodata/</h2>
+<div class="list"><table summary="Directory Listing">
+<tbody>
+<tr class="d"><td class="n"><a href="../">..</a>/</td><td class="m">&nbsp;</td>
+<td class="s">- &nbsp;</td><td class="t">Directory</td></tr>
+<tr class="d"><td class="n"><a href="drpms/">drpms</a>/</td>
+<td class="m">2017-Jul-05 10:00:00</td><td class="s">- &nbsp;</td><td class="t">Directory</td></tr>
+<tr><td class="n"><a href="repomd.xml">repomd.xml</a></td>
+<td class="m">2017-Jul-05 10:00:00</td><td class="s">34</td><td class="t">text/xml</td></tr>
+<tr><td class="n"><a href="primary.xml.gz">primary.xml.gz</a></td>
+<td class="m">2017-Jul-05 10:00:00</td><td class="s">4</td><td class="t">application/gzip</td></tr>
+<tr><td class="n"><a href="other%20file.gz">other file.gz</a></td>
+<td class="m">2017-Jul-05 10:00:00</td><td class="s">1.2K</td><td class="t">text/plain</td></tr>
+</tbody></table></div>
+<div class="foot">lighttpd/1.4.59</div>
+</body></html>
+"""
+
+NGINX_JSON_INDEX = """[
+{ "name":"drpms", "type":"directory", "mtime":"Wed, 05 Jul 2017 10:00:00 GMT" },
+{ "name":"repomd.xml", "type":"file", "mtime":"Wed, 05 Jul 2017 10:00:00 GMT", "size":34 },
+{ "name":"primary.xml.gz", "type":"file", "mtime":"Wed, 05 Jul 2017 10:00:00 GMT", "size":4 },
+{ "name":"other file.gz", "type":"file", "mtime":"Wed, 05 Jul 2017 10:00:00 GMT", "size":1234 }
+]"""
+
+
+@pytest.mark.parametrize(
+    "content_type,body,expected_format",
+    [
+        ("text/html", NGINX_INDEX, "nginx"),
+        ("text/html", APACHE_INDEX, "apache"),
+        ("text/html", LIGHTTPD_INDEX, "lighttpd"),
+        ("application/json", NGINX_JSON_INDEX, "json"),
+    ],
+    ids=["nginx", "apache", "lighttpd", "json"],
+)
+def test_parse_autoindex(content_type, body, expected_format):
+    autoindex_format = detect_autoindex_format(content_type, body)
+    assert autoindex_format == expected_format
+    listing = parse_autoindex(body, autoindex_format)
+    # The directories are not listed
+    assert set(listing) == {"repomd.xml", "primary.xml.gz", "other file.gz"}
+    assert listing["repomd.xml"] == ListedFile(size=34)
+    assert listing["primary.xml.gz"].matches(4)
+    assert not listing["primary.xml.gz"].matches(5)
+    # The human-readable sizes are approximate
+    assert listing["other file.gz"].matches(1234)
+    assert not listing["other file.gz"].matches(100000)
+
+
+def test_detect_autoindex_format_unknown():
+    assert detect_autoindex_format("text/html", "<html><body>Welcome!</body></html>") is None
+
+
+@pytest.fixture(params=HTTP_ENGINES)
+def autoindex_connector(request, http_server):
+    pool = ConnectionPool({}, max_connections=4, http_engine=request.param, autoindex=True)
+    yield pool.get(http_server.url)
+    pool.close_all()
+
+
+def _index_page(sizes):
+    lines = [f'<a href="{name}">{name}</a>  05-Jul-2017 10:00  {size}' for name, size in sizes]
+    return "\n".join(
+        ["<html><head><title>Index of /</title></head><body><h1>Index of /</h1><hr><pre>"]
+        + lines
+        + ["</pre><hr></body></html>"]
+    ).encode()
+
+
+def test_http_check_dir_autoindex(http_server, autoindex_connector, repo_directory, repo_files):
+    index = [("repomd.xml", len(REPOMD)), ("primary.xml.gz", 4), ("other.xml.gz", 5)]
+    http_server.files[f"{repo_files}/"] = _index_page(index)
+    url = f"{http_server.url}{repo_files}"
+    assert autoindex_connector.check_dir(url, repo_directory) is True
+    # One request for the listing, one for the checksum of repomd.xml
+    assert sorted(http_server.requests) == [
+        ("GET", f"{repo_files}/"),
+        ("GET", f"{repo_files}/repomd.xml"),
+    ]
+
+    # Wrong size in the listing
+    http_server.files[f"{repo_files}/"] = _index_page(index[:2] + [("other.xml.gz", 6)])
+    assert autoindex_connector.check_dir(url, repo_directory) is False
+
+    # Files that are not listed are checked one by one
+    http_server.requests.clear()
+    http_server.files[f"{repo_files}/"] = _index_page(index[:2])
+    assert autoindex_connector.check_dir(url, repo_directory) is True
+    assert ("HEAD", f"{repo_files}/other.xml.gz") in http_server.requests
+    assert ("HEAD", f"{repo_files}/primary.xml.gz") not in http_server.requests
+
+    # The files listed with a rounded size are checked one by one too
+    http_server.requests.clear()
+    http_server.files[f"{repo_files}/"] = _index_page(index[:2] + [("other.xml.gz", "0.1K")])
+    assert autoindex_connector.check_dir(url, repo_directory) is True
+    assert ("HEAD", f"{repo_files}/other.xml.gz") in http_server.requests
+    # Truncated
+    http_server.files[f"{repo_files}/other.xml.gz"] = b"123"
+    assert autoindex_connector.check_dir(url, repo_directory) is False
+
+
+def test_http_check_dir_no_autoindex(http_server, autoindex_connector, repo_directory, repo_files):
+    http_server.files[f"{repo_files}/"] = 403
+    url = f"{http_server.url}{repo_files}"
+    assert autoindex_connector.check_dir(url, repo_directory) is True
+    assert ("HEAD", f"{repo_files}/other.xml.gz") in http_server.requests
+    # The host has no directory index, don't try again
+    http_server.requests.clear()
+    assert autoindex_connector.check_dir(url, repo_directory) is True
+    assert ("GET", f"{repo_files}/") not in http_server.requests
+
+
+def test_ftp_parse_list_line():
+    line = "-rw-r--r--    1 ftp      ftp          4321 Jul 05  2017 file with spaces.txt"
+    assert parse_list_line(line) == ("file with spaces.txt", 4321, "file")
+    line = "lrwxrwxrwx    1 ftp      ftp             4 Jul 05 10:00 link -> file"
+    assert parse_list_line(line) == ("link", None, "link")
+    line = "drwxr-xr-x    2 ftp      ftp          4096 Jul 05  2017 repodata"
+    assert parse_list_line(line) == ("repodata", None, "dir")
+    assert parse_list_line("total 42") is None
+
+
+def test_ftp_recursive_listing():
+    listing = RecursiveFTPListing("/pub/fedora/linux")
+    for line in [
+        ".:",
+        "total 8",
+        "drwxr-xr-x    2 ftp      ftp          4096 Jul 05  2017 releases",
+        "-rw-r--r--    1 ftp      ftp            12 Jul 05  2017 README",
+        "",
+        "./releases/26:",
+        "-rw-r--r--    1 ftp      ftp          4321 Jul 05  2017 file with spaces",
+        "",
+        "/pub/fedora/linux/releases/27:",
+        "-rw-r--r--    1 ftp      ftp             1 Jul 05  2017 other",
+        "lrwxrwxrwx    1 ftp      ftp             5 Jul 05 10:00 latest -> other",
+    ]:
+        listing.parse_line(line)
+    assert listing.is_complete
+    assert len(listing) == 4
+    assert listing.get_directory("").get("README") == (12, False)
+    assert listing.get_directory("releases/26").get("file with spaces") == (4321, False)
+    assert listing.get_directory("releases/27").get("other") == (1, False)
+    assert listing.get_directory("releases/27").get("latest") == (0, True)
+    # The size of the symlinks is not checked
+    assert listing.check_directory("releases/27", {"latest": {"size": 1234}}) is True
+
+    # The server ignored -R
+    listing = RecursiveFTPListing("/pub")
+    listing.parse_line("drwxr-xr-x    2 ftp      ftp          4096 Jul 05  2017 releases")
+    assert not listing.is_complete
+
+
+@pytest.fixture()
+def ftp_files(ftp_server):
+    prefix = "/pub/fedora/linux/releases/26/Everything/x86_64/os/repodata"
+    ftp_server.files.update(
+        {
+            f"{prefix}/repomd.xml": REPOMD,
+            f"{prefix}/primary.xml.gz": b"1234",
+            f"{prefix}/other.xml.gz": b"12345",
+        }
+    )
+    return prefix
+
+
+@pytest.fixture(params=[False, True], ids=["per-directory", "recursive"])
+def ftp_connector(request, ftp_server):
+    pool = ConnectionPool({}, ftp_recursive=request.param)
+    yield pool.get(ftp_server.url)
+    pool.close_all()
+
+
+@pytest.mark.parametrize("mlsd", [True, False])
+def test_ftp_check_category(ftp_server, ftp_connector, ftp_files, repo_directory, mlsd):
+    ftp_server.mlsd = mlsd
+    url = f"{ftp_server.url}/pub/fedora/linux"
+    prefix_length = len("pub/fedora/linux/")
+    assert ftp_connector.check_category(url, repo_directory, prefix_length) is True
+    commands = {command for command, _arg in ftp_server.commands}
+    if ftp_connector.recursive:
+        assert ("LIST", "-R") in ftp_server.commands
+        assert "MLSD" not in commands
+    else:
+        assert ("MLSD" in commands) is mlsd
+
+    del ftp_server.files[f"{ftp_files}/other.xml.gz"]
+    ftp_connector._scan_results.clear()
+    assert ftp_connector.check_category(url, repo_directory, prefix_length) is False
+
+    ftp_server.files[f"{ftp_files}/other.xml.gz"] = b"123456"
+    ftp_connector._scan_results.clear()
+    assert ftp_connector.check_category(url, repo_directory, prefix_length) is False
+
+
+def test_ftp_check_category_recursive_not_supported(ftp_server, ftp_files, repo_directory):
+    ftp_server.recursive = False
+    pool = ConnectionPool({}, ftp_recursive=True)
+    connector = pool.get(ftp_server.url)
+    url = f"{ftp_server.url}/pub/fedora/linux"
+    prefix_length = len("pub/fedora/linux/")
+    assert connector.check_category(url, repo_directory, prefix_length) is True
+    # It fell back to listing the directory
+    assert ("MLSD", f"/pub/fedora/linux/{repo_directory.name[prefix_length:]}") in (
+        ftp_server.commands
+    )
+    pool.close_all()
+
+
+def test_metrics(tmp_path, http_server, http_connector, repo_directory, repo_files):
+    metrics.reset()
+    on_thread_started(host_id=1, host_name="mirror.example.com")
+    try:
+        assert http_connector.check_dir(f"{http_server.url}{repo_files}", repo_directory) is True
+    finally:
+        on_thread_started(host_id=None, host_name=None)
+    metrics.set("run_hosts", 1, mode="full")
+    metrics.write(
+        textfile_path=tmp_path.joinpath("crawler.prom"),
+        json_path=tmp_path.joinpath("crawler.json"),
+    )
+
+    textfile = tmp_path.joinpath("crawler.prom").read_text()
+    labels = 'host="mirror.example.com",method="HEAD",protocol="http"'
+    assert f"mirrormanager_crawler_requests_total{{{labels}}} 3" in textfile
+    assert f"mirrormanager_crawler_request_duration_seconds_count{{{labels}}} 3" in textfile
+    assert (
+        f'mirrormanager_crawler_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in textfile
+    )
+    assert "# TYPE mirrormanager_crawler_request_duration_seconds histogram" in textfile
+    assert 'mirrormanager_crawler_run_hosts{mode="full"} 1' in textfile
+
+    summary = json.loads(tmp_path.joinpath("crawler.json").read_text())
+    host = summary["hosts"]["mirror.example.com"]
+    assert host["method=GET,protocol=http"]["requests_total"] == 1
+    assert host["protocol=http"]["received_bytes_total"] == len(REPOMD)
+    assert summary["run"] == {"mode=full": {"run_hosts": 1}}
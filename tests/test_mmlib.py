@@ -823,3 +823,31 @@ def test_get_file_detail(db, directory, filedetail):
     results = mirrormanager2.lib.get_file_detail(db, "repomd.xml", 7, timestamp=1357758825)
     assert results.md5 == "foo_md5"
     assert results.directory.name == "pub/fedora/linux/updates/testing/25/x86_64"
+
+
+def test_get_recent_sha256_timestamps(db, directory, filedetail):
+    """Test the get_recent_sha256_timestamps function of
+    mirrormanager2.lib.
+    """
+    for timestamp, sha256 in [
+        (1357758825 - 5 * 86400, "old_sha256"),
+        (1357758825 - 3600, "foo_sha256"),
+        (1357758825 + 3600, "new_sha256"),
+    ]:
+        db.add(
+            mirrormanager2.lib.model.FileDetail(
+                filename="repomd.xml", directory_id=7, timestamp=timestamp, sha256=sha256
+            )
+        )
+    db.commit()
+    latest = mirrormanager2.lib.get_file_detail(db, "repomd.xml", 7, reverse=True)
+    results = mirrormanager2.lib.get_recent_sha256_timestamps(
+        db, [7, 8, 42], "repomd.xml", max_age=4 * 86400
+    )
+    assert sorted(results) == [7, 8]
+    assert results[7] == (
+        latest.id,
+        {"foo_sha256": 1357758825, "new_sha256": 1357758825 + 3600},
+    )
+    assert results[8][1] == {"foo2_sha256": 1357758826}
+    assert mirrormanager2.lib.get_recent_sha256_timestamps(db, [], "repomd.xml", 3600) == {}
@@ -2,6 +2,7 @@
 mirrormanager2 tests for the Flask application.
 """
 
+import gzip
 import os
 
 import pytest
@@ -1349,3 +1350,25 @@ def test_toggle_private_flag_site_auth_more(client, user, hostcategorydir_even_m
     data = output.get_data(as_text=True)
     # Make sure the host_category_directory is gone
     assert "pub/fedora/linux/updates/testing/27/x86_64" not in data
+
+
+def test_crawler_log(app, client, tmp_path):
+    """Test the crawler logs, compressed or not."""
+    app.config["MM_LOG_DIR"] = tmp_path.as_posix()
+    log_dir = tmp_path / "crawler"
+    log_dir.mkdir()
+    (log_dir / "1.log").write_text("plain log\n")
+    output = client.get("/crawler/1.log")
+    assert output.status_code == 200
+    assert output.get_data(as_text=True) == "plain log\n"
+
+    # Two runs appended to the same compressed file
+    for line in ("first run\n", "second run\n"):
+        with gzip.open(log_dir / "2.log.gz", "at") as log:
+            log.write(line)
+    output = client.get("/crawler/2.log")
+    assert output.status_code == 200
+    assert output.get_data(as_text=True) == "first run\nsecond run\n"
+
+    output = client.get("/crawler/3.log")
+    assert output.status_code == 404